@@ -0,0 +1,108 @@
+"""Added content hashes to value tables, and merged duplicate values.
+
+Revision ID: 17ba2b76608d
+Revises: 3f104ae31250
+Create Date: 2026-10-18 14:30:12.118305
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '17ba2b76608d'
+down_revision = '3f104ae31250'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+# The hashes must match bbschema.entity.hash_value_key
+VALUE_TABLES = [
+    # (table, primary key, value columns, hash expression, join tables,
+    #  referencing columns)
+    (
+        'alias', 'alias_id', ['name', 'sort_name', 'language_id', '"primary"'],
+        "md5(concat_ws(E'\\x1f', name, sort_name, "
+        "coalesce(language_id::text, ''), \"primary\"::text))",
+        [('entity_data__alias', 'entity_data_id')],
+        [('entity_data', 'default_alias_id')]
+    ),
+    (
+        'identifier', 'identifier_id', ['identifier_type_id', 'value'],
+        "md5(concat_ws(E'\\x1f', identifier_type_id::text, value))",
+        [('entity_data__identifier', 'entity_data_id')],
+        []
+    ),
+    (
+        'annotation', 'annotation_id', ['content'], 'md5(content)',
+        [],
+        [('entity_data', 'annotation_id')]
+    ),
+    (
+        'disambiguation', 'disambiguation_id', ['comment'], 'md5(comment)',
+        [],
+        [('entity_data', 'disambiguation_id')]
+    ),
+]
+
+
+def merge_duplicates(table, id_column, columns, join_tables, references):
+    # Map each duplicate to the value with the same content and lowest ID
+    op.execute(
+        'CREATE TEMPORARY TABLE duplicate_{0} AS '
+        'SELECT {1} AS old_id, canonical_id FROM ('
+        '  SELECT {1}, min({1}) OVER ('
+        '    PARTITION BY content_hash, {2}'
+        '  ) AS canonical_id FROM bookbrainz.{0}'
+        ') AS value WHERE {1} <> canonical_id'.format(
+            table, id_column, ', '.join(columns)
+        )
+    )
+
+    for join_table, other_column in join_tables:
+        op.execute(
+            'INSERT INTO bookbrainz.{0} ({1}, {2}) '
+            'SELECT DISTINCT j.{1}, d.canonical_id '
+            'FROM bookbrainz.{0} j JOIN duplicate_{3} d ON j.{2} = d.old_id '
+            'WHERE NOT EXISTS ('
+            '  SELECT 1 FROM bookbrainz.{0} k '
+            '  WHERE k.{1} = j.{1} AND k.{2} = d.canonical_id'
+            ')'.format(join_table, other_column, id_column, table)
+        )
+        op.execute(
+            'DELETE FROM bookbrainz.{0} j USING duplicate_{1} d '
+            'WHERE j.{2} = d.old_id'.format(join_table, table, id_column)
+        )
+
+    for referencing_table, column in references:
+        op.execute(
+            'UPDATE bookbrainz.{0} SET {1} = d.canonical_id '
+            'FROM duplicate_{2} d WHERE {1} = d.old_id'.format(
+                referencing_table, column, table
+            )
+        )
+
+    op.execute(
+        'DELETE FROM bookbrainz.{0} v USING duplicate_{0} d '
+        'WHERE v.{1} = d.old_id'.format(table, id_column)
+    )
+    op.execute('DROP TABLE duplicate_{}'.format(table))
+
+
+def upgrade():
+    for (table, id_column, columns, hash_expression, join_tables,
+         references) in VALUE_TABLES:
+        op.add_column(table, sa.Column('content_hash', sa.Unicode(length=32), nullable=True), schema='bookbrainz')
+        op.execute('UPDATE bookbrainz.{} SET content_hash = {}'.format(
+            table, hash_expression
+        ))
+        merge_duplicates(table, id_column, columns, join_tables, references)
+        op.create_index(op.f('ix_bookbrainz_{}_content_hash'.format(table)), table, ['content_hash'], unique=False, schema='bookbrainz')
+    ### end Alembic commands ###
+
+
+def downgrade():
+    # Merged duplicate values are not restored
+    for table in reversed([value_table[0] for value_table in VALUE_TABLES]):
+        op.drop_index(op.f('ix_bookbrainz_{}_content_hash'.format(table)), table_name=table, schema='bookbrainz')
+        op.drop_column(table, 'content_hash', schema='bookbrainz')
+    ### end Alembic commands ###
@@ -0,0 +1,94 @@
+"""Added entity data fingerprints.
+
+Revision ID: 4b6bf8d0c2e1
+Revises: 17ba2b76608d
+Create Date: 2026-10-18 15:02:47.530961
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4b6bf8d0c2e1'
+down_revision = '17ba2b76608d'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+# The fingerprints must match EntityData.compute_fingerprint, which joins the
+# values below with unit separators and writes NULL as an empty string
+COMMON_VALUES = [
+    'ed._type::text',
+    '(SELECT content_hash FROM bookbrainz.annotation v '
+    ' WHERE v.annotation_id = ed.annotation_id)',
+    '(SELECT content_hash FROM bookbrainz.disambiguation v '
+    ' WHERE v.disambiguation_id = ed.disambiguation_id)',
+    '(SELECT content_hash FROM bookbrainz.alias v '
+    ' WHERE v.alias_id = ed.default_alias_id)',
+    '(SELECT string_agg(v.content_hash, \',\' '
+    '                   ORDER BY v.content_hash COLLATE "C") '
+    ' FROM bookbrainz.entity_data__alias j '
+    ' JOIN bookbrainz.alias v ON v.alias_id = j.alias_id '
+    ' WHERE j.entity_data_id = ed.entity_data_id)',
+    '(SELECT string_agg(v.content_hash, \',\' '
+    '                   ORDER BY v.content_hash COLLATE "C") '
+    ' FROM bookbrainz.entity_data__identifier j '
+    ' JOIN bookbrainz.identifier v ON v.identifier_id = j.identifier_id '
+    ' WHERE j.entity_data_id = ed.entity_data_id)',
+]
+
+DATA_VALUES = [
+    ('publication_data', ['d.publication_type_id::text']),
+    ('creator_data', [
+        'd.begin_date::text', 'd.begin_date_precision::text',
+        'd.end_date::text', 'd.end_date_precision::text',
+        'coalesce(d.ended, false)::text', 'd.country_id::text',
+        'd.gender_id::text', 'd.creator_type_id::text'
+    ]),
+    ('publisher_data', [
+        'd.begin_date::text', 'd.begin_date_precision::text',
+        'd.end_date::text', 'd.end_date_precision::text',
+        'coalesce(d.ended, false)::text', 'd.country_id::text',
+        'd.publisher_type_id::text'
+    ]),
+    ('edition_data', [
+        'd.release_date::text', 'd.release_date_precision::text',
+        'd.pages::text', 'd.width::text', 'd.height::text', 'd.depth::text',
+        'd.weight::text', 'd.country_id::text', 'd.edition_format_id::text',
+        'd.edition_status_id::text', 'd.language_id::text',
+        'd.publication_gid::text', 'd.publisher_gid::text'
+    ]),
+    ('work_data', [
+        'd.work_type_id::text',
+        '(SELECT string_agg(l.language_id::text, \',\' '
+        '                   ORDER BY l.language_id) '
+        ' FROM bookbrainz.work_data__language l '
+        ' WHERE l.work_data_id = d.entity_data_id)'
+    ]),
+]
+
+
+def upgrade():
+    op.add_column('entity_data', sa.Column('fingerprint', sa.Unicode(length=32), nullable=True), schema='bookbrainz')
+
+    for table, values in DATA_VALUES:
+        op.execute(
+            'UPDATE bookbrainz.entity_data ed SET fingerprint = md5({}) '
+            'FROM bookbrainz.{} d '
+            'WHERE d.entity_data_id = ed.entity_data_id'.format(
+                " || E'\\x1f' || ".join(
+                    "coalesce({}, '')".format(value)
+                    for value in COMMON_VALUES + values
+                ),
+                table
+            )
+        )
+
+    op.create_index(op.f('ix_bookbrainz_entity_data_fingerprint'), 'entity_data', ['fingerprint'], unique=False, schema='bookbrainz')
+    ### end Alembic commands ###
+
+
+def downgrade():
+    op.drop_index(op.f('ix_bookbrainz_entity_data_fingerprint'), table_name='entity_data', schema='bookbrainz')
+    op.drop_column('entity_data', 'fingerprint', schema='bookbrainz')
+    ### end Alembic commands ###
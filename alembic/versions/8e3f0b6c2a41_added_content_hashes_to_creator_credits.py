@@ -0,0 +1,70 @@
+"""Added content hashes to creator credits, and merged duplicate credits.
+
+Revision ID: 8e3f0b6c2a41
+Revises: 5d1c7b3e8f24
+Create Date: 2026-10-18 17:22:05.483190
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '8e3f0b6c2a41'
+down_revision = '5d1c7b3e8f24'
+branch_labels = None
+depends_on = None
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.add_column('creator_credit', sa.Column('content_hash', sa.Unicode(length=32), nullable=True), schema='bookbrainz')
+
+    # The signature is the text hashed by bbschema.entity.hash_value_key for
+    # CreatorCredit.value_key
+    op.execute(
+        "CREATE TEMPORARY TABLE credit_signature AS "
+        "SELECT c.creator_credit_id, concat_ws(E'\\x1f', c.begin_phrase, ("
+        "  SELECT string_agg(concat_ws(E'\\x1f', n.position::text, n.name, "
+        "    n.join_phrase, coalesce(n.creator_gid::text, '')), "
+        "    E'\\x1f' ORDER BY n.position) "
+        "  FROM bookbrainz.creator_credit_name n "
+        "  WHERE n.creator_credit_id = c.creator_credit_id"
+        ")) AS signature FROM bookbrainz.creator_credit c"
+    )
+    op.execute(
+        'UPDATE bookbrainz.creator_credit c SET content_hash = md5(s.signature) '
+        'FROM credit_signature s '
+        'WHERE s.creator_credit_id = c.creator_credit_id'
+    )
+
+    # Map each duplicate to the credit with the same content and lowest ID
+    op.execute(
+        'CREATE TEMPORARY TABLE duplicate_creator_credit AS '
+        'SELECT creator_credit_id AS old_id, canonical_id FROM ('
+        '  SELECT creator_credit_id, min(creator_credit_id) OVER ('
+        '    PARTITION BY signature'
+        '  ) AS canonical_id FROM credit_signature'
+        ') AS credit WHERE creator_credit_id <> canonical_id'
+    )
+    op.execute(
+        'UPDATE bookbrainz.edition_data SET creator_credit_id = d.canonical_id '
+        'FROM duplicate_creator_credit d WHERE creator_credit_id = d.old_id'
+    )
+    op.execute(
+        'DELETE FROM bookbrainz.creator_credit_name n '
+        'USING duplicate_creator_credit d WHERE n.creator_credit_id = d.old_id'
+    )
+    op.execute(
+        'DELETE FROM bookbrainz.creator_credit c '
+        'USING duplicate_creator_credit d WHERE c.creator_credit_id = d.old_id'
+    )
+    op.execute('DROP TABLE duplicate_creator_credit')
+    op.execute('DROP TABLE credit_signature')
+
+    op.create_index(op.f('ix_bookbrainz_creator_credit_content_hash'), 'creator_credit', ['content_hash'], unique=False, schema='bookbrainz')
+
+
+def downgrade():
+    # Merged duplicate credits are not restored
+    op.drop_index(op.f('ix_bookbrainz_creator_credit_content_hash'), table_name='creator_credit', schema='bookbrainz')
+    op.drop_column('creator_credit', 'content_hash', schema='bookbrainz')
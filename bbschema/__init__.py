@@ -19,7 +19,8 @@ from .base import Base
 
 from .entity import (Entity, EntityRedirect,
                      Annotation, Disambiguation, Alias, Creator, Publication,
-                     Edition, Publisher, Work, Identifier, IdentifierType)
+                     Edition, Publisher, Work, Identifier, IdentifierType,
+                     refresh_edition_links)
 from .user import (User, UserType, InactiveUser, SuspendedUser, OAuthClient,
                    Message, MessageReceipt, UserLanguage)
 from .entity_data import (EntityData, PublicationData, PublicationType,
@@ -34,6 +35,17 @@ from .revision import (Revision, EntityRevision, RelationshipRevision,
 from .relationships import (Relationship, RelationshipType, RelationshipData,
                             RelationshipEntity, RelationshipText)
 
+from .resolver import ReferenceResolver
+from .identifiers import IdentifierEngine
+from .current import (EntityCurrent, refresh_entity_current,
+                      maintain_entity_current, maintains_entity_current)
+from .bulk import bulk_create_revisions
+from .batch import iterate_query, query_batches
+from .instrumentation import QueryRecorder, query_budget
+from .redirect import resolve_gid, clear_redirect_cache
+from .loading import (LoaderProfile, SUMMARY, FULL, FULL_CREATOR, FULL_EDITION,
+                      FULL_PUBLICATION, FULL_PUBLISHER, FULL_WORK)
+
 INCLUDED_TABLES = [
     'musicbrainz.language',
     'musicbrainz.gender'
@@ -0,0 +1,111 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module contains functions for iterating over the results of large
+queries in batches, for jobs which process whole tables. Each batch is fetched
+with keyset pagination, so fetching a batch costs the same however far through
+the table it is, and the objects of finished batches are released from the
+session, so that memory use stays flat."""
+
+from sqlalchemy import inspect, tuple_
+from sqlalchemy.orm.attributes import QueryableAttribute
+
+# The number of rows fetched by each query
+BATCH_SIZE = 1000
+
+
+def _key_columns(query, key):
+    mapper = inspect(query.column_descriptions[0]['entity']).mapper
+    if key is None:
+        key = mapper.primary_key
+
+    columns = []
+    for column in key:
+        # Columns may be given as mapped attributes, such as Entity.entity_gid
+        if isinstance(column, QueryableAttribute):
+            columns.append((column, column.key))
+        else:
+            columns.append(
+                (column, mapper.get_property_by_column(column).key)
+            )
+
+    return columns
+
+
+def _release(session, batch):
+    # Changes to the objects are flushed first, so that they aren't lost
+    session.flush()
+
+    for row in batch:
+        values = row if isinstance(row, tuple) else (row,)
+        for value in values:
+            state = inspect(value, raiseerr=False)
+            if state is not None and state.session_id is not None:
+                session.expunge(value)
+
+
+def query_batches(query, batch_size=BATCH_SIZE, key=None, expunge=True):
+    """Yields the results of query as lists of at most batch_size rows, in
+    order of key, which is a list of columns of the first entity of the query
+    and defaults to its primary key. Any ordering of the query is replaced.
+
+    Each batch is fetched by a query for the rows following the last row of
+    the previous batch, so rows inserted behind that point aren't returned,
+    and rows inserted ahead of it are. The key must be unique.
+
+    Unless expunge is False, the session is flushed once the caller is done
+    with each batch, and the objects of the batch are expunged from it, so
+    that they can be garbage collected. Any other objects loaded while
+    processing the batch are only weakly referenced by the session once
+    flushed, so are also released when no longer referenced by the caller.
+    """
+    columns = _key_columns(query, key)
+    if len(columns) == 1:
+        key_expression = columns[0][0]
+    else:
+        key_expression = tuple_(*[column for column, _ in columns])
+
+    query = query.order_by(None).order_by(
+        *[column for column, _ in columns]
+    )
+
+    batch = query.limit(batch_size).all()
+    while batch:
+        last_values = [getattr(batch[-1], attr) for _, attr in columns]
+
+        yield batch
+
+        if expunge:
+            _release(query.session, batch)
+
+        if len(batch) < batch_size:
+            return
+
+        if len(columns) == 1:
+            condition = key_expression > last_values[0]
+        else:
+            condition = key_expression > tuple_(*last_values)
+
+        batch = query.filter(condition).limit(batch_size).all()
+
+
+def iterate_query(query, batch_size=BATCH_SIZE, key=None, expunge=True):
+    """Yields the results of query one row at a time, fetching them in
+    batches as for query_batches."""
+    for batch in query_batches(query, batch_size, key, expunge):
+        for row in batch:
+            yield row
@@ -0,0 +1,482 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module contains functions for creating large numbers of entity
+revisions at once. The rows are built directly from the revision JSON, by the
+same column_values methods used by the create methods of the models, and are
+written with COPY, using IDs allocated from the table sequences in blocks,
+rather than being built as ORM objects and flushed one object at a time."""
+
+import gc
+import uuid
+from collections import defaultdict
+from operator import itemgetter, methodcaller
+
+from bbschema.base import Base
+from bbschema.current import maintains_entity_current, refresh_entity_current
+from bbschema.entity import (Alias, Annotation, Creator, Disambiguation,
+                             Edition, Entity, Identifier, Publication,
+                             Publisher, VALUE_MODELS, Work, alias_values,
+                             hash_value_key, identifier_values,
+                             refresh_edition_links)
+from bbschema.entity_data import (CreatorData, EditionData, EntityData,
+                                  PublicationData, PublisherData, WorkData)
+from bbschema.resolver import ReferenceResolver
+from bbschema.revision import EntityRevision, Revision
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.sql import text
+
+ENTITY_TYPES = {
+    'Creator': (Creator, CreatorData),
+    'Edition': (Edition, EditionData),
+    'Publication': (Publication, PublicationData),
+    'Publisher': (Publisher, PublisherData),
+    'Work': (Work, WorkData)
+}
+
+
+def allocate_ids(session, column, count):
+    """Reserves count values from the sequence of an autoincrement column.
+    The values are returned in a single array, since fetching a row for each
+    of them costs more than reserving it."""
+    if not count:
+        return []
+
+    sequence = session.execute(
+        text('SELECT pg_get_serial_sequence(:table, :column)'),
+        {'table': column.table.fullname, 'column': column.name}
+    ).scalar()
+
+    # The sequence is passed as a constant, since it would otherwise be
+    # looked up again for every value
+    return session.execute(text(
+        'SELECT array_agg(nextval(CAST(:sequence AS regclass))) '
+        'FROM generate_series(1, :count)'
+    ), {'sequence': sequence, 'count': count}).scalar()
+
+
+# The number of rows converted at a time as they are written with COPY
+COPY_CHUNK_SIZE = 1000
+
+_INTEGER_TYPES = frozenset([int, long])
+_BOOLEAN_TYPES = frozenset([bool])
+_TEXT_TYPES = frozenset([unicode])
+
+_BOOLEAN_TEXT = {True: u't', False: u'f', None: u'\\N'}
+
+# The characters which must be escaped in the text format of COPY
+_ESCAPED = u'\\\t\n\r'
+
+
+def _copy_text(value):
+    """Returns value in the text format of COPY."""
+    if value is None:
+        return u'\\N'
+
+    value_type = type(value)
+    if value_type is int or value_type is long:
+        return unicode(value)
+    elif value_type is bool:
+        return u't' if value else u'f'
+    elif value_type is bytes:
+        value = value.decode('utf8')
+    elif value_type is not unicode:
+        return unicode(value)
+
+    # Most text needs no escaping, and is much faster to check than to copy
+    if (u'\\' in value or u'\t' in value or u'\n' in value or
+            u'\r' in value):
+        value = (value.replace(u'\\', u'\\\\').replace(u'\t', u'\\t')
+                 .replace(u'\n', u'\\n').replace(u'\r', u'\\r'))
+
+    return value
+
+
+def _copy_column(values):
+    """Returns the values of a column in the text format of COPY. Columns of
+    integers, booleans or text which needs no escaping are converted without
+    examining each value in Python."""
+    types = set(map(type, values))
+    nulls = type(None) in types
+    types.discard(type(None))
+
+    if types <= _INTEGER_TYPES:
+        if nulls:
+            return [u'\\N' if value is None else unicode(value)
+                    for value in values]
+        return map(unicode, values)
+    elif types == _BOOLEAN_TYPES:
+        return map(_BOOLEAN_TEXT.__getitem__, values)
+    elif types == _TEXT_TYPES:
+        text = u''.join(filter(None, values))
+        if not any(character in text for character in _ESCAPED):
+            if nulls:
+                return [u'\\N' if value is None else value
+                        for value in values]
+            return values
+
+    return map(_copy_text, values)
+
+
+class _RowReader(object):
+    """A file object from which copy_expert reads rows, which are dictionaries
+    of column values, in the text format of COPY. The rows are converted a
+    chunk at a time as they are read, so the text of the whole table is never
+    held at once, and the server can write the rows read so far while the
+    next chunk is converted. Each read returns a whole chunk, whatever size
+    is requested, which copy_expert sends as it is."""
+
+    def __init__(self, rows, keys):
+        self.rows = rows
+        self.keys = keys
+        self.start = 0
+
+    def read(self, size=-1):
+        rows = self.rows[self.start:self.start + COPY_CHUNK_SIZE]
+        self.start += len(rows)
+        if not rows:
+            return u''
+
+        # The rows are converted a column at a time, which is much faster
+        # than converting each value in turn
+        lines = map(u'\t'.join, zip(*[
+            _copy_column(map(methodcaller('get', key), rows))
+            for key in self.keys
+        ]))
+        lines.append(u'')
+
+        return u'\n'.join(lines)
+
+
+def _copy_rows(session, table, rows):
+    """Writes rows, which are dictionaries of column values, to table with a
+    single COPY statement. Columns missing from a row are written as NULL, and
+    columns with server defaults which are missing from every row are left to
+    their defaults, like unset attributes of objects flushed by the ORM."""
+    keys = set().union(*rows)
+
+    columns = [column for column in table.columns
+               if column.key in keys or column.server_default is None]
+
+    connection = session.connection()
+    preparer = connection.dialect.identifier_preparer
+    dbapi_connection = connection.connection
+
+    statement = 'COPY {} ({}) FROM STDIN'.format(
+        preparer.format_table(table),
+        ', '.join(preparer.format_column(column) for column in columns)
+    )
+
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(statement, _RowReader(
+            rows, [column.key for column in columns]
+        ))
+    finally:
+        cursor.close()
+
+
+def _intern_values(session, model, values):
+    """Returns a list of the IDs of the rows of the value model with each of
+    the column values in values, a list of the content hashes of those rows,
+    and a list of the new rows to be written.
+
+    Like ReferenceResolver.intern_all, values with the same content share a
+    row, which is an existing row with the same content hash and value_key if
+    there is one."""
+    if not values:
+        return [], [], []
+
+    getter = itemgetter(*model.value_columns)
+    if len(model.value_columns) == 1:
+        keys = [(getter(value),) for value in values]
+    else:
+        keys = map(getter, values)
+
+    hashes = {}
+    for key in keys:
+        if key not in hashes:
+            hashes[key] = hash_value_key(key)
+
+    table = model.__table__
+    id_column = class_mapper(model).primary_key[0]
+    preparer = session.connection().dialect.identifier_preparer
+
+    result = session.execute(
+        'SELECT {}, {} FROM {} WHERE content_hash = ANY(:hashes)'.format(
+            preparer.format_column(id_column),
+            ', '.join(preparer.format_column(table.c[key])
+                      for key in model.value_columns),
+            preparer.format_table(table)
+        ),
+        {'hashes': list(set(hashes.values()))}
+    )
+
+    ids = {}
+    for row in result.fetchall():
+        ids.setdefault(tuple(row[1:]), row[0])
+
+    new_keys = [key for key in hashes if key not in ids]
+    new_rows = []
+    for key, new_id in zip(new_keys, allocate_ids(session, id_column,
+                                                  len(new_keys))):
+        ids[key] = new_id
+
+        row = dict(zip(model.value_columns, key))
+        row[id_column.key] = new_id
+        row['content_hash'] = hashes[key]
+        new_rows.append(row)
+
+    return (map(ids.__getitem__, keys), map(hashes.__getitem__, keys),
+            new_rows)
+
+
+# The association table of each many-to-many relationship of the data
+# classes, with the keys of its columns referring to the data and to the
+# related rows, by data class and relationship key
+_associations = {}
+
+
+def _association(data_cls, key):
+    association = _associations.get((data_cls, key))
+    if association is None:
+        prop = data_cls.__mapper__.relationships[key]
+        (_, data_column), = prop.synchronize_pairs
+        (_, related_column), = prop.secondary_synchronize_pairs
+
+        association = (prop.secondary, data_column.key, related_column.key)
+        _associations[data_cls, key] = association
+
+    return association
+
+
+class _DataRows(object):
+    """The rows of a single new EntityData, as they are built from its
+    revision JSON, with the values referred to by their indexes in the lists
+    of values of each value model collected for the batch."""
+
+    def __init__(self, data_cls, revision_json, resolver, values):
+        self.data_cls = data_cls
+        self.columns = data_cls.column_values(revision_json, resolver)
+        self.associations = data_cls.association_values(revision_json,
+                                                        resolver)
+
+        self.annotation = self._add(values, Annotation,
+                                    Annotation.column_values(revision_json))
+        self.disambiguation = self._add(
+            values, Disambiguation,
+            Disambiguation.column_values(revision_json)
+        )
+
+        aliases, default_index = alias_values(revision_json)
+        self.aliases = [self._add(values, Alias, alias) for alias in aliases]
+        self.default_alias = (None if default_index is None
+                              else self.aliases[default_index])
+
+        self.identifiers = [self._add(values, Identifier, identifier)
+                            for identifier in identifier_values(revision_json)]
+
+    @staticmethod
+    def _add(values, model, column_values):
+        if column_values is None:
+            return None
+
+        values[model].append(column_values)
+        return len(values[model]) - 1
+
+    def add_rows(self, rows, entity_data_id, ids, hashes):
+        """Adds the rows of this data to rows, the lists of rows of each
+        table, given the IDs and content hashes of the values collected for
+        the batch."""
+        data_cls = self.data_cls
+
+        def value(values, index):
+            return None if index is None else values[index]
+
+        # Interning maps identical values to the same row, which is only
+        # linked to the data once
+        related = dict(self.associations)
+        related['aliases'] = [ids[Alias][index] for index in self.aliases]
+        related['identifiers'] = [ids[Identifier][index]
+                                  for index in self.identifiers]
+
+        columns = dict.fromkeys(data_cls.__mapper__.columns.keys())
+        columns.update(self.columns)
+        columns.update(self.associations)
+        columns.update({
+            'annotation': value(hashes[Annotation], self.annotation),
+            'disambiguation': value(hashes[Disambiguation],
+                                    self.disambiguation),
+            'default_alias': value(hashes[Alias], self.default_alias),
+            'aliases': u','.join(sorted(set(
+                hashes[Alias][index] for index in self.aliases
+            ))),
+            'identifiers': u','.join(sorted(set(
+                hashes[Identifier][index] for index in self.identifiers
+            )))
+        })
+
+        rows[EntityData.__table__].append({
+            'entity_data_id': entity_data_id,
+            '_type': data_cls.__mapper__.polymorphic_identity,
+            'annotation_id': value(ids[Annotation], self.annotation),
+            'disambiguation_id': value(ids[Disambiguation],
+                                       self.disambiguation),
+            'default_alias_id': value(ids[Alias], self.default_alias),
+            'fingerprint': hash_value_key(
+                data_cls.fingerprint_values(columns)
+            )
+        })
+
+        row = dict(self.columns)
+        row['entity_data_id'] = entity_data_id
+        rows[data_cls.__table__].append(row)
+
+        for key, related_ids in related.items():
+            table, data_key, related_key = _association(data_cls, key)
+            seen = set()
+            for related_id in related_ids:
+                if related_id not in seen:
+                    seen.add(related_id)
+                    rows[table].append({data_key: entity_data_id,
+                                        related_key: related_id})
+
+
+def _write_batch(session, records, set_master_revision):
+    resolver = ReferenceResolver(session)
+
+    documents = defaultdict(list)
+    for entity_type, revision_json, _ in records:
+        documents[ENTITY_TYPES[entity_type][1]].append(revision_json)
+
+    for data_cls, data_documents in documents.items():
+        resolver.add_documents(data_cls, data_documents)
+
+    values = defaultdict(list)
+    data = []
+    for entity_type, revision_json, _ in records:
+        data_cls = ENTITY_TYPES[entity_type][1]
+        if data_cls.creates_data(revision_json):
+            data.append(_DataRows(data_cls, revision_json, resolver, values))
+        else:
+            data.append(None)
+
+    rows = defaultdict(list)
+
+    ids = {}
+    hashes = {}
+    for model in VALUE_MODELS:
+        ids[model], hashes[model], new_rows =\
+            _intern_values(session, model, values[model])
+        rows[model.__table__].extend(new_rows)
+
+    entity_data_ids = iter(allocate_ids(
+        session, EntityData.__table__.c.entity_data_id,
+        len([data_rows for data_rows in data if data_rows is not None])
+    ))
+    revision_ids = allocate_ids(session, Revision.__table__.c.revision_id,
+                                len(records))
+
+    entity_gids = []
+    for (entity_type, _, user_id), data_rows, revision_id in\
+            zip(records, data, revision_ids):
+        entity_cls = ENTITY_TYPES[entity_type][0]
+        entity_gid = uuid.uuid4()
+        entity_gids.append(entity_gid)
+
+        # The gid is converted to text once for all the rows which refer to it
+        gid_text = unicode(entity_gid)
+
+        entity_data_id = None
+        if data_rows is not None:
+            entity_data_id = next(entity_data_ids)
+            data_rows.add_rows(rows, entity_data_id, ids, hashes)
+
+        rows[Entity.__table__].append({
+            'entity_gid': gid_text,
+            '_type': entity_cls.__mapper__.polymorphic_identity,
+            'master_revision_id': (revision_id if set_master_revision
+                                   else None)
+        })
+        rows[Revision.__table__].append({
+            'revision_id': revision_id,
+            'user_id': user_id,
+            '_type': EntityRevision.__mapper__.polymorphic_identity
+        })
+        rows[EntityRevision.__table__].append({
+            'revision_id': revision_id,
+            'entity_gid': gid_text,
+            'entity_data_id': entity_data_id
+        })
+
+    for table in Base.metadata.sorted_tables:
+        if rows[table]:
+            _copy_rows(session, table, rows[table])
+
+    # The rows are not flushed, so the read model and the links of editions
+    # must be refreshed here
+    if set_master_revision:
+        if maintains_entity_current(session):
+            refresh_entity_current(session, entity_gids)
+        refresh_edition_links(session, entity_gids)
+
+    return entity_gids
+
+
+def bulk_create_revisions(session, records, batch_size=5000,
+                          set_master_revision=True):
+    """Creates a new entity and an initial EntityRevision for each of the
+    (entity type, revision JSON, user ID) records, writing the rows for each
+    batch of records with a COPY statement per table.
+
+    The rows written are the same as those written when flushing the objects
+    built by the create method of the EntityData subclass for each entity
+    type. If set_master_revision is True, each new revision becomes the master
+    revision of its entity.
+
+    Constraints are deferred for the rest of the transaction, which is not
+    committed. Returns the entity_gids of the new entities, in the order of
+    the records.
+    """
+
+    session.execute('SET CONSTRAINTS ALL DEFERRED')
+
+    # The rows built for each batch hold no reference cycles, but the cyclic
+    # garbage collector would otherwise traverse them over and over as they
+    # are built, which takes much of the time spent in Python
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        entity_gids = []
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= batch_size:
+                entity_gids.extend(
+                    _write_batch(session, batch, set_master_revision)
+                )
+                batch = []
+
+        if batch:
+            entity_gids.extend(
+                _write_batch(session, batch, set_master_revision)
+            )
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    return entity_gids
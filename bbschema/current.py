@@ -0,0 +1,284 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module specifies EntityCurrent, a denormalized copy of the master
+revision of each entity, from which an entity can be displayed with a single
+query. Its rows are rewritten by refresh_entity_current whenever a flush
+changes the master revisions of entities, in sessions for which
+maintain_entity_current has been called."""
+
+from bbschema.base import Base
+from bbschema.entity import Alias, Entity
+from bbschema.entity_data import (ENTITY_DATA__ALIAS, CreatorData,
+                                  EditionData, PublicationData,
+                                  PublisherData, WorkData)
+from sqlalchemy import (Column, DateTime, Enum, ForeignKey, Index, Integer,
+                        Unicode, UnicodeText, event, inspect)
+from sqlalchemy.dialects.postgresql import JSON, UUID
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql import exists, text
+
+
+class EntityCurrent(Base):
+    __tablename__ = 'entity_current'
+    __table_args__ = (
+        Index('ix_bookbrainz_entity_current_entity_type_default_sort_name',
+              'entity_type', 'default_sort_name'),
+        {'schema': 'bookbrainz'}
+    )
+
+    entity_gid = Column(
+        UUID(as_uuid=True), ForeignKey('bookbrainz.entity.entity_gid',
+                                       deferrable=True), primary_key=True
+    )
+    entity_type = Column(
+        Enum('Creator', 'Publication', 'Edition', 'Publisher', 'Work',
+             name='entity_types'),
+        nullable=False
+    )
+    revision_id = Column(
+        Integer, ForeignKey('bookbrainz.entity_revision.revision_id',
+                            deferrable=True), nullable=False
+    )
+
+    # None if the entity has been deleted, along with the fields below
+    entity_data_id = Column(
+        Integer, ForeignKey('bookbrainz.entity_data.entity_data_id',
+                            deferrable=True)
+    )
+
+    default_name = Column(Unicode)
+    default_sort_name = Column(Unicode)
+    disambiguation = Column(UnicodeText)
+    annotation = Column(UnicodeText)
+
+    # Lists of objects with the columns of each alias and identifier
+    aliases = Column(JSON, nullable=False)
+    identifiers = Column(JSON, nullable=False)
+
+    # The columns of the type-specific data, such as creator_type_id, and
+    # the language_ids of works
+    details = Column(JSON)
+
+    updated_at = Column(DateTime, nullable=False,
+                        server_default=text("(now() AT TIME ZONE 'UTC')"))
+
+    entity = relationship('Entity')
+
+    @classmethod
+    def query(cls, session, entity_type=None, include_deleted=False):
+        """Returns a query for the current state of entities of entity_type,
+        or of every type, ordered by their default sort names."""
+        query = session.query(cls)
+        if entity_type is not None:
+            query = query.filter(cls.entity_type == entity_type)
+        if not include_deleted:
+            query = query.filter(cls.entity_data_id.isnot(None))
+
+        return query.order_by(cls.default_sort_name, cls.entity_gid)
+
+    @classmethod
+    def get_many(cls, session, gids, include_deleted=False):
+        """Returns a dictionary of the current state of each of the entities
+        with the given gids, loaded with a single query. Entities which don't
+        exist or have no master revision are left out."""
+        if not gids:
+            return {}
+
+        query = cls.query(session, include_deleted=include_deleted).filter(
+            cls.entity_gid.in_(gids)
+        )
+        return dict((row.entity_gid, row) for row in query)
+
+    @classmethod
+    def with_alias(cls, session, name, entity_type=None):
+        """Returns a query for the entities with an alias named name. The
+        aliases are looked up in their own table, which is indexed, rather
+        than in the aliases column."""
+        return cls.query(session, entity_type).filter(exists().where(
+            (ENTITY_DATA__ALIAS.c.entity_data_id == cls.entity_data_id) &
+            (ENTITY_DATA__ALIAS.c.alias_id == Alias.alias_id) &
+            (Alias.name == name)
+        ))
+
+
+def _data_columns(alias, data_cls):
+    """Returns the columns of the table of data_cls, other than its
+    entity_data_id, qualified by the alias of the table."""
+    return ', '.join(
+        '{}."{}"'.format(alias, column.name)
+        for column in data_cls.__table__.columns
+        if column.name != 'entity_data_id'
+    )
+
+
+# The current state of each entity with a master revision, in the columns of
+# entity_current. Only JSON functions available in PostgreSQL 9.3 are used,
+# so objects are built with row_to_json from subqueries
+_CURRENT_SQL = """
+SELECT
+    e.entity_gid, e._type AS entity_type, r.revision_id, d.entity_data_id,
+    a.name AS default_name, a.sort_name AS default_sort_name,
+    dis.comment AS disambiguation, ann.content AS annotation,
+    coalesce((
+        SELECT json_agg(x ORDER BY x.alias_id)
+        FROM (
+            SELECT al.alias_id, al.name, al.sort_name, al.language_id,
+                al."primary"
+            FROM bookbrainz.entity_data__alias eda
+            JOIN bookbrainz.alias al ON al.alias_id = eda.alias_id
+            WHERE eda.entity_data_id = d.entity_data_id
+        ) x
+    ), '[]') AS aliases,
+    coalesce((
+        SELECT json_agg(x ORDER BY x.identifier_id)
+        FROM (
+            SELECT i.identifier_id, i.identifier_type_id, i.value
+            FROM bookbrainz.entity_data__identifier edi
+            JOIN bookbrainz.identifier i
+                ON i.identifier_id = edi.identifier_id
+            WHERE edi.entity_data_id = d.entity_data_id
+        ) x
+    ), '[]') AS identifiers,
+    CASE
+    WHEN cd.entity_data_id IS NOT NULL THEN
+        (SELECT row_to_json(x) FROM (SELECT {creator}) x)
+    WHEN pd.entity_data_id IS NOT NULL THEN
+        (SELECT row_to_json(x) FROM (SELECT {publication}) x)
+    WHEN pud.entity_data_id IS NOT NULL THEN
+        (SELECT row_to_json(x) FROM (SELECT {publisher}) x)
+    WHEN ed.entity_data_id IS NOT NULL THEN
+        (SELECT row_to_json(x) FROM (SELECT {edition}) x)
+    WHEN wd.entity_data_id IS NOT NULL THEN
+        (SELECT row_to_json(x) FROM (SELECT {work}, coalesce((
+            SELECT array_agg(wl.language_id ORDER BY wl.language_id)
+            FROM bookbrainz.work_data__language wl
+            WHERE wl.work_data_id = wd.entity_data_id
+        ), CAST(ARRAY[] AS INTEGER[])) AS language_ids) x)
+    END AS details,
+    now() AT TIME ZONE 'UTC' AS updated_at
+FROM bookbrainz.entity e
+JOIN bookbrainz.entity_revision r ON r.revision_id = e.master_revision_id
+LEFT JOIN bookbrainz.entity_data d ON d.entity_data_id = r.entity_data_id
+LEFT JOIN bookbrainz.alias a ON a.alias_id = d.default_alias_id
+LEFT JOIN bookbrainz.disambiguation dis
+    ON dis.disambiguation_id = d.disambiguation_id
+LEFT JOIN bookbrainz.annotation ann ON ann.annotation_id = d.annotation_id
+LEFT JOIN bookbrainz.creator_data cd ON cd.entity_data_id = d.entity_data_id
+LEFT JOIN bookbrainz.publication_data pd
+    ON pd.entity_data_id = d.entity_data_id
+LEFT JOIN bookbrainz.publisher_data pud
+    ON pud.entity_data_id = d.entity_data_id
+LEFT JOIN bookbrainz.edition_data ed ON ed.entity_data_id = d.entity_data_id
+LEFT JOIN bookbrainz.work_data wd ON wd.entity_data_id = d.entity_data_id
+WHERE {{filter}}
+""".format(
+    creator=_data_columns('cd', CreatorData),
+    publication=_data_columns('pd', PublicationData),
+    publisher=_data_columns('pud', PublisherData),
+    edition=_data_columns('ed', EditionData),
+    work=_data_columns('wd', WorkData)
+)
+
+_COLUMNS = [
+    'entity_type', 'revision_id', 'entity_data_id', 'default_name',
+    'default_sort_name', 'disambiguation', 'annotation', 'aliases',
+    'identifiers', 'details', 'updated_at'
+]
+
+# Like upsert_table in utils/import.py, existing rows are updated before the
+# missing rows are inserted, since INSERT ... ON CONFLICT needs PostgreSQL 9.5
+_UPDATE_SQL = """
+UPDATE bookbrainz.entity_current c
+SET {}
+FROM ({}) AS s
+WHERE c.entity_gid = s.entity_gid
+""".format(
+    ', '.join('{0} = s.{0}'.format(column) for column in _COLUMNS),
+    _CURRENT_SQL
+)
+
+_INSERT_SQL = """
+INSERT INTO bookbrainz.entity_current (entity_gid, {0})
+SELECT s.entity_gid, {1}
+FROM ({2}) AS s
+WHERE NOT EXISTS (
+    SELECT 1 FROM bookbrainz.entity_current c
+    WHERE c.entity_gid = s.entity_gid
+)
+""".format(
+    ', '.join(_COLUMNS),
+    ', '.join('s.{}'.format(column) for column in _COLUMNS),
+    _CURRENT_SQL
+)
+
+# Removes the rows of entities which no longer have a master revision
+_DELETE_SQL = """
+DELETE FROM bookbrainz.entity_current c
+USING bookbrainz.entity e
+WHERE e.entity_gid = c.entity_gid AND e.master_revision_id IS NULL AND
+    {filter}
+"""
+
+
+def refresh_entity_current(bind, gids=None):
+    """Rewrites the EntityCurrent rows of the entities with the given gids
+    from their master revisions, and removes those of the entities without a
+    master revision. If gids is None, the rows of every entity are
+    refreshed, as is needed after entities have been written without the
+    ORM. bind is a session or a connection.
+
+    This is called when a session maintaining the table is flushed, for the
+    entities whose master revisions have changed, by bulk_create_revisions,
+    and by the migration which adds the table."""
+    if gids is None:
+        condition = 'TRUE'
+        params = {}
+    elif gids:
+        condition = 'e.entity_gid = ANY(CAST(:gids AS UUID[]))'
+        params = {'gids': [str(gid) for gid in gids]}
+    else:
+        return
+
+    for statement in (_UPDATE_SQL, _INSERT_SQL, _DELETE_SQL):
+        bind.execute(text(statement.format(filter=condition)), params)
+
+
+def _refresh_changed_entities(session, flush_context):
+    gids = [
+        entity.entity_gid for entity in list(session.new) +
+        list(session.dirty) if isinstance(entity, Entity) and (
+            inspect(entity).attrs.master_revision.history.has_changes() or
+            inspect(entity).attrs.master_revision_id.history.has_changes()
+        )
+    ]
+
+    if gids:
+        refresh_entity_current(session, gids)
+
+
+def maintain_entity_current(target):
+    """Keeps EntityCurrent up to date when sessions of target are flushed.
+    target is a sessionmaker, a Session subclass or a single Session."""
+    if not event.contains(target, 'after_flush', _refresh_changed_entities):
+        event.listen(target, 'after_flush', _refresh_changed_entities)
+
+
+def maintains_entity_current(session):
+    """Returns whether maintain_entity_current has been called for session,
+    its class or its sessionmaker."""
+    return _refresh_changed_entities in session.dispatch.after_flush
@@ -18,16 +18,41 @@
 """This module specifies a class, Resource, which is designed to be used as the
 base class for all resource models specified in this package."""
 
+import hashlib
+
 import sqlalchemy.sql as sql
 from bbschema.base import Base
 from bbschema.musicbrainz import Language
 from sqlalchemy import (Boolean, Column, DateTime, Enum, ForeignKey, Integer,
-                        Unicode, UnicodeText, UniqueConstraint)
+                        Unicode, UnicodeText, UniqueConstraint, event)
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import Session, backref, relationship
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.sql import text
 
 
+def hash_value_key(value_key):
+    """Returns the content hash of a value row (an Alias, Identifier,
+    Annotation, Disambiguation or CreatorCredit) with the given value_key. The
+    values are written as PostgreSQL casts them to text, with None as an empty
+    string, and joined with unit separators before being hashed with MD5, so
+    that the same hash can be computed in SQL."""
+    parts = []
+    for value in value_key:
+        if isinstance(value, unicode):
+            parts.append(value)
+        elif value is None:
+            parts.append(u'')
+        elif isinstance(value, bool):
+            parts.append(u'true' if value else u'false')
+        elif isinstance(value, bytes):
+            parts.append(value.decode('utf8'))
+        else:
+            parts.append(unicode(value))
+
+    return unicode(hashlib.md5(u'\x1f'.join(parts).encode('utf8')).hexdigest())
+
+
 class Entity(Base):
     """Resource class, from which all other resource models are derived."""
 
@@ -57,11 +82,33 @@ class Entity(Base):
         'EntityRevision', foreign_keys=[master_revision_id], post_update=True
     )
 
+    # The publication and publisher of the master revision of an edition,
+    # which are kept in sync by refresh_edition_links, so that the editions
+    # of a publication or publisher are found with an index scan
+    publication_gid = Column(
+        UUID(as_uuid=True), ForeignKey('bookbrainz.entity.entity_gid',
+                                       deferrable=True), index=True
+    )
+    publisher_gid = Column(
+        UUID(as_uuid=True), ForeignKey('bookbrainz.entity.entity_gid',
+                                       deferrable=True), index=True
+    )
+
     __mapper_args__ = {
         'polymorphic_on': _type
     }
 
 
+@event.listens_for(Entity.master_revision, 'set', propagate=True)
+@event.listens_for(Entity.master_revision_id, 'set', propagate=True)
+def touch_last_updated(target, value, oldvalue, initiator):
+    """Sets last_updated whenever the master revision of an entity or
+    relationship is changed. The master revision is written by a post_update,
+    which doesn't update the row otherwise, and delta dumps rely on
+    last_updated to find rows reverted to an older revision."""
+    target.last_updated = text("(now() AT TIME ZONE 'UTC')")
+
+
 class Creator(Entity):
     __mapper_args__ = {
         'polymorphic_identity': 'Creator'
@@ -80,19 +127,15 @@ class Edition(Entity):
     }
 
     publication = relationship(
-        'Publication',
-        primaryjoin='Edition.master_revision_id == EntityRevision.revision_id',
-        secondary='join(EntityRevision, EditionData, EntityRevision.entity_data_id == EditionData.entity_data_id)',
-        secondaryjoin='EditionData.publication_gid == Publication.entity_gid',
-        backref='editions'
+        'Publication', foreign_keys=[Entity.publication_gid],
+        remote_side=[Entity.entity_gid], viewonly=True,
+        backref=backref('editions', viewonly=True)
     )
 
     publisher = relationship(
-        'Publisher',
-        primaryjoin='Edition.master_revision_id == EntityRevision.revision_id',
-        secondary='join(EntityRevision, EditionData, EntityRevision.entity_data_id == EditionData.entity_data_id)',
-        secondaryjoin='EditionData.publisher_gid == Publisher.entity_gid',
-        backref='editions'
+        'Publisher', foreign_keys=[Entity.publisher_gid],
+        remote_side=[Entity.entity_gid], viewonly=True,
+        backref=backref('editions', viewonly=True)
     )
 
 
@@ -130,6 +173,17 @@ class Annotation(Base):
     created_at = Column(DateTime, nullable=False,
                         server_default=text("(now() AT TIME ZONE 'UTC')"))
 
+    content_hash = Column(Unicode(32), index=True)
+
+    # created_at is not part of the value, so an annotation shared between
+    # revisions keeps the time at which its content was first written, and
+    # annotations with the same content are equal whenever they were created
+    value_columns = ('content',)
+
+    @property
+    def value_key(self):
+        return (self.content,)
+
     def copy(self):
         return Annotation(content=self.content, created_at=self.created_at)
 
@@ -137,16 +191,28 @@ class Annotation(Base):
         if other is None:
             return False
 
-        return ((self.content == other.content) and
-                (self.created_at == other.created_at))
+        return self.value_key == other.value_key
+
+    def __ne__(self, other):
+        return not self == other
 
     @classmethod
-    def create(cls, revision_json):
+    def column_values(cls, revision_json):
+        """Returns a dictionary of the columns of the annotation created from
+        revision_json, or None if it has no annotation."""
         if ('annotation' not in revision_json or
                 not revision_json['annotation']):
             return None
 
-        return cls(content=revision_json['annotation'])
+        return {'content': revision_json['annotation']}
+
+    @classmethod
+    def create(cls, revision_json):
+        values = cls.column_values(revision_json)
+        if values is None:
+            return None
+
+        return cls(**values)
 
     def update(self, revision_json):
         if 'annotation' not in revision_json:
@@ -172,6 +238,14 @@ class Disambiguation(Base):
     disambiguation_id = Column(Integer, primary_key=True)
     comment = Column(UnicodeText, nullable=False, server_default="")
 
+    content_hash = Column(Unicode(32), index=True)
+
+    value_columns = ('comment',)
+
+    @property
+    def value_key(self):
+        return (self.comment,)
+
     def copy(self):
         cls = type(self)
         return cls(comment=self.comment)
@@ -183,12 +257,22 @@ class Disambiguation(Base):
         return (self.comment == other.comment)
 
     @classmethod
-    def create(cls, revision_json):
+    def column_values(cls, revision_json):
+        """Returns a dictionary of the columns of the disambiguation created
+        from revision_json, or None if it has no disambiguation."""
         if ('disambiguation' not in revision_json or
                 not revision_json['disambiguation']):
             return None
 
-        return cls(comment=revision_json['disambiguation'])
+        return {'comment': revision_json['disambiguation']}
+
+    @classmethod
+    def create(cls, revision_json):
+        values = cls.column_values(revision_json)
+        if values is None:
+            return None
+
+        return cls(**values)
 
     def update(self, revision_json):
         if 'disambiguation' not in revision_json:
@@ -223,8 +307,19 @@ class Alias(Base):
 
     primary = Column(Boolean, nullable=False, server_default=text('false'))
 
+    content_hash = Column(Unicode(32), index=True)
+
     language = relationship(Language)
 
+    # create always sets primary, so the values of these columns given by
+    # column_values form the value_key
+    value_columns = ('name', 'sort_name', 'language_id', 'primary')
+
+    @property
+    def value_key(self):
+        return (self.name, self.sort_name, self.language_id,
+                bool(self.primary))
+
     def copy(self):
         return Alias(name=self.name, sort_name=self.sort_name,
                      language_id=self.language_id, primary=self.primary)
@@ -242,7 +337,9 @@ class Alias(Base):
         return not self == other
 
     @classmethod
-    def create(cls, alias_json):
+    def column_values(cls, alias_json):
+        """Returns a dictionary of the columns of the alias created from
+        alias_json, or None if alias_json is not a valid alias."""
         if 'name' not in alias_json or 'sort_name' not in alias_json:
             return None
 
@@ -259,12 +356,20 @@ class Alias(Base):
                 not isinstance(alias_json['primary'], bool)):
             return None
 
-        return cls(
-            name=alias_json['name'],
-            sort_name=alias_json['sort_name'],
-            language_id=alias_json.get('language_id'),
-            primary=alias_json.get('primary', False)
-        )
+        return {
+            'name': alias_json['name'],
+            'sort_name': alias_json['sort_name'],
+            'language_id': alias_json.get('language_id'),
+            'primary': alias_json.get('primary', False)
+        }
+
+    @classmethod
+    def create(cls, alias_json):
+        values = cls.column_values(alias_json)
+        if values is None:
+            return None
+
+        return cls(**values)
 
     def update(self, alias_json):
         if ('name' in alias_json and
@@ -311,8 +416,16 @@ class Identifier(Base):
 
     value = Column(UnicodeText, nullable=False)
 
+    content_hash = Column(Unicode(32), index=True)
+
     identifier_type = relationship('IdentifierType')
 
+    value_columns = ('identifier_type_id', 'value')
+
+    @property
+    def value_key(self):
+        return (self.identifier_type_id, self.value)
+
     def copy(self):
         return Identifier(value=self.value,
                           identifier_type_id=self.identifier_type_id)
@@ -328,15 +441,19 @@ class Identifier(Base):
         return not self == other
 
     @classmethod
-    def create(cls, identifier_json):
-        new_identifier = cls()
-
-        new_identifier.identifier_type_id =\
-            identifier_json.get('identifier_type', {}).get('identifier_type_id')
+    def column_values(cls, identifier_json):
+        """Returns a dictionary of the columns of the identifier created from
+        identifier_json."""
+        return {
+            'identifier_type_id': identifier_json.get(
+                'identifier_type', {}
+            ).get('identifier_type_id'),
+            'value': identifier_json.get('value')
+        }
 
-        new_identifier.value = identifier_json.get('value')
-
-        return new_identifier
+    @classmethod
+    def create(cls, identifier_json):
+        return cls(**cls.column_values(identifier_json))
 
     def update(self, identifier_json):
         new = self.copy()
@@ -348,6 +465,9 @@ class Identifier(Base):
             new.identifier_type_id =\
                 identifier_json['identifier_type'].get('identifier_type_id')
 
+        if new == self:
+            return self
+
         return new
 
 
@@ -382,23 +502,37 @@ class IdentifierType(Base):
     UniqueConstraint('label', 'entity_type')
 
 
-def create_aliases(revision_json):
+def alias_values(revision_json):
+    """Returns a list of the column values of the aliases created from
+    revision_json, and the index in that list of the default alias, or None if
+    there are no aliases. The default alias is the last marked as the default,
+    or otherwise the first."""
     if 'aliases' not in revision_json:
         return ([], None)
 
     aliases = []
-    default_alias = None
+    default_index = None
     for alias in revision_json['aliases']:
-        result = Alias.create(alias)
+        result = Alias.column_values(alias)
         if result is not None:
             aliases.append(result)
             if alias.get('default', False):
-                default_alias = aliases[-1]
+                default_index = len(aliases) - 1
+
+    if default_index is None and aliases:
+        default_index = 0
 
-    if default_alias is None and aliases:
-        default_alias = aliases[0]
+    return (aliases, default_index)
 
-    return (aliases, default_alias)
+
+def create_aliases(revision_json):
+    values, default_index = alias_values(revision_json)
+
+    aliases = [Alias(**alias) for alias in values]
+    if default_index is None:
+        return (aliases, None)
+
+    return (aliases, aliases[default_index])
 
 
 def update_aliases(aliases, default_alias_id, revision_json):
@@ -433,20 +567,35 @@ def update_aliases(aliases, default_alias_id, revision_json):
     return (list(alias_dict.values()) + new_aliases, default_alias)
 
 
+def diff_values(left, right):
+    """Returns a tuple of the values in left with no equal value in right, and
+    the values in right with no equal value in left. Values are compared by
+    their value_key, using sets, so duplicates are kept or dropped together,
+    and the order of each list is preserved."""
+    left_keys = set(value.value_key for value in left)
+    right_keys = set(value.value_key for value in right)
+
+    return ([l for l in left if l.value_key not in right_keys],
+            [r for r in right if r.value_key not in left_keys])
+
+
 def diff_aliases(left, right):
-    aliases_in_left = [l for l in left if l not in right]
-    aliases_in_right = [r for r in right if r not in left]
+    return diff_values(left, right)
 
-    return (aliases_in_left, aliases_in_right)
 
-def create_identifiers(revision_json):
+def identifier_values(revision_json):
+    """Returns a list of the column values of the identifiers created from
+    revision_json."""
     if 'identifiers' not in revision_json:
         return []
 
-    identifiers = [Identifier.create(identifier)
-                   for identifier in revision_json['identifiers']]
+    return [Identifier.column_values(identifier)
+            for identifier in revision_json['identifiers']]
 
-    return identifiers
+
+def create_identifiers(revision_json):
+    return [Identifier(**identifier)
+            for identifier in identifier_values(revision_json)]
 
 
 def update_identifiers(identifiers, revision_json):
@@ -473,7 +622,88 @@ def update_identifiers(identifiers, revision_json):
 
 
 def diff_identifiers(left, right):
-    identifiers_in_left = [l for l in left if l not in right]
-    identifiers_in_right = [r for r in right if r not in left]
+    return diff_values(left, right)
+
+
+VALUE_MODELS = (Alias, Annotation, Disambiguation, Identifier)
+
+
+def _set_content_hash(mapper, connection, target):
+    target.content_hash = hash_value_key(target.value_key)
+
+
+for _model in VALUE_MODELS:
+    event.listen(_model, 'before_insert', _set_content_hash)
+    event.listen(_model, 'before_update', _set_content_hash)
+
+
+# Editions without master revisions, or whose master revisions have no data,
+# aren't linked to anything
+_EDITION_LINKS_SQL = """
+UPDATE bookbrainz.entity e
+SET publication_gid = s.publication_gid, publisher_gid = s.publisher_gid
+FROM (
+    SELECT edition.entity_gid, ed.publication_gid, ed.publisher_gid
+    FROM bookbrainz.entity edition
+    LEFT JOIN bookbrainz.entity_revision r
+        ON r.revision_id = edition.master_revision_id
+    LEFT JOIN bookbrainz.edition_data ed
+        ON ed.entity_data_id = r.entity_data_id
+    WHERE edition._type = 'Edition' {}
+) AS s
+WHERE e.entity_gid = s.entity_gid
+RETURNING e.entity_gid, e.publication_gid, e.publisher_gid
+"""
+
+
+def refresh_edition_links(bind, gids=None):
+    """Sets the publication_gid and publisher_gid of the editions with the
+    given gids to those of their master revisions, using a single statement.
+    If gids is None, every edition is updated. bind is a session or a
+    connection.
+
+    This is called when a session is flushed, for the editions whose master
+    revisions have changed, by bulk_create_revisions, and by the migration
+    which adds the columns. Returns a dictionary of the new (publication_gid,
+    publisher_gid) of each edition updated."""
+    if gids is None:
+        result = bind.execute(text(_EDITION_LINKS_SQL.format('')))
+    elif gids:
+        result = bind.execute(
+            text(_EDITION_LINKS_SQL.format(
+                'AND edition.entity_gid = ANY(CAST(:gids AS UUID[]))'
+            )),
+            {'gids': [str(gid) for gid in gids]}
+        )
+    else:
+        return {}
+
+    return dict((row[0], tuple(row[1:])) for row in result)
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_changed_editions(session, flush_context):
+    # The objects flushed are grouped by mapper, so flushes without editions
+    # are passed over without looking at the objects in the session
+    editions = [
+        state.obj() for state in
+        flush_context.mappers.get(Edition.__mapper__, ())
+        if not state.deleted and (
+            state.attrs.master_revision.history.has_changes() or
+            state.attrs.master_revision_id.history.has_changes()
+        )
+    ]
+
+    if not editions:
+        return
+
+    links = refresh_edition_links(
+        session, [edition.entity_gid for edition in editions]
+    )
 
-    return (identifiers_in_left, identifiers_in_right)
+    # The columns were written by the statement, so they aren't changes
+    for edition in editions:
+        publication_gid, publisher_gid = links.get(edition.entity_gid,
+                                                   (None, None))
+        set_committed_value(edition, 'publication_gid', publication_gid)
+        set_committed_value(edition, 'publisher_gid', publisher_gid)
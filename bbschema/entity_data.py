@@ -21,14 +21,17 @@ base class for all resource models specified in this package."""
 import datetime
 
 from bbschema.base import Base
-from bbschema.entity import (Annotation, Creator, Disambiguation, Publication,
-                             Publisher, create_aliases, create_identifiers,
+from bbschema.entity import (Alias, Annotation, Creator, Disambiguation,
+                             Publication, Publisher, create_aliases,
+                             create_identifiers, hash_value_key,
                              update_aliases, update_identifiers, diff_aliases, diff_identifiers)
 from bbschema.musicbrainz import Language, Gender
+from bbschema.resolver import ReferenceResolver
 from sqlalchemy import (Boolean, Column, Date, Enum, ForeignKey, Integer,
-                        SmallInteger, Table, Unicode, UnicodeText)
+                        SmallInteger, Table, Unicode, UnicodeText, event)
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import backref, object_mapper, object_session, relationship
+from sqlalchemy.orm.base import instance_state
 from sqlalchemy.sql import text
 
 ENTITY_DATA__ALIAS = Table(
@@ -92,6 +95,42 @@ def parse_date_string(date_string):
         return None
 
 
+def value_hashes(values):
+    """Returns the sorted content hashes of a collection of value rows, joined
+    with commas, for use in an EntityData fingerprint."""
+    return u','.join(sorted(hash_value_key(value.value_key)
+                            for value in values))
+
+
+def unique_rows(rows):
+    """Returns rows without repeats of the same object, keeping their order.
+    Interning maps identical values to the same row, which can only appear
+    once in a many-to-many collection."""
+    seen = set()
+    result = []
+    for row in rows:
+        if id(row) not in seen:
+            seen.add(id(row))
+            result.append(row)
+
+    return result
+
+
+def related_key(obj, relationship_key, column_key, related_column_key):
+    """Returns the value of a foreign key column of obj, taking it from the
+    related object if the relationship has been set, since the column itself
+    is only updated when obj is flushed."""
+    state_dict = instance_state(obj).dict
+    if relationship_key not in state_dict:
+        return getattr(obj, column_key)
+
+    related = state_dict[relationship_key]
+    if related is None:
+        return None
+
+    return getattr(related, related_column_key)
+
+
 def format_date(date, precision):
     if date is None:
         return None
@@ -110,21 +149,45 @@ class CreatorCredit(Base):
     creator_credit_id = Column(Integer, primary_key=True)
     begin_phrase = Column(UnicodeText, nullable=False, server_default='')
 
-    names = relationship('CreatorCreditName', backref='creator_credit')
+    content_hash = Column(Unicode(32), index=True)
+
+    names = relationship('CreatorCreditName', backref='creator_credit',
+                         order_by='CreatorCreditName.position')
+
+    @property
+    def value_key(self):
+        # Credits are shared like value rows, so that every edition credited
+        # to the same creators in the same way uses a single credit
+        key = [self.begin_phrase]
+        for name in sorted(self.names, key=lambda name: name.position):
+            key.extend(name.value_key)
+
+        return tuple(key)
+
+    @classmethod
+    def references(cls, data):
+        return [(Creator, name_data.get('creator_gid'))
+                for name_data in data.get('names', [])]
 
     @classmethod
-    def create(cls, data, session):
+    def create(cls, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
+        # Register every creator first, so that they're found by one query
+        for model, key in cls.references(data):
+            resolver.add(model, key)
+
         new_credit = cls()
 
         new_credit.begin_phrase = data.get('begin_phrase', '')
 
         for name_data in data.get('names', []):
-            name = CreatorCreditName.create(name_data, session)
-
-            name.creator_credit_id = new_credit.creator_credit_id
+            name = CreatorCreditName.create(name_data, session, resolver)
             new_credit.names.append(name)
 
-        return new_credit
+        # An existing credit with the same phrases and names is used instead
+        return resolver.intern(new_credit)
 
 
 class CreatorCreditName(Base):
@@ -148,15 +211,26 @@ class CreatorCreditName(Base):
 
     creator = relationship('Creator')
 
+    @property
+    def value_key(self):
+        creator_gid = self.creator_gid
+        if creator_gid is None and self.creator is not None:
+            creator_gid = self.creator.entity_gid
+
+        return (self.position, self.name, self.join_phrase, creator_gid)
+
     @classmethod
-    def create(cls, data, session):
+    def create(cls, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
         new_name = cls()
 
         new_name.position = data.get('position')
         new_name.name = data.get('name')
         new_name.join_phrase = data.get('join_phrase')
 
-        creator = session.query(Creator).get(data.get('creator_gid'))
+        creator = resolver.get(Creator, data.get('creator_gid'))
         new_name.creator = creator
 
         return new_name
@@ -187,12 +261,95 @@ class EntityData(Base):
 
     annotation = relationship('Annotation')
     disambiguation = relationship('Disambiguation')
-    aliases = relationship("Alias", secondary=ENTITY_DATA__ALIAS,
-                           backref='data')
+    # Adding an EntityData to the data of a value does not add it to the
+    # session, so that copies made by update are only flushed if used
+    aliases = relationship(
+        "Alias", secondary=ENTITY_DATA__ALIAS,
+        backref=backref('data', cascade_backrefs=False)
+    )
     default_alias = relationship('Alias', foreign_keys=[default_alias_id])
 
-    identifiers = relationship('Identifier', secondary=ENTITY_DATA__IDENTIFIER,
-                               backref='data')
+    identifiers = relationship(
+        'Identifier', secondary=ENTITY_DATA__IDENTIFIER,
+        backref=backref('data', cascade_backrefs=False)
+    )
+
+    fingerprint = Column(Unicode(32), index=True)
+
+    def _related_value(self, relationship_key, model, column_key):
+        value = getattr(self, relationship_key)
+        if value is None and getattr(self, column_key) is not None:
+            # Only the ID was copied, and new objects are not lazy loaded
+            session = object_session(self)
+            if session is not None:
+                value = session.query(model).get(getattr(self, column_key))
+
+        if value is None:
+            return None
+
+        return hash_value_key(value.value_key)
+
+    def _fingerprint_columns(self):
+        """Returns the mapping of columns passed to fingerprint_values for
+        this EntityData."""
+        columns = dict((prop.key, getattr(self, prop.key))
+                       for prop in object_mapper(self).column_attrs)
+
+        columns.update({
+            'annotation': self._related_value('annotation', Annotation,
+                                              'annotation_id'),
+            'disambiguation': self._related_value(
+                'disambiguation', Disambiguation, 'disambiguation_id'
+            ),
+            'default_alias': self._related_value('default_alias', Alias,
+                                                 'default_alias_id'),
+            'aliases': value_hashes(self.aliases),
+            'identifiers': value_hashes(self.identifiers)
+        })
+
+        return columns
+
+    @classmethod
+    def fingerprint_values(cls, columns):
+        """Returns the list of values from which the fingerprint of data of
+        this class is computed. columns maps the keys of the columns of the
+        data to their values, except that the annotation, disambiguation and
+        default_alias keys give the content hashes of those values, and the
+        aliases and identifiers keys give the joined hashes from value_hashes.
+        Subclasses append the values of their own columns."""
+        return [
+            cls.__mapper__.polymorphic_identity,
+            columns['annotation'],
+            columns['disambiguation'],
+            columns['default_alias'],
+            columns['aliases'],
+            columns['identifiers']
+        ]
+
+    def compute_fingerprint(self):
+        """Returns a hash of the content of this EntityData. Values are hashed
+        by content rather than ID, and aliases and identifiers regardless of
+        order, so data with the same content has the same fingerprint,
+        whichever revision it belongs to."""
+        return hash_value_key(
+            self.fingerprint_values(self._fingerprint_columns())
+        )
+
+    def same_content(self, other):
+        """Returns True if this EntityData has the same fingerprint as other,
+        using the stored fingerprint of other if it has one, so that other
+        does not need to be loaded."""
+        other_fingerprint = other.fingerprint
+        if other_fingerprint is None:
+            other_fingerprint = other.compute_fingerprint()
+
+        return self.compute_fingerprint() == other_fingerprint
+
+    def discard(self):
+        """Unlinks an unused copy made by update from the values it shares
+        with the original, so that the copy is not flushed through them."""
+        self.aliases = []
+        self.identifiers = []
 
     def __eq__(self, other):
         # Assume that other is an EntityData
@@ -234,51 +391,106 @@ class EntityData(Base):
         return result
 
     @classmethod
-    def create(cls, data, session):
+    def references(cls, data):
+        """Returns a list of (model, key) pairs for the rows referenced by
+        the revision JSON data, which are looked up by create and update."""
+        return []
+
+    @classmethod
+    def creates_data(cls, data):
+        """Returns False if create returns None for the revision JSON data,
+        rather than a new EntityData."""
+        return True
+
+    @classmethod
+    def column_values(cls, data, resolver):
+        """Returns a dictionary of the columns which create sets from the
+        revision JSON data, other than those of the values. Subclasses add
+        their own columns."""
+        return {}
+
+    @classmethod
+    def association_values(cls, data, resolver):
+        """Returns a dictionary mapping the keys of the many-to-many
+        relationships which create sets from the revision JSON data, other
+        than those of the values, to the keys of the related rows."""
+        return {}
+
+    @classmethod
+    def create(cls, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
         new_data = cls()
 
-        new_data.annotation = Annotation.create(data)
-        new_data.disambiguation = Disambiguation.create(data)
-        new_data.identifiers = create_identifiers(data)
-        new_data.aliases, default_alias = create_aliases(data)
+        for key, value in cls.column_values(data, resolver).items():
+            setattr(new_data, key, value)
+
+        annotation = Annotation.create(data)
+        disambiguation = Disambiguation.create(data)
+        identifiers = create_identifiers(data)
+        aliases, default_alias = create_aliases(data)
+
+        # Intern all values together, so each model is queried once
+        resolver.intern_all(
+            [annotation, disambiguation] + identifiers + aliases
+        )
+
+        new_data.annotation = resolver.intern(annotation)
+        new_data.disambiguation = resolver.intern(disambiguation)
+        new_data.identifiers = unique_rows(resolver.intern_all(identifiers))
+        new_data.aliases = unique_rows(resolver.intern_all(aliases))
 
         if default_alias is not None:
-            new_data.default_alias = default_alias
+            new_data.default_alias = resolver.intern(default_alias)
 
         return new_data
 
-    def update(self, data, session):
+    def update(self, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
         # Create a new EntityData, copying the current data.
         new_data = self.copy()
 
         if self.annotation is not None:
-            new_data.annotation = self.annotation.update(data)
+            annotation = self.annotation.update(data)
         else:
-            new_data.annotation = Annotation.create(data)
+            annotation = Annotation.create(data)
 
         if self.disambiguation is not None:
-            new_data.disambiguation = self.disambiguation.update(data)
+            disambiguation = self.disambiguation.update(data)
         else:
-            new_data.disambiguation = Disambiguation.create(data)
+            disambiguation = Disambiguation.create(data)
 
-        new_data.identifiers =\
-            update_identifiers(self.identifiers, data)
+        identifiers = update_identifiers(self.identifiers, data)
 
-        new_data.aliases, default_alias =\
+        aliases, default_alias =\
             update_aliases(self.aliases, self.default_alias_id, data)
 
+        resolver.intern_all(
+            [annotation, disambiguation] + identifiers + aliases
+        )
+
+        new_data.annotation = resolver.intern(annotation)
+        new_data.disambiguation = resolver.intern(disambiguation)
+        new_data.identifiers = unique_rows(resolver.intern_all(identifiers))
+        new_data.aliases = unique_rows(resolver.intern_all(aliases))
+
         if default_alias is not None:
-            new_data.default_alias = default_alias
+            new_data.default_alias = resolver.intern(default_alias)
 
         return new_data
 
     def copy(self):
         copied_data = type(self)(
-            annotation_id=self.annotation_id,
-            disambiguation_id=self.disambiguation_id,
-            default_alias_id=self.default_alias_id
+            annotation=self.annotation,
+            disambiguation=self.disambiguation
         )
         copied_data.aliases = self.aliases
+        copied_data.identifiers = self.identifiers
+        # The default alias is one of the aliases, so is already loaded
+        copied_data.default_alias = self.default_alias
 
         return copied_data
 
@@ -311,6 +523,12 @@ class PublicationData(EntityData):
 
         return False
 
+    @classmethod
+    def fingerprint_values(cls, columns):
+        values = super(PublicationData, cls).fingerprint_values(columns)
+        values.append(columns['publication_type_id'])
+        return values
+
     def diff(self, other):
         data = {
             'publication_type': (self.publication_type,
@@ -322,23 +540,24 @@ class PublicationData(EntityData):
         return result
 
     @classmethod
-    def create(cls, data, session):
-        new_data = super(PublicationData, cls).create(data, session)
+    def column_values(cls, data, resolver):
+        values = super(PublicationData, cls).column_values(data, resolver)
 
-        new_data.publication_type_id =\
+        values['publication_type_id'] =\
             data.get('publication_type', {}).get('publication_type_id')
 
-        return new_data
+        return values
 
-    def update(self, data, session):
-        new_data = super(PublicationData, self).update(data, session)
+    def update(self, data, session, resolver=None):
+        new_data = super(PublicationData, self).update(data, session, resolver)
 
         if (('publication_type' in data) and
                 ('publication_type_id' in data['publication_type'])):
             new_data.publication_type_id =\
                 data['publication_type']['publication_type_id']
 
-        if new_data == self:
+        if new_data.same_content(self):
+            new_data.discard()
             return self
         else:
             return new_data
@@ -418,6 +637,17 @@ class CreatorData(EntityData):
 
         return False
 
+    @classmethod
+    def fingerprint_values(cls, columns):
+        values = super(CreatorData, cls).fingerprint_values(columns)
+        values.extend([
+            columns['begin_date'], columns['begin_date_precision'],
+            columns['end_date'], columns['end_date_precision'],
+            bool(columns['ended']), columns['country_id'],
+            columns['gender_id'], columns['creator_type_id']
+        ])
+        return values
+
     def diff(self, other):
         data = {
             'begin_date': (
@@ -441,29 +671,29 @@ class CreatorData(EntityData):
         return result
 
     @classmethod
-    def create(cls, data, session):
-        new_data = super(CreatorData, cls).create(data, session)
+    def column_values(cls, data, resolver):
+        values = super(CreatorData, cls).column_values(data, resolver)
 
         parsed_date_info = parse_date_string(data.get('begin_date'))
         if parsed_date_info is not None:
-            new_data.begin_date = parsed_date_info[0]
-            new_data.begin_date_precision = parsed_date_info[1]
+            values['begin_date'] = parsed_date_info[0]
+            values['begin_date_precision'] = parsed_date_info[1]
 
         parsed_date_info = parse_date_string(data.get('end_date'))
         if parsed_date_info is not None:
-            new_data.end_date = parsed_date_info[0]
-            new_data.end_date_precision = parsed_date_info[1]
+            values['end_date'] = parsed_date_info[0]
+            values['end_date_precision'] = parsed_date_info[1]
 
-        new_data.ended = data.get('ended', False)
-        new_data.country_id = data.get('country_id')
-        new_data.gender_id = data.get('gender', {}).get('gender_id')
-        new_data.creator_type_id =\
+        values['ended'] = data.get('ended', False)
+        values['country_id'] = data.get('country_id')
+        values['gender_id'] = data.get('gender', {}).get('gender_id')
+        values['creator_type_id'] =\
             data.get('creator_type', {}).get('creator_type_id')
 
-        return new_data
+        return values
 
-    def update(self, data, session):
-        new_data = super(CreatorData, self).update(data, session)
+    def update(self, data, session, resolver=None):
+        new_data = super(CreatorData, self).update(data, session, resolver)
 
         parsed_date_info = parse_date_string(data.get('begin_date'))
         if parsed_date_info is not None:
@@ -486,7 +716,8 @@ class CreatorData(EntityData):
                 ('creator_type_id' in data['creator_type'])):
             new_data.creator_type_id = data['creator_type']['creator_type_id']
 
-        if new_data == self:
+        if new_data.same_content(self):
+            new_data.discard()
             return self
         else:
             return new_data
@@ -569,6 +800,17 @@ class PublisherData(EntityData):
 
         return False
 
+    @classmethod
+    def fingerprint_values(cls, columns):
+        values = super(PublisherData, cls).fingerprint_values(columns)
+        values.extend([
+            columns['begin_date'], columns['begin_date_precision'],
+            columns['end_date'], columns['end_date_precision'],
+            bool(columns['ended']), columns['country_id'],
+            columns['publisher_type_id']
+        ])
+        return values
+
     def diff(self, other):
         data = {
             'begin_date': (
@@ -591,28 +833,28 @@ class PublisherData(EntityData):
         return result
 
     @classmethod
-    def create(cls, data, session):
-        new_data = super(PublisherData, cls).create(data, session)
+    def column_values(cls, data, resolver):
+        values = super(PublisherData, cls).column_values(data, resolver)
 
         parsed_date_info = parse_date_string(data.get('begin_date'))
         if parsed_date_info is not None:
-            new_data.begin_date = parsed_date_info[0]
-            new_data.begin_date_precision = parsed_date_info[1]
+            values['begin_date'] = parsed_date_info[0]
+            values['begin_date_precision'] = parsed_date_info[1]
 
         parsed_date_info = parse_date_string(data.get('end_date'))
         if parsed_date_info is not None:
-            new_data.end_date = parsed_date_info[0]
-            new_data.end_date_precision = parsed_date_info[1]
+            values['end_date'] = parsed_date_info[0]
+            values['end_date_precision'] = parsed_date_info[1]
 
-        new_data.ended = data.get('ended', False)
-        new_data.country_id = data.get('country_id')
-        new_data.publisher_type_id =\
+        values['ended'] = data.get('ended', False)
+        values['country_id'] = data.get('country_id')
+        values['publisher_type_id'] =\
             data.get('publisher_type', {}).get('publisher_type_id')
 
-        return new_data
+        return values
 
-    def update(self, data, session):
-        new_data = super(PublisherData, self).update(data, session)
+    def update(self, data, session, resolver=None):
+        new_data = super(PublisherData, self).update(data, session, resolver)
 
         parsed_date_info = parse_date_string(data.get('begin_date'))
         if parsed_date_info is not None:
@@ -633,7 +875,8 @@ class PublisherData(EntityData):
             new_data.publisher_type_id =\
                 data['publisher_type']['publisher_type_id']
 
-        if new_data == self:
+        if new_data.same_content(self):
+            new_data.discard()
             return self
         else:
             return new_data
@@ -748,6 +991,29 @@ class EditionData(EntityData):
 
         return False
 
+    def _fingerprint_columns(self):
+        columns = super(EditionData, self)._fingerprint_columns()
+        columns['publication_gid'] = related_key(
+            self, 'publication', 'publication_gid', 'entity_gid'
+        )
+        columns['publisher_gid'] = related_key(
+            self, 'publisher', 'publisher_gid', 'entity_gid'
+        )
+        return columns
+
+    @classmethod
+    def fingerprint_values(cls, columns):
+        values = super(EditionData, cls).fingerprint_values(columns)
+        values.extend([
+            columns['release_date'], columns['release_date_precision'],
+            columns['pages'], columns['width'], columns['height'],
+            columns['depth'], columns['weight'], columns['country_id'],
+            columns['edition_format_id'], columns['edition_status_id'],
+            columns['language_id'], columns['publication_gid'],
+            columns['publisher_gid']
+        ])
+        return values
+
     def diff(self, other):
         data = {
             'release_date': (
@@ -776,49 +1042,75 @@ class EditionData(EntityData):
         return result
 
     @classmethod
-    def create(cls, data, session):
-        new_data = super(EditionData, cls).create(data, session)
+    def references(cls, data):
+        references = super(EditionData, cls).references(data)
+        references.append((Publication, data.get('publication')))
+        references.append((Publisher, data.get('publisher')))
+        return references
 
-        publication_gid = data.get('publication')
-        if publication_gid is None:
-            return None
+    @classmethod
+    def creates_data(cls, data):
+        return data.get('publication') is not None
 
-        publication =\
-            session.query(Publication).filter_by(entity_gid=publication_gid).one()
-        new_data.publication = publication
+    @classmethod
+    def column_values(cls, data, resolver):
+        values = super(EditionData, cls).column_values(data, resolver)
+
+        # The gids are taken from the rows found, so that a missing
+        # publication or publisher raises NoResultFound
+        values['publication_gid'] =\
+            resolver.one(Publication, data['publication']).entity_gid
 
         #new_data.creator_credit =\
         #    CreatorCredit.create(data.get('creator_credit'), session)
         parsed_date_info = parse_date_string(data.get('release_date'))
         if parsed_date_info is not None:
-            new_data.release_date = parsed_date_info[0]
-            new_data.release_date_precision = parsed_date_info[1]
+            values['release_date'] = parsed_date_info[0]
+            values['release_date_precision'] = parsed_date_info[1]
 
-        new_data.pages = data.get('pages')
-        new_data.width = data.get('width')
-        new_data.height = data.get('height')
-        new_data.depth = data.get('depth')
-        new_data.weight = data.get('weight')
+        values['pages'] = data.get('pages')
+        values['width'] = data.get('width')
+        values['height'] = data.get('height')
+        values['depth'] = data.get('depth')
+        values['weight'] = data.get('weight')
 
-        new_data.country_id = data.get('country_id')
-        new_data.language_id =\
+        values['country_id'] = data.get('country_id')
+        values['language_id'] =\
             data.get('language', {}).get('language_id')
-        new_data.edition_format_id =\
+        values['edition_format_id'] =\
             data.get('edition_format', {}).get('edition_format_id')
-        new_data.edition_status_id =\
+        values['edition_status_id'] =\
             data.get('edition_status', {}).get('edition_status_id')
 
         publisher_gid = data.get('publisher')
         if publisher_gid is not None:
-            publisher = session.query(Publisher)\
-                .filter_by(entity_gid=publisher_gid).one()
+            values['publisher_gid'] =\
+                resolver.one(Publisher, publisher_gid).entity_gid
+
+        return values
+
+    @classmethod
+    def create(cls, data, session, resolver=None):
+        if not cls.creates_data(data):
+            return None
+
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
+        new_data = super(EditionData, cls).create(data, session, resolver)
 
-            new_data.publisher = publisher
+        # The related rows were found by column_values
+        new_data.publication = resolver.one(Publication, data['publication'])
+        if new_data.publisher_gid is not None:
+            new_data.publisher = resolver.one(Publisher, data['publisher'])
 
         return new_data
 
-    def update(self, data, session):
-        new_data = super(EditionData, self).update(data, session)
+    def update(self, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
+        new_data = super(EditionData, self).update(data, session, resolver)
 
         parsed_date_info = parse_date_string(data.get('release_date'))
         if parsed_date_info is not None:
@@ -849,18 +1141,16 @@ class EditionData(EntityData):
                 ('language_id' in data['language'])):
             new_data.language_id = data['language']['language_id']
         if 'publication' in data:
-            publication = session.query(Publication).\
-                filter_by(entity_gid=data['publication']).one()
-            new_data.publication = publication
+            new_data.publication =\
+                resolver.one(Publication, data['publication'])
         if 'publisher' in data:
             if data['publisher'] is None:
                 new_data.publisher = None
             else:
-                publisher = session.query(Publisher).\
-                    filter_by(entity_gid=data['publisher']).one()
-                new_data.publisher = publisher
+                new_data.publisher = resolver.one(Publisher, data['publisher'])
 
-        if new_data == self:
+        if new_data.same_content(self):
+            new_data.discard()
             return self
         else:
             return new_data
@@ -930,6 +1220,21 @@ class WorkData(EntityData):
 
         return False
 
+    def _fingerprint_columns(self):
+        columns = super(WorkData, self)._fingerprint_columns()
+        columns['languages'] = [language.id for language in self.languages]
+        return columns
+
+    @classmethod
+    def fingerprint_values(cls, columns):
+        values = super(WorkData, cls).fingerprint_values(columns)
+        values.extend([
+            columns['work_type_id'],
+            u','.join(unicode(language_id) for language_id in
+                      sorted(columns['languages']))
+        ])
+        return values
+
     def diff(self, other):
         other_languages = getattr(other, 'languages', [])
         data = {
@@ -946,24 +1251,70 @@ class WorkData(EntityData):
 
 
     @classmethod
-    def create(cls, data, session):
-        new_data = super(WorkData, cls).create(data, session)
+    def references(cls, data):
+        references = super(WorkData, cls).references(data)
 
-        new_data.country_id = data.get('country_id')
-        new_data.language_id = data.get('language_id')
-        new_data.work_type_id =\
+        # Creation data holds language objects, update data holds pairs of
+        # (removed, added) language IDs
+        for language_data in data.get('languages', []):
+            if isinstance(language_data, dict):
+                language_id = language_data.get('language_id')
+            else:
+                language_id = language_data[1]
+
+            references.append((Language, language_id))
+
+        return references
+
+    @classmethod
+    def column_values(cls, data, resolver):
+        values = super(WorkData, cls).column_values(data, resolver)
+
+        values['work_type_id'] =\
             data.get('work_type', {}).get('work_type_id')
 
+        return values
+
+    @classmethod
+    def association_values(cls, data, resolver):
+        values = super(WorkData, cls).association_values(data, resolver)
+
+        for model, key in cls.references(data):
+            resolver.add(model, key)
+
+        # Languages which don't exist are skipped
+        language_ids = []
         for language_data in data.get('languages', []):
             language_id = language_data['language_id']
-            language = session.query(Language).get(language_id)
-            if language is not None:
-                new_data.languages.append(language)
+            if resolver.get(Language, language_id) is not None:
+                language_ids.append(language_id)
+
+        values['languages'] = language_ids
+        return values
+
+    @classmethod
+    def create(cls, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
+        new_data = super(WorkData, cls).create(data, session, resolver)
+
+        new_data.country_id = data.get('country_id')
+        new_data.language_id = data.get('language_id')
+
+        for language_id in cls.association_values(data, resolver)['languages']:
+            new_data.languages.append(resolver.get(Language, language_id))
 
         return new_data
 
-    def update(self, data, session):
-        new_data = super(WorkData, self).update(data, session)
+    def update(self, data, session, resolver=None):
+        if resolver is None:
+            resolver = ReferenceResolver(session)
+
+        new_data = super(WorkData, self).update(data, session, resolver)
+
+        for model, key in self.references(data):
+            resolver.add(model, key)
 
         if 'country_id' in data:
             new_data.country_id = data['country_id']
@@ -978,11 +1329,12 @@ class WorkData(EntityData):
             new_data.languages = [x for x in new_data.languages if x.id not in removed_language_ids]
 
             for language_id in added_language_ids:
-                language = session.query(Language).get(language_id)
+                language = resolver.get(Language, language_id)
                 if language is not None:
                     new_data.languages.append(language)
 
-        if new_data == self:
+        if new_data.same_content(self):
+            new_data.discard()
             return self
         else:
             return new_data
@@ -1002,3 +1354,13 @@ class WorkType(Base):
 
     work_type_id = Column(Integer, primary_key=True)
     label = Column(UnicodeText, nullable=False, unique=True)
+
+
+@event.listens_for(EntityData, 'before_insert', propagate=True)
+def _set_fingerprint(mapper, connection, target):
+    target.fingerprint = target.compute_fingerprint()
+
+
+@event.listens_for(CreatorCredit, 'before_insert')
+def _set_credit_content_hash(mapper, connection, target):
+    target.content_hash = hash_value_key(target.value_key)
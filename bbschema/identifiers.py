@@ -0,0 +1,221 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module specifies a class, IdentifierEngine, which validates identifier
+values and detects the identifier types of raw strings, using the compiled
+regexes of each IdentifierType."""
+
+import re
+import sre_constants
+import sre_parse
+
+from bbschema.entity import IdentifierType
+
+
+def _refers_to_groups(node):
+    """Returns whether a node of a parsed regex, or any node within it, is a
+    backreference or a conditional on a group."""
+    if isinstance(node, sre_parse.SubPattern):
+        node = node.data
+
+    if isinstance(node, (list, tuple)):
+        if node and node[0] in (sre_constants.GROUPREF,
+                                sre_constants.GROUPREF_EXISTS):
+            return True
+        return any(_refers_to_groups(child) for child in node)
+
+    return False
+
+
+def _embeddable(regex):
+    """Returns whether regex can be embedded in a combined pattern. Inline
+    flags would apply to the whole pattern, rather than to regex alone,
+    backreferences would refer to renumbered groups, and the names of named
+    groups could clash."""
+    try:
+        parsed = sre_parse.parse(regex)
+    except (sre_constants.error, AssertionError, OverflowError):
+        return False
+
+    return not (parsed.pattern.flags or parsed.pattern.groupdict or
+                _refers_to_groups(parsed))
+
+
+class _CompiledType(object):
+    def __init__(self, identifier_type):
+        self.identifier_type_id = identifier_type.identifier_type_id
+        self.entity_type = identifier_type.entity_type
+        self.detection_regex = identifier_type.detection_regex
+        self.validation = re.compile(identifier_type.validation_regex)
+
+        if self.detection_regex:
+            self.detection = re.compile(self.detection_regex)
+        else:
+            self.detection = None
+
+    def detected_value(self, match, group):
+        # The value is the first group of the regex, or the whole match
+        if self.detection.groups:
+            return match.group(group + 1)
+
+        return match.group(group)
+
+
+class _Detector(object):
+    """Matches all of the detection regexes of an entity type against a
+    string in a single pass, using a pattern made of one optional lookahead
+    per type. Types with regexes which can't be combined are matched
+    separately."""
+
+    def __init__(self, compiled_types):
+        self.compiled_types = sorted(compiled_types,
+                                     key=lambda t: t.identifier_type_id)
+
+        combined = [t for t in self.compiled_types
+                    if _embeddable(t.detection_regex)]
+
+        self.pattern = None
+        if combined:
+            try:
+                self.pattern = re.compile(''.join(
+                    r'(?:(?=[\s\S]*?(?P<t{}>{}))|)'.format(
+                        t.identifier_type_id, t.detection_regex
+                    ) for t in combined
+                ))
+            except (re.error, AssertionError, OverflowError):
+                # For example, too many groups
+                combined = []
+
+        self.combined = combined
+        self.separate = [t for t in self.compiled_types if t not in combined]
+
+    def detect(self, value):
+        found = {}
+        if self.combined:
+            match = self.pattern.match(value)
+            for compiled_type in self.combined:
+                group = self.pattern.groupindex[
+                    't{}'.format(compiled_type.identifier_type_id)
+                ]
+                if match.group(group) is not None:
+                    found[compiled_type.identifier_type_id] =\
+                        compiled_type.detected_value(match, group)
+
+        for compiled_type in self.separate:
+            match = compiled_type.detection.search(value)
+            if match is not None:
+                found[compiled_type.identifier_type_id] =\
+                    compiled_type.detected_value(match, 0)
+
+        return [(t.identifier_type_id, found[t.identifier_type_id])
+                for t in self.compiled_types if t.identifier_type_id in found]
+
+
+class IdentifierEngine(object):
+    """Validates identifiers and detects identifier types from raw strings.
+
+    Every IdentifierType is loaded and compiled the first time the engine is
+    used, unless a list of identifier types is given, in which case the
+    session is only used to reload types which have been invalidated. The
+    detection regexes of each entity type are combined, so that detect makes
+    a single pass over the string.
+
+    Regexes are matched with search semantics, as in JavaScript's
+    RegExp.test, so a validation regex must be anchored to match whole values.
+    """
+
+    def __init__(self, session, identifier_types=None):
+        self.session = session
+        self._compiled = {}
+        self._detectors = {}
+        self._stale = set()
+        self._loaded = False
+
+        if identifier_types is not None:
+            for identifier_type in identifier_types:
+                self._add(identifier_type)
+            self._loaded = True
+
+    def _add(self, identifier_type):
+        compiled_type = _CompiledType(identifier_type)
+        self._compiled[compiled_type.identifier_type_id] = compiled_type
+
+    def _load(self):
+        if not self._loaded:
+            for identifier_type in self.session.query(IdentifierType):
+                self._add(identifier_type)
+            self._loaded = True
+
+        if self._stale:
+            query = self.session.query(IdentifierType).populate_existing()
+            for identifier_type in query.filter(
+                    IdentifierType.identifier_type_id.in_(self._stale)):
+                self._add(identifier_type)
+            self._stale = set()
+
+    def invalidate(self, identifier_type_id=None):
+        """Discards the compiled regexes of an identifier type, or of all
+        types if no ID is given, so that they are reloaded when next used."""
+        if identifier_type_id is None:
+            self._compiled = {}
+            self._loaded = False
+            self._stale = set()
+        else:
+            self._compiled.pop(identifier_type_id, None)
+            self._stale.add(identifier_type_id)
+
+        # The type may have moved to another entity type, or been deleted
+        self._detectors = {}
+
+    def _compiled_type(self, identifier_type_id):
+        self._load()
+        compiled_type = self._compiled.get(identifier_type_id)
+        if compiled_type is None:
+            raise ValueError(
+                'Unknown identifier type: {}'.format(identifier_type_id)
+            )
+
+        return compiled_type
+
+    def validate(self, identifier_type_id, value):
+        """Returns True if value matches the validation regex of the
+        identifier type. Raises ValueError if there is no such type."""
+        compiled_type = self._compiled_type(identifier_type_id)
+        return compiled_type.validation.search(value) is not None
+
+    def validate_many(self, values):
+        """Returns a list of booleans, one for each of the
+        (identifier type ID, value) pairs in values, as for validate."""
+        return [self.validate(identifier_type_id, value)
+                for identifier_type_id, value in values]
+
+    def detect(self, value, entity_type):
+        """Returns a list of (identifier type ID, identifier value) pairs for
+        the identifier types of entity_type whose detection regexes match
+        value, ordered by type ID. The identifier value is the first group
+        of the detection regex, or the whole match if it has no groups."""
+        self._load()
+
+        detector = self._detectors.get(entity_type)
+        if detector is None:
+            detector = _Detector([
+                t for t in self._compiled.values()
+                if t.entity_type == entity_type and t.detection is not None
+            ])
+            self._detectors[entity_type] = detector
+
+        return detector.detect(value)
@@ -0,0 +1,187 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module records the SQL statements issued through an engine, so that
+the cost of the functions of this package can be measured. Nothing is
+recorded unless a QueryRecorder is started, or a query_budget is entered."""
+
+import sys
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+# Statements which are issued from outside this package are grouped under this
+# caller
+OTHER_CALLER = 'other'
+
+# The functions of SQLAlchemy which load attributes on access
+LAZY_LOADERS = set([
+    ('sqlalchemy.orm.strategies', '_load_for_state'),
+    ('sqlalchemy.orm.loading', 'load_scalar_attributes')
+])
+
+# Lazy loads from these methods are flagged, since comparisons and diffs are
+# often made for many objects at once, with a query for each
+FLAGGED_METHODS = set(['__eq__', '__ne__', 'diff'])
+
+
+Statement = namedtuple('Statement', ['statement', 'parameters', 'duration',
+                                     'callers', 'lazy', 'flagged'])
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def _function_name(frame):
+    code = frame.f_code
+    if 'self' in frame.f_locals:
+        cls = type(frame.f_locals['self'])
+    elif 'cls' in frame.f_locals and isinstance(frame.f_locals['cls'], type):
+        cls = frame.f_locals['cls']
+    else:
+        return '{}.{}'.format(frame.f_globals.get('__name__'), code.co_name)
+
+    return '{}.{}.{}'.format(cls.__module__, cls.__name__, code.co_name)
+
+
+def _inspect_stack():
+    """Returns the functions of this package on the calling stack, innermost
+    first, whether the statement is a lazy load, and whether the lazy load was
+    made by one of the FLAGGED_METHODS."""
+    callers = []
+    lazy = False
+    flagged = False
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get('__name__', '')
+        if (module, frame.f_code.co_name) in LAZY_LOADERS:
+            lazy = True
+        elif module.startswith('bbschema.') and module != __name__:
+            callers.append(_function_name(frame))
+            if lazy and frame.f_code.co_name in FLAGGED_METHODS:
+                flagged = True
+
+        frame = frame.f_back
+
+    return tuple(callers) or (OTHER_CALLER,), lazy, flagged
+
+
+class QueryRecorder(object):
+    """Records the statements executed through bind, which is an Engine or a
+    Connection, while started. Sessions use the engine they are bound to, so a
+    session's statements are recorded by a recorder of session.get_bind().
+
+    Each statement is recorded with its duration, the functions of this
+    package on the stack when it was issued, innermost first, and whether it
+    was a lazy load. Lazy loads made by __eq__, __ne__ or diff are flagged.
+    Statements executed by other threads through the same engine are also
+    recorded.
+    """
+
+    def __init__(self, bind):
+        self.bind = bind
+        self.statements = []
+
+    def start(self):
+        event.listen(self.bind, 'before_cursor_execute', self._before)
+        event.listen(self.bind, 'after_cursor_execute', self._after)
+
+    def stop(self):
+        event.remove(self.bind, 'before_cursor_execute', self._before)
+        event.remove(self.bind, 'after_cursor_execute', self._after)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _before(self, conn, cursor, statement, parameters, context,
+                executemany):
+        # The start is kept on the execution, since statements of other
+        # threads may start and finish in between. The statements issued
+        # while a dialect is initialized have no execution context
+        if context is not None:
+            context._query_start_time = time.time()
+
+    def _after(self, conn, cursor, statement, parameters, context,
+               executemany):
+        start = getattr(context, '_query_start_time', None)
+        duration = 0.0 if start is None else time.time() - start
+        callers, lazy, flagged = _inspect_stack()
+
+        self.statements.append(Statement(statement, parameters, duration,
+                                         callers, lazy, flagged))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def flagged(self):
+        """The lazy loads made by __eq__, __ne__ or diff."""
+        return [s for s in self.statements if s.flagged]
+
+    def by_caller(self):
+        """Returns a dictionary of the number of statements issued directly by
+        each function, and the total time they took, in seconds."""
+        result = {}
+        for statement in self.statements:
+            caller = statement.callers[0]
+            count, duration = result.get(caller, (0, 0.0))
+            result[caller] = (count + 1, duration + statement.duration)
+
+        return result
+
+    def export(self, sink, prefix='bbschema'):
+        """Sends the counts and times of the statements of each function to a
+        metrics sink, which is any object with incr(name, count) and
+        timing(name, milliseconds) methods, such as a statsd client."""
+        for caller, (count, duration) in sorted(self.by_caller().items()):
+            name = '{}.{}'.format(prefix, caller)
+            sink.incr(name + '.queries', count)
+            sink.timing(name + '.query_time', duration * 1000)
+
+        sink.incr(prefix + '.flagged_lazy_loads', len(self.flagged))
+
+
+@contextmanager
+def query_budget(bind, limit, caller=None):
+    """Raises QueryBudgetExceeded if more than limit statements are executed
+    through bind within the context. If caller is given, only the statements
+    issued within calls to that function, such as
+    'bbschema.entity_data.EditionData.update', are counted."""
+    recorder = QueryRecorder(bind)
+    with recorder:
+        yield recorder
+
+    statements = [s for s in recorder.statements
+                  if caller is None or caller in s.callers]
+
+    if len(statements) > limit:
+        raise QueryBudgetExceeded(
+            '{} statements were executed, but the budget was {}:\n{}'.format(
+                len(statements), limit,
+                '\n'.join('{}: {}'.format(s.callers[0], s.statement)
+                          for s in statements)
+            )
+        )
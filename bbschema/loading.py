@@ -0,0 +1,168 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module contains named loader profiles, which eagerly load the entity
+data needed for a purpose, such as displaying an edition or listing entities,
+so that a query for any number of entities loads everything it needs with a
+fixed number of queries, rather than a lazy load for each attribute of each
+entity.
+
+A profile is applied to a query for entities, entity revisions or entity
+data with its apply method:
+
+    editions = FULL_EDITION.apply(session.query(Edition)).all()
+
+Many-to-one relationships are loaded with joins, and collections with a
+subquery each, since selectin loading isn't available in the version of
+SQLAlchemy used."""
+
+from bbschema.entity import Entity
+from bbschema.entity_data import (CreatorData, EditionData, EntityData,
+                                  PublicationData, PublisherData, WorkData)
+from bbschema.revision import EntityRevision
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, subqueryload
+
+JOINED = 'joined'
+SUBQUERY = 'subquery'
+
+
+class LoaderProfile(object):
+    """A set of relationships of a subclass of EntityData to be loaded along
+    with it. Each path is a list of (strategy, attribute name) pairs,
+    starting from the data class. Entity paths are loaded from the entity,
+    when entities are queried."""
+
+    def __init__(self, name, data_cls, paths, entity_paths=()):
+        self.name = name
+        self.data_cls = data_cls
+        self.paths = [list(path) for path in paths]
+        self.entity_paths = [list(path) for path in entity_paths]
+
+    def extend(self, name, data_cls, paths=(), entity_paths=()):
+        """Returns a new profile for data_cls, which loads the paths of this
+        profile and those given."""
+        return LoaderProfile(name, data_cls, self.paths + list(paths),
+                             self.entity_paths + list(entity_paths))
+
+    def __repr__(self):
+        return '<LoaderProfile {}>'.format(self.name)
+
+    @staticmethod
+    def _chain(option, cls, path):
+        for strategy, name in path:
+            attribute = getattr(cls, name)
+            if option is None:
+                loader = joinedload if strategy == JOINED else subqueryload
+                option = loader(attribute)
+            elif strategy == JOINED:
+                option = option.joinedload(attribute)
+            else:
+                option = option.subqueryload(attribute)
+
+            cls = attribute.property.mapper.class_
+
+        return option
+
+    def data_options(self, parent=None):
+        """Returns the loader options for the paths from the data, chained
+        from parent, an option which loads the data, if given."""
+        return [self._chain(parent, self.data_cls, path)
+                for path in self.paths]
+
+    def revision_options(self, parent=None):
+        """Returns the loader options for loading the data of revisions."""
+        entity_data = EntityRevision.entity_data
+        if self.data_cls is not EntityData:
+            entity_data = entity_data.of_type(self.data_cls)
+
+        if parent is None:
+            option = joinedload(entity_data)
+        else:
+            option = parent.joinedload(entity_data)
+
+        return [option] + self.data_options(option)
+
+    def entity_options(self, entity_cls=Entity):
+        """Returns the loader options for loading the master data of
+        entities of entity_cls."""
+        option = joinedload(entity_cls.master_revision)
+        return ([option] + self.revision_options(option) +
+                [self._chain(None, entity_cls, path)
+                 for path in self.entity_paths])
+
+    def apply(self, query):
+        """Returns query with the options of this profile for the class of
+        its first entity, which may be an Entity, an EntityRevision or an
+        EntityData subclass."""
+        cls = inspect(query.column_descriptions[0]['entity']).class_
+        if issubclass(cls, Entity):
+            options = self.entity_options(cls)
+        elif issubclass(cls, EntityRevision):
+            options = self.revision_options()
+        elif issubclass(cls, EntityData):
+            options = self.data_options()
+        else:
+            raise ValueError(
+                '{} can\'t be loaded with a profile'.format(cls.__name__)
+            )
+
+        return query.options(*options)
+
+
+# The default name and disambiguation, for listing entities of any type
+SUMMARY = LoaderProfile('SUMMARY', EntityData, [
+    [(JOINED, 'default_alias')],
+    [(JOINED, 'disambiguation')]
+])
+
+# Everything shared by the data of every type of entity
+FULL = SUMMARY.extend('FULL', EntityData, [
+    [(JOINED, 'annotation')],
+    [(SUBQUERY, 'aliases'), (JOINED, 'language')],
+    [(SUBQUERY, 'identifiers'), (JOINED, 'identifier_type')]
+])
+
+FULL_CREATOR = FULL.extend('FULL_CREATOR', CreatorData, [
+    [(JOINED, 'gender')],
+    [(JOINED, 'creator_type')]
+])
+
+FULL_EDITION = FULL.extend('FULL_EDITION', EditionData, [
+    [(JOINED, 'language')],
+    [(JOINED, 'edition_format')],
+    [(JOINED, 'edition_status')],
+    [(JOINED, 'creator_credit'), (SUBQUERY, 'names'), (JOINED, 'creator')],
+    [(JOINED, 'publication')],
+    [(JOINED, 'publisher')]
+], entity_paths=[
+    [(JOINED, 'publication')],
+    [(JOINED, 'publisher')]
+])
+
+FULL_PUBLICATION = FULL.extend('FULL_PUBLICATION', PublicationData, [
+    [(JOINED, 'publication_type')]
+])
+
+FULL_PUBLISHER = FULL.extend('FULL_PUBLISHER', PublisherData, [
+    [(JOINED, 'publisher_type')]
+])
+
+FULL_WORK = FULL.extend('FULL_WORK', WorkData, [
+    [(JOINED, 'work_type')],
+    [(SUBQUERY, 'languages')]
+])
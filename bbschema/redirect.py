@@ -0,0 +1,185 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module resolves the gids of entities which have been merged into
+other entities to the gids of the entities they now refer to, following
+chains of EntityRedirects. Recent resolutions are cached in the process, and
+the cache is cleared whenever a transaction which wrote an EntityRedirect
+ends."""
+
+import threading
+import uuid
+from collections import OrderedDict
+
+from bbschema.entity import EntityRedirect
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+# The number of resolutions kept in the cache
+CACHE_SIZE = 10000
+
+# The key in Session.info marking a session whose transaction has written
+# redirects, which other sessions can't see until they're committed
+_WRITES_KEY = 'bbschema.redirect.writes'
+
+# Follows the redirects from each of the given gids, keeping the sources of
+# the redirects followed in path, and returns the last target of each chain.
+# Sources already in the path are not followed, so a cycle can't loop forever
+_RESOLVE_SQL = """
+WITH RECURSIVE chain(source_gid, target_gid, path) AS (
+    SELECT source_gid, target_gid, ARRAY[source_gid]
+    FROM bookbrainz.entity_redirect
+    WHERE source_gid = ANY(CAST(:gids AS UUID[]))
+UNION ALL
+    SELECT c.source_gid, r.target_gid, c.path || r.source_gid
+    FROM chain c
+    JOIN bookbrainz.entity_redirect r ON r.source_gid = c.target_gid
+    WHERE NOT r.source_gid = ANY(c.path)
+)
+SELECT DISTINCT ON (c.source_gid) CAST(c.source_gid AS TEXT),
+    CAST(c.target_gid AS TEXT), CAST(c.path AS TEXT[])
+FROM chain c
+ORDER BY c.source_gid, array_length(c.path, 1) DESC
+"""
+
+# Points each of the given redirects directly at its final target
+_COMPRESS_SQL = """
+UPDATE bookbrainz.entity_redirect r
+SET target_gid = c.target_gid
+FROM unnest(CAST(:sources AS UUID[]), CAST(:targets AS UUID[]))
+    AS c(source_gid, target_gid)
+WHERE r.source_gid = c.source_gid AND r.target_gid <> c.target_gid AND
+    c.source_gid <> c.target_gid
+"""
+
+
+class _LRUCache(object):
+    """A dictionary of at most size items, which discards the least recently
+    used item when full. It may be used by several threads at once."""
+
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.pop(key, None)
+            if value is not None:
+                self._items[key] = value
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = value
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+_cache = _LRUCache(CACHE_SIZE)
+
+
+def clear_redirect_cache():
+    """Clears the cached resolutions. This must be called after redirects are
+    written without the ORM, such as by a script."""
+    _cache.clear()
+
+
+def resolve_gid(session, gids):
+    """Returns a dictionary of the gid of the entity each of the given gids
+    refers to, following chains of redirects, with a single query for the
+    gids which aren't cached. Gids which aren't redirected refer to
+    themselves.
+
+    Chains of more than one redirect which are found are rewritten to point
+    directly at their final targets, in the session's transaction, so that
+    later resolutions follow a single redirect.
+
+    The cache isn't used by sessions with uncommitted redirects, since their
+    resolutions may differ from those of other sessions."""
+    cached = not session.info.get(_WRITES_KEY, False)
+
+    result = {}
+    uncached = {}
+    for gid in gids:
+        key = uuid.UUID(str(gid))
+        target = _cache.get(key) if cached else None
+        if target is None:
+            uncached.setdefault(key, []).append(gid)
+        else:
+            result[gid] = target
+
+    if not uncached:
+        return result
+
+    targets = dict((key, key) for key in uncached)
+    compressed = {}
+    rows = session.execute(
+        _RESOLVE_SQL, {'gids': [str(key) for key in uncached]}
+    )
+    for source_gid, target_gid, path in rows:
+        target_gid = uuid.UUID(target_gid)
+        targets[uuid.UUID(source_gid)] = target_gid
+
+        # Every redirect on a chain of more than one leads to the same target
+        if len(path) > 1:
+            for gid in path:
+                compressed[uuid.UUID(gid)] = target_gid
+
+    if compressed:
+        sources = list(compressed)
+        session.execute(_COMPRESS_SQL, {
+            'sources': [str(gid) for gid in sources],
+            'targets': [str(compressed[gid]) for gid in sources]
+        })
+
+    for key, given in uncached.items():
+        if cached:
+            _cache.set(key, targets[key])
+        for gid in given:
+            result[gid] = targets[key]
+
+    return result
+
+
+@event.listens_for(EntityRedirect, 'after_insert')
+@event.listens_for(EntityRedirect, 'after_update')
+@event.listens_for(EntityRedirect, 'after_delete')
+def _mark_writes(mapper, connection, target):
+    object_session(target).info[_WRITES_KEY] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    # Releasing a savepoint leaves the writes uncommitted
+    if not session.transaction.nested and session.info.pop(_WRITES_KEY, False):
+        clear_redirect_cache()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _after_soft_rollback(session, previous_transaction):
+    # The writes are kept until the outermost transaction ends, since those
+    # made before a savepoint which is rolled back are still uncommitted
+    if previous_transaction.parent is None and \
+            session.info.pop(_WRITES_KEY, False):
+        clear_redirect_cache()
@@ -15,10 +15,13 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import uuid
+
 import sqlalchemy.sql as sql
 from bbschema.base import Base
+from bbschema.entity import diff_values, touch_last_updated
 from sqlalchemy import (Boolean, Column, DateTime, ForeignKey, Integer,
-                        SmallInteger, Unicode, UnicodeText)
+                        SmallInteger, Unicode, UnicodeText, event)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import text
@@ -43,6 +46,10 @@ class Relationship(Base):
     )
 
 
+event.listen(Relationship.master_revision, 'set', touch_last_updated)
+event.listen(Relationship.master_revision_id, 'set', touch_last_updated)
+
+
 class RelationshipType(Base):
     __tablename__ = 'rel_type'
     __table_args__ = {'schema': 'bookbrainz'}
@@ -85,14 +92,8 @@ class RelationshipData(Base):
         data = {
             'relationship_type': (self.relationship_type,
                                   getattr(other, 'relationship_type', None)),
-            'entities': (
-                [e for e in self.entities if e not in other_entities],
-                [e for e in other_entities if e not in self.entities]
-            ),
-            'texts': (
-                [e for e in self.texts if e not in other_texts],
-                [e for e in other_texts if e not in self.texts]
-            )
+            'entities': diff_values(self.entities, other_entities),
+            'texts': diff_values(self.texts, other_texts)
         }
 
         return {k: v for k, v in data.items() if v[0] != v[1]}
@@ -149,6 +150,24 @@ class RelationshipEntity(Base):
 
     entity = relationship('Entity')
 
+    @property
+    def value_key(self):
+        # Relationships created from JSON may hold the GID as a string
+        entity_gid = self.entity_gid
+        if entity_gid is not None and not isinstance(entity_gid, uuid.UUID):
+            entity_gid = uuid.UUID(entity_gid)
+
+        return (self.position, entity_gid)
+
+    def __eq__(self, other):
+        if other is None:
+            return False
+
+        return self.value_key == other.value_key
+
+    def __ne__(self, other):
+        return not self == other
+
 
 class RelationshipText(Base):
     __tablename__ = 'rel_text'
@@ -161,3 +180,16 @@ class RelationshipText(Base):
     position = Column(SmallInteger, primary_key=True)
 
     text = Column(UnicodeText, nullable=False)
+
+    @property
+    def value_key(self):
+        return (self.position, self.text)
+
+    def __eq__(self, other):
+        if other is None:
+            return False
+
+        return self.value_key == other.value_key
+
+    def __ne__(self, other):
+        return not self == other
@@ -0,0 +1,185 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""This module specifies a class, ReferenceResolver, which looks up the rows
+referenced by a batch of revision JSON documents using a single query per
+referenced model, rather than one query per reference. It also interns value
+rows, so that identical aliases, identifiers, annotations and disambiguations
+share a single row."""
+
+import uuid
+from collections import defaultdict
+
+from bbschema.entity import hash_value_key
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import class_mapper
+from sqlalchemy.orm.base import instance_state
+from sqlalchemy.orm.exc import NoResultFound
+
+
+class ReferenceResolver(object):
+    """Collects the keys of rows referenced by revision JSON, and resolves
+    them with one IN (...) query per model the first time any of them is
+    requested.
+
+    A resolver may be passed to the create and update methods of EntityData
+    and its subclasses. If all documents in a batch are registered with
+    add_documents before the first create or update call, each referenced
+    model is only queried once for the whole batch.
+
+    New value rows passed to intern or intern_all are replaced by existing rows
+    with the same content, found by their content hash. If intern_values is
+    False, value rows are returned unchanged, so that a caller creating many
+    rows at once can intern them all in one call afterwards.
+    """
+
+    def __init__(self, session, intern_values=True):
+        self.session = session
+        self.intern_values = intern_values
+        self._pending = defaultdict(set)
+        self._resolved = defaultdict(dict)
+        self._pending_values = defaultdict(set)
+        self._values = defaultdict(dict)
+
+    @staticmethod
+    def _key_column(model):
+        return class_mapper(model).primary_key[0]
+
+    def _coerce(self, model, key):
+        column = self._key_column(model)
+        if isinstance(column.type, UUID) and not isinstance(key, uuid.UUID):
+            return uuid.UUID(key)
+
+        return key
+
+    def add(self, model, key):
+        """Registers a key of model to be looked up with the next query for
+        that model."""
+        if key is None:
+            return
+
+        key = self._coerce(model, key)
+        if key not in self._resolved[model]:
+            self._pending[model].add(key)
+
+    def add_documents(self, data_cls, documents):
+        """Registers every key referenced by a batch of revision JSON
+        documents, which are to be passed to data_cls.create or update."""
+        for document in documents:
+            for model, key in data_cls.references(document):
+                self.add(model, key)
+
+    def resolve(self):
+        """Looks up all pending keys, issuing one query per model."""
+        for model in list(self._pending.keys()):
+            self._resolve_model(model)
+
+    def _resolve_model(self, model):
+        keys = self._pending.pop(model, None)
+        if not keys:
+            return
+
+        column = self._key_column(model)
+        attribute = class_mapper(model).get_property_by_column(column).key
+
+        resolved = self._resolved[model]
+        for key in keys:
+            resolved[key] = None
+
+        with self.session.no_autoflush:
+            rows = self.session.query(model).filter(column.in_(keys)).all()
+
+        for row in rows:
+            resolved[getattr(row, attribute)] = row
+
+    def get(self, model, key):
+        """Returns the row of model with the given key, or None if there is
+        no such row, like Query.get."""
+        if key is None:
+            return None
+
+        key = self._coerce(model, key)
+        resolved = self._resolved[model]
+        if key not in resolved:
+            self._pending[model].add(key)
+            self._resolve_model(model)
+
+        return resolved[key]
+
+    def one(self, model, key):
+        """Returns the row of model with the given key, raising NoResultFound
+        if there is no such row, like Query.one."""
+        result = self.get(model, key)
+        if result is None:
+            raise NoResultFound("No row was found for one()")
+
+        return result
+
+    def _resolve_values(self, model):
+        hashes = self._pending_values.pop(model, None)
+        if not hashes:
+            return
+
+        values = self._values[model]
+        for content_hash in hashes:
+            values[content_hash] = []
+
+        with self.session.no_autoflush:
+            rows = self.session.query(model).filter(
+                model.content_hash.in_(hashes)
+            ).all()
+
+        for row in rows:
+            values[row.content_hash].append(row)
+
+    def _canonical(self, value):
+        candidates = self._values[type(value)][value.content_hash]
+        for candidate in candidates:
+            if candidate is value or candidate.value_key == value.value_key:
+                return candidate
+
+        # Later values with the same content will share this one
+        candidates.append(value)
+        return value
+
+    def intern_all(self, values):
+        """Returns a list of the rows to use in place of values, in which each
+        new value row is replaced by an existing row with the same content, if
+        there is one. Each model of value row is queried at most once."""
+        values = list(values)
+        if not self.intern_values:
+            return values
+
+        new_values = [value for value in values if value is not None and
+                      not instance_state(value).has_identity]
+
+        for value in new_values:
+            value.content_hash = hash_value_key(value.value_key)
+            if value.content_hash not in self._values[type(value)]:
+                self._pending_values[type(value)].add(value.content_hash)
+
+        for model in list(self._pending_values.keys()):
+            self._resolve_values(model)
+
+        new_ids = set(id(value) for value in new_values)
+        return [self._canonical(value) if id(value) in new_ids else value
+                for value in values]
+
+    def intern(self, value):
+        """Returns the row to use in place of a single value row, as for
+        intern_all."""
+        return self.intern_all([value])[0]
@@ -22,16 +22,21 @@ are changes to the database."""
 import sqlalchemy.orm
 import sqlalchemy.sql as sql
 from bbschema.base import Base
-from sqlalchemy import (Column, DateTime, ForeignKey, Integer, SmallInteger,
-                        UnicodeText)
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer,
+                        SmallInteger, UnicodeText)
 from sqlalchemy.dialects.postgresql import UUID
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import (foreign, mapper, object_session, relationship,
+                            with_polymorphic)
 from sqlalchemy.sql import select, text
 
 
 class RevisionNote(Base):
     __tablename__ = 'revision_note'
-    __table_args__ = {'schema': 'bookbrainz'}
+    __table_args__ = (
+        Index('ix_bookbrainz_revision_note_revision_id_posted_at',
+              'revision_id', 'posted_at'),
+        {'schema': 'bookbrainz'}
+    )
 
     revision_note_id = Column(Integer, primary_key=True)
 
@@ -60,13 +65,7 @@ class Revision(Base):
                         server_default=text("(now() AT TIME ZONE 'UTC')"))
 
     parent_id = Column(Integer, ForeignKey('bookbrainz.revision.revision_id',
-                                           deferrable=True))
-
-    note = sqlalchemy.orm.column_property(
-        select([RevisionNote.content]).where(
-            RevisionNote.revision_id == revision_id
-        ).order_by(RevisionNote.posted_at).limit(1)
-    )
+                                           deferrable=True), index=True)
 
     notes = relationship('RevisionNote')
     user = relationship('User', backref='revisions')
@@ -80,6 +79,112 @@ class Revision(Base):
         'polymorphic_on': _type
     }
 
+    @property
+    def note(self):
+        """The content of the first note posted on this revision, or None if
+        there are no notes."""
+        if self.first_note is None:
+            return None
+
+        return self.first_note.content
+
+    @staticmethod
+    def _ancestry_cte(revision_id, name, limit=None):
+        """Returns a recursive CTE of the revision with the given ID and its
+        ancestors, up to limit hops away, with their distance from it."""
+        revision = Revision.__table__
+
+        ancestry = select([
+            revision.c.revision_id, revision.c.parent_id,
+            sql.literal_column('0', Integer).label('depth')
+        ]).where(revision.c.revision_id == revision_id).cte(
+            name, recursive=True
+        )
+
+        parent = revision.alias()
+        step = select([
+            parent.c.revision_id, parent.c.parent_id, ancestry.c.depth + 1
+        ]).where(parent.c.revision_id == ancestry.c.parent_id)
+
+        if limit is not None:
+            step = step.where(ancestry.c.depth < limit)
+
+        return ancestry.union_all(step)
+
+    @staticmethod
+    def _descendant_cte(revision_id, name):
+        """Returns a recursive CTE of the revision with the given ID and its
+        descendants, with their distance from it."""
+        revision = Revision.__table__
+
+        descendants = select([
+            revision.c.revision_id,
+            sql.literal_column('0', Integer).label('depth')
+        ]).where(revision.c.revision_id == revision_id).cte(
+            name, recursive=True
+        )
+
+        child = revision.alias()
+        step = select([
+            child.c.revision_id, descendants.c.depth + 1
+        ]).where(child.c.parent_id == descendants.c.revision_id)
+
+        return descendants.union_all(step)
+
+    def _query_related(self, cte):
+        # Loads the columns of every subclass, so that the revisions don't
+        # each need another query when their subclass columns are accessed
+        revisions = with_polymorphic(Revision, '*')
+        return object_session(self).query(revisions).join(
+            cte, revisions.revision_id == cte.c.revision_id
+        )
+
+    def ancestors(self, limit=None):
+        """Returns a list of the ancestors of this revision, starting with its
+        parent, using a single query. If limit is given, at most that many
+        ancestors are returned."""
+        cte = self._ancestry_cte(self.revision_id, 'ancestors', limit)
+        return self._query_related(cte).filter(
+            cte.c.depth > 0
+        ).order_by(cte.c.depth).all()
+
+    def descendants(self):
+        """Returns a list of the descendants of this revision, using a single
+        query. Revisions nearer to this one come first."""
+        cte = self._descendant_cte(self.revision_id, 'descendants')
+        return self._query_related(cte).filter(
+            cte.c.depth > 0
+        ).order_by(cte.c.depth, cte.c.revision_id).all()
+
+    def common_ancestor(self, other):
+        """Returns the nearest revision which is this revision or one of its
+        ancestors, and also other or one of its ancestors, using a single
+        query. Returns None if the revisions have no common ancestor."""
+        cte = self._ancestry_cte(self.revision_id, 'ancestors')
+        other_cte = self._ancestry_cte(other.revision_id, 'other_ancestors')
+
+        return self._query_related(cte).filter(
+            cte.c.revision_id.in_(select([other_cte.c.revision_id]))
+        ).order_by(cte.c.depth).first()
+
+
+# The first note posted on each revision, mapped separately so that the first
+# notes of many revisions can be loaded with a single join
+_first_notes = select([RevisionNote.__table__]).distinct(
+    RevisionNote.revision_id
+).order_by(RevisionNote.revision_id, RevisionNote.posted_at).alias(
+    'first_revision_note'
+)
+
+_first_note_mapper = mapper(RevisionNote, _first_notes, non_primary=True)
+
+# Loaded on first access, or for a whole query with the option
+# joinedload(Revision.first_note)
+Revision.first_note = relationship(
+    _first_note_mapper, uselist=False, viewonly=True,
+    primaryjoin=Revision.revision_id == foreign(_first_notes.c.revision_id)
+)
+
 
 class EntityRevision(Revision):
     __tablename__ = 'entity_revision'
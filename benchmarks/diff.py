@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" This module times diff_aliases, diff_identifiers and the entity and text
+diffs of RelationshipData against the pairwise comparisons they replaced, for
+lists of 10, 100 and 1000 values. No database is needed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import timeit
+import uuid
+
+import click
+
+from bbschema import (Alias, Identifier, RelationshipData, RelationshipEntity,
+                      RelationshipText)
+from bbschema.entity import diff_aliases, diff_identifiers
+
+SIZES = [10, 100, 1000]
+
+
+def pairwise_diff(left, right):
+    return ([l for l in left if l not in right],
+            [r for r in right if r not in left])
+
+
+def make_aliases(count, offset):
+    return [Alias(name='Alias {}'.format(i), sort_name='Alias {}'.format(i),
+                  language_id=1 + i % 5, primary=False)
+            for i in range(offset, offset + count)]
+
+
+def make_identifiers(count, offset):
+    return [Identifier(identifier_type_id=1 + i % 3,
+                       value='{:010}'.format(i))
+            for i in range(offset, offset + count)]
+
+
+def make_relationship(count, offset):
+    data = RelationshipData(relationship_type_id=1)
+    for i in range(offset, offset + count):
+        data.entities.append(RelationshipEntity(
+            position=i, entity_gid=uuid.UUID(int=i)
+        ))
+        data.texts.append(RelationshipText(position=i,
+                                           text='Text {}'.format(i)))
+
+    return data
+
+
+def relationship_pairwise_diff(left, right):
+    return (pairwise_diff(left.entities, right.entities),
+            pairwise_diff(left.texts, right.texts))
+
+
+@click.command()
+@click.option('--number', default=5,
+              help='the number of times each diff is run per size')
+def benchmark(number):
+    """ Prints the mean time taken by each diff, in milliseconds. Each pair of
+    lists overlaps by half, so that both sides of the diff are non-empty.
+    """
+
+    cases = [
+        ('aliases', make_aliases, diff_aliases, pairwise_diff),
+        ('identifiers', make_identifiers, diff_identifiers, pairwise_diff),
+        ('relationship', make_relationship,
+         lambda left, right: left.diff(right), relationship_pairwise_diff)
+    ]
+
+    print('{:<14}{:>6}{:>14}{:>14}'.format('diff', 'size', 'pairwise/ms',
+                                           'keyed/ms'))
+    for name, make, keyed, pairwise in cases:
+        for size in SIZES:
+            left = make(size, 0)
+            right = make(size, size // 2)
+
+            times = [
+                timeit.timeit(lambda: function(left, right),
+                              number=number) * 1000 / number
+                for function in (pairwise, keyed)
+            ]
+
+            print('{:<14}{:>6}{:>14.3f}{:>14.3f}'.format(name, size, *times))
+
+
+if __name__ == "__main__":
+    benchmark()
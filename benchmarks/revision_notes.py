@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+""" This module times loading revisions with and without their first notes,
+against the correlated subquery which previously loaded the first note of
+every revision. The revisions are created for the benchmark, and rolled back
+once the timings have been taken.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import time
+
+import click
+from sqlalchemy import create_engine
+from sqlalchemy.orm import joinedload, sessionmaker
+from sqlalchemy.sql import select, text
+
+from benchmarks.bulk_import import make_records
+from bbschema import (EntityRevision, IdentifierType, Language, Revision,
+                      RevisionNote, User)
+from bbschema.bulk import bulk_create_revisions
+
+
+def load_plain(session, revision_ids):
+    return session.query(Revision).filter(
+        Revision.revision_id.in_(revision_ids)
+    ).all()
+
+
+def load_with_notes(session, revision_ids):
+    revisions = session.query(Revision).options(
+        joinedload(Revision.first_note)
+    ).filter(Revision.revision_id.in_(revision_ids)).all()
+
+    return [revision.note for revision in revisions]
+
+
+def load_with_subquery(session, revision_ids):
+    first_note = select([RevisionNote.content]).where(
+        RevisionNote.revision_id == Revision.revision_id
+    ).order_by(RevisionNote.posted_at).limit(1).as_scalar()
+
+    return session.query(Revision, first_note).filter(
+        Revision.revision_id.in_(revision_ids)
+    ).all()
+
+
+def timed(session, function, revision_ids, number):
+    best = None
+    for _ in range(number):
+        session.expunge_all()
+        start = time.time()
+        function(session, revision_ids)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best * 1000
+
+
+@click.command()
+@click.argument('username')
+@click.argument('database')
+@click.option('--password', prompt=True, hide_input=True,
+              help=('the password for the specified PostgreSQL user, prompted'
+                    ' for if not provided in the command line'))
+@click.option('--host', default='localhost',
+              help='the hostname for the instance of PostgreSQL to connect to')
+@click.option('--port', default=5432,
+              help='the port for the instance of PostgreSQL to connect to')
+@click.option('--count', default=10000,
+              help='the number of revisions to load')
+@click.option('--number', default=5,
+              help='the number of times each load is run')
+def benchmark(username, database, password, **kwargs):
+    """ Prints the best time taken by each way of loading the revisions, in
+    milliseconds. Half of the revisions have two notes each.
+    """
+
+    connection_string =\
+        'postgresql://{}:{}@{}:{}/{}'.format(
+            username, password, kwargs['host'], kwargs['port'], database
+        )
+
+    engine = create_engine(connection_string)
+    session = sessionmaker(bind=engine)()
+
+    user_id = session.query(User.user_id).first()[0]
+    language_ids = [l.id for l in session.query(Language.id).limit(10)]
+    identifier_type_ids = [
+        t.identifier_type_id for t in
+        session.query(IdentifierType.identifier_type_id)
+    ]
+
+    records = make_records(kwargs['count'], user_id, language_ids,
+                           identifier_type_ids)
+    entity_gids = bulk_create_revisions(session, records)
+    session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    revision_ids = [r.revision_id for r in session.query(
+        EntityRevision.revision_id
+    ).filter(EntityRevision.entity_gid.in_(entity_gids))]
+
+    session.execute(text(
+        "INSERT INTO bookbrainz.revision_note "
+        "(user_id, revision_id, content, posted_at) "
+        "SELECT :user_id, revision_id, 'Note ' || n, "
+        "       (now() AT TIME ZONE 'UTC') + n * interval '1 minute' "
+        "FROM bookbrainz.revision, generate_series(1, 2) AS n "
+        "WHERE revision_id = ANY(:revision_ids) AND revision_id % 2 = 0"
+    ), {'user_id': user_id, 'revision_ids': revision_ids})
+    session.execute('ANALYZE bookbrainz.revision_note')
+
+    for label, function in [('Without notes', load_plain),
+                            ('With notes (joined)', load_with_notes),
+                            ('Correlated subquery', load_with_subquery)]:
+        print("{}: {:.1f} ms".format(
+            label, timed(session, function, revision_ids, kwargs['number'])
+        ))
+
+    session.rollback()
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf8 -*-
+
+# Copyright (C) 2015  Ben Ockmore
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+""" This module times the main paths through the ORM against a generated
+dataset, which is grown to each of a list of sizes in turn. At each size, the
+creation, update and diff of entity data, the loading of revision histories,
+and the dump and import scripts are timed, and the results are appended to a
+file as JSON lines, so that they can be tracked over time.
+
+The generated data is committed, so the suite should be run against a scratch
+database, created with utils/create.py and populated with the lookup rows of
+utils/data.py. If an import database is given, all of its BookBrainz tables
+are emptied before the dump is imported into it.
+
+The suite is run from the root of the repository, as a module:
+
+    python -m benchmarks.suite USERNAME DATABASE
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import click
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from bbschema import INCLUDED_TABLES, Entity, EntityRevision
+from bbschema.base import Base
+from bbschema.bulk import ENTITY_TYPES
+
+from benchmarks.dataset import ENTITY_SHARES, DatasetGenerator
+
+UTILS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         '..', 'utils')
+
+
+def git_commit():
+    """ Returns the hash of the checked out commit, or None if it can't be
+    found. """
+    try:
+        output = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=UTILS_DIR,
+            stderr=subprocess.STDOUT
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return output.decode('ascii').strip()
+
+
+def sample_types(count):
+    """ Returns count entity types, in the shares of ENTITY_SHARES. """
+    types = []
+    for entity_type, share in ENTITY_SHARES:
+        types.extend([entity_type] * int(round(share * count)))
+    return types[:count]
+
+
+def edited_gids(session, count):
+    """ Returns the gids of up to count entities which have been edited since
+    they were created. """
+    return [row[0] for row in session.query(Entity.entity_gid).join(
+        EntityRevision, Entity.master_revision_id == EntityRevision.revision_id
+    ).filter(EntityRevision.parent_id.isnot(None)).order_by(
+        Entity.entity_gid
+    ).limit(count)]
+
+
+def time_create(session, sampler, count):
+    records = [(entity_type, sampler.revision_json(entity_type))
+               for entity_type in sample_types(count)]
+
+    start = time.time()
+    for entity_type, revision_json in records:
+        entity_cls, data_cls = ENTITY_TYPES[entity_type]
+
+        revision = EntityRevision(user_id=sampler.user_id)
+        revision.entity = entity_cls()
+        revision.entity_data = data_cls.create(revision_json, session)
+        revision.entity.master_revision = revision
+        session.add(revision)
+
+    session.flush()
+    session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    return len(records), time.time() - start
+
+
+def time_update(session, sampler, count):
+    gids = []
+    for entity_type in sample_types(count):
+        gids.append(sampler.rand.choice(sampler.gids[entity_type]))
+
+    start = time.time()
+    for gid in gids:
+        entity = session.query(Entity).get(gid)
+        parent = entity.master_revision
+        names = [alias.name for alias in parent.entity_data.aliases]
+
+        revision = EntityRevision(user_id=sampler.user_id, entity=entity,
+                                  parent=parent)
+        revision.entity_data = parent.entity_data.update(
+            sampler.update_json(entity._type, names), session
+        )
+        entity.master_revision = revision
+        session.add(revision)
+
+    session.flush()
+    session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+    return len(gids), time.time() - start
+
+
+def time_diff(session, sampler, count):
+    gids = edited_gids(session, count)
+
+    start = time.time()
+    for gid in gids:
+        revision = session.query(Entity).get(gid).master_revision
+        revision.entity_data.diff(revision.parent.entity_data)
+
+    return len(gids), time.time() - start
+
+
+def time_history(session, sampler, count):
+    gids = edited_gids(session, count)
+
+    start = time.time()
+    for gid in gids:
+        session.query(Entity).get(gid).master_revision.ancestors()
+        session.query(EntityRevision).filter(
+            EntityRevision.entity_gid == gid
+        ).order_by(EntityRevision.revision_id).all()
+
+    return len(gids), time.time() - start
+
+
+ORM_BENCHMARKS = [
+    ('create', time_create),
+    ('update', time_update),
+    ('diff', time_diff),
+    ('history', time_history)
+]
+
+
+def run_script(script, arguments):
+    """ Runs one of the scripts in utils, raising a ClickException with the
+    end of its output if it fails. """
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(UTILS_DIR, script)] + arguments,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        lines = output.decode('utf-8', 'replace').strip().splitlines()
+        raise click.ClickException(
+            lines[-1] if lines else '{} failed'.format(script)
+        )
+
+
+def time_script(run, size, count, script, arguments):
+    """ Returns the result of running one of the scripts in utils. If the
+    script fails, its error is recorded in place of the time taken. """
+    result = dict(run, size=size, benchmark=script[:-len('.py')],
+                  count=count)
+
+    start = time.time()
+    try:
+        run_script(script, arguments)
+    except click.ClickException as e:
+        result['error'] = e.format_message()
+    else:
+        result['seconds'] = time.time() - start
+
+    return result
+
+
+def empty_database(engine):
+    """ Deletes the rows of every table which is included in a dump. """
+    tables = [
+        table.fullname for name, table in Base.metadata.tables.items()
+        if name.startswith('bookbrainz') or name in INCLUDED_TABLES
+    ]
+    with engine.begin() as connection:
+        connection.execute('TRUNCATE {} CASCADE'.format(', '.join(tables)))
+
+
+@click.command()
+@click.argument('username')
+@click.argument('database')
+@click.option('--password', prompt=True, hide_input=True,
+              help=('the password for the specified PostgreSQL user, prompted'
+                    ' for if not provided in the command line'))
+@click.option('--host', default='localhost',
+              help='the hostname for the instance of PostgreSQL to connect to')
+@click.option('--port', default=5432,
+              help='the port for the instance of PostgreSQL to connect to')
+@click.option('--sizes', default='10000,100000,1000000',
+              help='the comma-separated numbers of entities to time at')
+@click.option('--seed', default=0,
+              help='the seed of the generated data')
+@click.option('--sample', default=200,
+              help='the number of entities used by each ORM benchmark')
+@click.option('--output', default='benchmark-results.jsonl',
+              help='the file which results are appended to, as JSON lines')
+@click.option('--import-database', default=None,
+              help=('a scratch database to time the import of the dump into,'
+                    ' which is emptied first (default: skip the import)'))
+def benchmark(username, database, password, **kwargs):
+    """ Grows a generated dataset to each of the given sizes, and prints the
+    time taken by each benchmark at each size.
+    """
+
+    connection_string = 'postgresql://{}:{}@{}:{}/{}'
+    engine = create_engine(connection_string.format(
+        username, password, kwargs['host'], kwargs['port'], database
+    ))
+    session = sessionmaker(bind=engine)()
+
+    import_engine = None
+    if kwargs['import_database'] is not None:
+        import_engine = create_engine(connection_string.format(
+            username, password, kwargs['host'], kwargs['port'],
+            kwargs['import_database']
+        ))
+
+    sizes = sorted(int(size) for size in kwargs['sizes'].split(','))
+
+    run = {
+        'started_at': datetime.datetime.utcnow().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'seed': kwargs['seed']
+    }
+
+    generator = DatasetGenerator(session, kwargs['seed'])
+
+    # Samples are drawn from a generator of their own, so that the dataset
+    # doesn't depend on the sample size
+    sampler = DatasetGenerator(session, kwargs['seed'] + 1)
+    sampler.gids = generator.gids
+
+    script_arguments = ['--password', password, '--host', kwargs['host'],
+                        '--port', str(kwargs['port'])]
+
+    with open(kwargs['output'], 'a') as output:
+        def write(result):
+            if 'error' in result:
+                print('{:>9} {:<10} failed: {}'.format(
+                    result['size'], result['benchmark'], result['error']
+                ))
+            else:
+                print('{:>9} {:<10} {:>9} in {:.2f}s'.format(
+                    result['size'], result['benchmark'], result['count'],
+                    result['seconds']
+                ))
+
+            output.write(json.dumps(result, sort_keys=True) + '\n')
+            output.flush()
+
+        for size in sizes:
+            count = size - generator.count
+            start = time.time()
+            generator.generate(count)
+            write(dict(run, size=size, benchmark='generate', count=count,
+                       seconds=time.time() - start))
+
+            for name, function in ORM_BENCHMARKS:
+                # Start each benchmark with nothing loaded
+                session.expunge_all()
+                done, seconds = function(session, sampler, kwargs['sample'])
+                session.rollback()
+                write(dict(run, size=size, benchmark=name, count=done,
+                           seconds=seconds))
+
+            dump_dir = tempfile.mkdtemp(prefix='bbbenchmark')
+            try:
+                result = time_script(run, size, generator.count, 'dump.py', [
+                    username, database, '--output-dir', dump_dir
+                ] + script_arguments)
+                write(result)
+
+                if import_engine is not None and 'error' not in result:
+                    empty_database(import_engine)
+
+                    sources = []
+                    for source in sorted(glob.glob(
+                            os.path.join(dump_dir, 'bbdump-*.tar.*'))):
+                        sources.extend(['--source', source])
+
+                    write(time_script(run, size, generator.count, 'import.py',
+                                      [username, kwargs['import_database']] +
+                                      script_arguments + sources))
+            finally:
+                shutil.rmtree(dump_dir)
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,2 +1,11 @@
 from test_entity_revision import *
 from test_entity_data import *
+from test_resolver import *
+from test_bulk import *
+from test_identifiers import *
+from test_batch import *
+from test_instrumentation import *
+from test_entity_current import *
+from test_loading import *
+from test_edition_links import *
+from test_redirect import *
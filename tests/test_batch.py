@@ -0,0 +1,95 @@
+import datetime
+from unittest import TestCase
+
+from bbschema import (Entity, EntityRevision, Publication, PublicationData,
+                      RevisionNote, config, iterate_query, query_batches)
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class TestQueryBatches(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+        for _ in range(5):
+            rev = EntityRevision(user_id=1)
+            rev.entity = Publication()
+            rev.entity_data = PublicationData.create({
+                'publication_type': {'publication_type_id': 1}
+            }, self.session)
+            self.session.add(rev)
+
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def test_query_batches(self):
+        expected = [gid for gid, in self.session.query(
+            Entity.entity_gid
+        ).order_by(Entity.entity_gid)]
+
+        batches = list(query_batches(
+            self.session.query(Entity).order_by(Entity.last_updated),
+            batch_size=2
+        ))
+
+        self.assertTrue(all(len(batch) <= 2 for batch in batches))
+        self.assertEqual(
+            [entity.entity_gid for batch in batches for entity in batch],
+            expected
+        )
+
+        # The entities of finished batches are released from the session
+        self.assertNotIn(batches[0][0], self.session)
+
+    def test_iterate_query(self):
+        expected = [gid for gid, in self.session.query(
+            Entity.entity_gid
+        ).order_by(Entity.entity_gid)]
+
+        rows = list(iterate_query(
+            self.session.query(Entity.entity_gid), batch_size=3
+        ))
+        self.assertEqual([gid for gid, in rows], expected)
+
+    def test_iterate_query_keeps_changes(self):
+        updated = datetime.datetime(2015, 1, 1)
+        for entity in iterate_query(self.session.query(Publication),
+                                    batch_size=2):
+            entity.last_updated = updated
+
+        self.assertEqual(
+            self.session.query(Publication).filter(
+                Publication.last_updated != updated
+            ).count(), 0
+        )
+
+    def test_composite_key(self):
+        revision = self.session.query(EntityRevision).first()
+        for content in [u'a', u'b', u'c']:
+            self.session.add(RevisionNote(
+                user_id=1, revision_id=revision.revision_id, content=content
+            ))
+        self.session.flush()
+
+        key = [RevisionNote.posted_at, RevisionNote.revision_note_id]
+        notes = list(iterate_query(
+            self.session.query(RevisionNote), batch_size=2, key=key,
+            expunge=False
+        ))
+
+        self.assertEqual(
+            [note.revision_note_id for note in notes],
+            [note.revision_note_id for note in self.session.query(
+                RevisionNote
+            ).order_by(*key)]
+        )
@@ -0,0 +1,321 @@
+from unittest import TestCase
+
+from bbschema import (Alias, Annotation, Disambiguation, Entity, EntityData,
+                      EntityRevision, Identifier, Publication,
+                      PublicationData, Publisher, PublisherData, Revision,
+                      User, bulk_create_revisions, config)
+from bbschema.bulk import ENTITY_TYPES
+from bbschema.entity_data import (ENTITY_DATA__ALIAS, ENTITY_DATA__IDENTIFIER,
+                                  WORK_DATA__LANGUAGE)
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class TestBulkCreateRevisions(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.rollback()
+
+    def _revision_json(self, name):
+        return {
+            'publication_type': {
+                'publication_type_id': 1
+            },
+            'annotation': u'Annotation of {}'.format(name),
+            'disambiguation': u'disambiguation of {}'.format(name),
+            'aliases': [{
+                'name': name,
+                'sort_name': name,
+                'language_id': 1,
+                'primary': True,
+                'default': True
+            }],
+            'identifiers': [{
+                'value': u'{}-id'.format(name),
+                'identifier_type': {
+                    'identifier_type_id': 1
+                }
+            }]
+        }
+
+    def test_bulk_create(self):
+        user = self.session.query(User).filter_by(user_id=1).one()
+
+        entity_gids = bulk_create_revisions(self.session, [
+            ('Publication', self._revision_json(u'Bulk {}'.format(i)),
+             user.user_id) for i in range(3)
+        ])
+
+        self.assertEqual(len(entity_gids), 3)
+
+        self.session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.session.expire_all()
+
+        for i, entity_gid in enumerate(entity_gids):
+            entity = self.session.query(Entity).get(entity_gid)
+            revision = entity.master_revision
+
+            self.assertIsInstance(revision, EntityRevision)
+            self.assertEqual(revision.entity_gid, entity_gid)
+            self.assertEqual(revision.user_id, user.user_id)
+
+            entity_data = revision.entity_data
+            self.assertIsInstance(entity_data, PublicationData)
+            self.assertEqual(entity_data.publication_type_id, 1)
+            self.assertEqual(entity_data.annotation.content,
+                             u'Annotation of Bulk {}'.format(i))
+            self.assertEqual(entity_data.disambiguation.comment,
+                             u'disambiguation of Bulk {}'.format(i))
+
+            self.assertEqual(len(entity_data.aliases), 1)
+            self.assertIsInstance(entity_data.aliases[0], Alias)
+            self.assertEqual(entity_data.aliases[0].name,
+                             u'Bulk {}'.format(i))
+            self.assertEqual(entity_data.default_alias,
+                             entity_data.aliases[0])
+
+            self.assertEqual(len(entity_data.identifiers), 1)
+            self.assertIsInstance(entity_data.identifiers[0], Identifier)
+            self.assertEqual(entity_data.identifiers[0].value,
+                             u'Bulk {}-id'.format(i))
+
+    def test_without_master_revision(self):
+        user = self.session.query(User).filter_by(user_id=1).one()
+
+        entity_gids = bulk_create_revisions(
+            self.session,
+            [('Publication', self._revision_json(u'Bulk'), user.user_id)],
+            set_master_revision=False
+        )
+
+        self.session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.session.expire_all()
+
+        entity = self.session.query(Entity).get(entity_gids[0])
+        self.assertIsNone(entity.master_revision)
+
+    def test_values_interned(self):
+        user = self.session.query(User).filter_by(user_id=1).one()
+
+        entity_gids = bulk_create_revisions(self.session, [
+            ('Publication', self._revision_json(u'Interned'), user.user_id)
+            for _ in range(2)
+        ])
+
+        self.session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        self.session.expire_all()
+
+        first, second = [
+            self.session.query(Entity).get(gid).master_revision.entity_data
+            for gid in entity_gids
+        ]
+
+        self.assertEqual(first.annotation_id, second.annotation_id)
+        self.assertEqual(first.default_alias_id, second.default_alias_id)
+        self.assertEqual(first.aliases, second.aliases)
+        self.assertEqual(first.identifiers[0].identifier_id,
+                         second.identifiers[0].identifier_id)
+
+
+class TestBulkMatchesORM(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+        self.user = self.session.query(User).filter_by(user_id=1).one()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def _alias(self, name, **kwargs):
+        alias = {'name': name, 'sort_name': name, 'language_id': 1}
+        alias.update(kwargs)
+        return alias
+
+    def _create(self, entity_type, revision_json):
+        entity_cls, data_cls = ENTITY_TYPES[entity_type]
+
+        revision = EntityRevision(user_id=self.user.user_id)
+        revision.entity = entity_cls()
+        revision.entity_data = data_cls.create(revision_json, self.session)
+        revision.entity.master_revision = revision
+
+        self.session.add(revision)
+        self.session.flush()
+
+        return revision.entity.entity_gid
+
+    def _records(self):
+        publication_gid = self._create('Publication', {
+            'aliases': [self._alias(u'Existing', primary=True)]
+        })
+        publisher_gid = self._create('Publisher', {
+            'aliases': [self._alias(u'Existing Publisher')]
+        })
+
+        return [
+            ('Creator', {
+                'creator_type': {'creator_type_id': 1},
+                'gender': {'gender_id': 2},
+                'begin_date': '1950-03',
+                'end_date': '2001',
+                'ended': True,
+                'country_id': 7,
+                'annotation': u'Creator \\ annotation\twith\nbreaks',
+                'disambiguation': u'the creator',
+                'aliases': [
+                    self._alias(u'Cr\xe9ateur', primary=True),
+                    self._alias(u'Createur', language_id=2, default=True),
+                    self._alias(u'Cr\xe9ateur', primary=True)
+                ],
+                'identifiers': [
+                    {'value': u'C1', 'identifier_type': {
+                        'identifier_type_id': 1}},
+                    {'value': u'C1', 'identifier_type': {
+                        'identifier_type_id': 1}}
+                ]
+            }),
+            ('Publication', {
+                'publication_type': {'publication_type_id': 2},
+                'aliases': [self._alias(u'Existing', primary=True)],
+                'identifiers': [{'value': u'P1', 'identifier_type': {
+                    'identifier_type_id': 2}}]
+            }),
+            ('Publisher', {
+                'publisher_type': {'publisher_type_id': 1},
+                'begin_date': '1890-01-02',
+                'aliases': [self._alias(u'Publisher')]
+            }),
+            ('Edition', {
+                'publication': str(publication_gid),
+                'publisher': publisher_gid,
+                'release_date': '2010-05-06',
+                'pages': 320,
+                'width': 110,
+                'weight': 250,
+                'language': {'language_id': 3},
+                'edition_format': {'edition_format_id': 1},
+                'edition_status': {'edition_status_id': 2},
+                'annotation': u'Edition annotation',
+                'aliases': [self._alias(u'Edition')]
+            }),
+            ('Edition', {'aliases': [self._alias(u'No Publication')]}),
+            ('Work', {
+                'work_type': {'work_type_id': 3},
+                'languages': [{'language_id': 4}, {'language_id': 1}],
+                'disambiguation': u'the creator',
+                'aliases': [self._alias(u'Work')]
+            })
+        ]
+
+    def _row(self, table, **kwargs):
+        clauses = [table.c[key] == value for key, value in kwargs.items()]
+        return dict(self.session.execute(
+            table.select().where(*clauses)
+        ).first().items())
+
+    def _value(self, model, value_id):
+        if value_id is None:
+            return None
+
+        row = self._row(model.__table__, **{
+            model.__mapper__.primary_key[0].key: value_id
+        })
+        return tuple(row[key] for key in model.value_columns + (
+            'content_hash',
+        ))
+
+    def _values(self, model, association, entity_data_id):
+        id_key = model.__mapper__.primary_key[0].key
+        rows = self.session.execute(association.select().where(
+            association.c.entity_data_id == entity_data_id
+        ))
+        return sorted(self._value(model, row[id_key]) for row in rows)
+
+    def _content(self, entity_gid):
+        """Returns the rows of an entity and its master revision, without
+        generated IDs and timestamps, and with values given by content."""
+        entity = self._row(Entity.__table__, entity_gid=entity_gid)
+        revision_id = entity.pop('master_revision_id')
+        del entity['entity_gid'], entity['last_updated']
+
+        revision = self._row(Revision.__table__, revision_id=revision_id)
+        del revision['revision_id'], revision['created_at']
+
+        entity_revision = self._row(EntityRevision.__table__,
+                                    revision_id=revision_id)
+        self.assertEqual(entity_revision['entity_gid'], entity_gid)
+        entity_data_id = entity_revision['entity_data_id']
+
+        content = {'entity': entity, 'revision': revision}
+        if entity_data_id is None:
+            return content
+
+        data = self._row(EntityData.__table__, entity_data_id=entity_data_id)
+        data_cls = EntityData.__mapper__.polymorphic_map[data['_type']].class_
+        data.update(self._row(data_cls.__table__,
+                              entity_data_id=entity_data_id))
+        del data['entity_data_id']
+
+        data['annotation'] = self._value(Annotation,
+                                         data.pop('annotation_id'))
+        data['disambiguation'] = self._value(Disambiguation,
+                                             data.pop('disambiguation_id'))
+        data['default_alias'] = self._value(Alias,
+                                            data.pop('default_alias_id'))
+        data['aliases'] = self._values(Alias, ENTITY_DATA__ALIAS,
+                                       entity_data_id)
+        data['identifiers'] = self._values(Identifier,
+                                           ENTITY_DATA__IDENTIFIER,
+                                           entity_data_id)
+        data['languages'] = sorted(
+            row.language_id for row in self.session.execute(
+                WORK_DATA__LANGUAGE.select().where(
+                    WORK_DATA__LANGUAGE.c.work_data_id == entity_data_id
+                )
+            )
+        )
+
+        content['data'] = data
+        return content
+
+    def test_rows_match_orm(self):
+        records = self._records()
+
+        self.session.begin_nested()
+        orm_gids = [self._create(entity_type, revision_json)
+                    for entity_type, revision_json in records]
+        orm_content = [self._content(gid) for gid in orm_gids]
+        self.session.rollback()
+
+        self.session.begin_nested()
+        bulk_gids = bulk_create_revisions(self.session, [
+            (entity_type, revision_json, self.user.user_id)
+            for entity_type, revision_json in records
+        ])
+        self.session.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        bulk_content = [self._content(gid) for gid in bulk_gids]
+        self.session.rollback()
+
+        self.assertIsNone(orm_content[4].get('data'))
+        self.assertEqual(len(orm_content[0]['data']['aliases']), 2)
+        self.assertIsNotNone(orm_content[3]['entity']['publication_gid'])
+
+        for orm, bulk in zip(orm_content, bulk_content):
+            self.assertEqual(orm, bulk)
@@ -0,0 +1,174 @@
+from unittest import TestCase
+
+from bbschema import (Edition, EditionData, EntityRevision, Publication,
+                      PublicationData, Publisher, PublisherData,
+                      QueryRecorder, User, bulk_create_revisions, config,
+                      query_budget, refresh_edition_links)
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class TestEditionLinks(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+        self.user = self.session.query(User).filter_by(user_id=1).one()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def _data(self, name, **kwargs):
+        data = {
+            'aliases': [{
+                'name': name,
+                'sort_name': name,
+                'language_id': 1,
+                'primary': True,
+                'default': True
+            }]
+        }
+        data.update(kwargs)
+
+        return data
+
+    def _create(self, entity, entity_data):
+        revision = EntityRevision(user_id=self.user.user_id)
+        revision.entity = entity
+        revision.entity_data = entity_data
+        entity.master_revision = revision
+
+        self.session.add(revision)
+        self.session.flush()
+
+        return entity
+
+    def _revise(self, entity, entity_data):
+        revision = EntityRevision(user_id=self.user.user_id, entity=entity,
+                                  entity_data=entity_data,
+                                  parent=entity.master_revision)
+        entity.master_revision = revision
+        self.session.add(revision)
+        self.session.flush()
+
+    def _create_edition(self):
+        publication = self._create(
+            Publication(),
+            PublicationData.create(self._data(u'Linked'), self.session)
+        )
+        publisher = self._create(
+            Publisher(),
+            PublisherData.create(self._data(u'Linker'), self.session)
+        )
+        edition = self._create(Edition(), EditionData.create(
+            self._data(u'Linked Edition',
+                       publication=publication.entity_gid,
+                       publisher=publisher.entity_gid),
+            self.session
+        ))
+
+        return edition, publication, publisher
+
+    def test_create(self):
+        edition, publication, publisher = self._create_edition()
+
+        self.assertEqual(edition.publication_gid, publication.entity_gid)
+        self.assertEqual(edition.publisher_gid, publisher.entity_gid)
+        self.assertNotIn(edition, self.session.dirty)
+
+        self.session.expunge_all()
+        edition = self.session.query(Edition).get(edition.entity_gid)
+        publication = self.session.query(Publication).get(
+            publication.entity_gid
+        )
+
+        self.assertIs(edition.publication, publication)
+        self.assertEqual(edition.publisher.entity_gid, publisher.entity_gid)
+
+        with query_budget(self.engine, 1):
+            self.assertEqual(publication.editions, [edition])
+
+    def test_revise(self):
+        edition, publication, _ = self._create_edition()
+        other = self._create(
+            Publication(),
+            PublicationData.create(self._data(u'Other'), self.session)
+        )
+
+        self._revise(edition, EditionData.create(
+            self._data(u'Linked Edition', publication=other.entity_gid),
+            self.session
+        ))
+
+        self.assertEqual(edition.publication_gid, other.entity_gid)
+        self.assertIsNone(edition.publisher_gid)
+
+        self.session.expire_all()
+        self.assertEqual(publication.editions, [])
+        self.assertEqual(other.editions, [edition])
+
+        # Deleting the edition removes it from the editions of its publication
+        self._revise(edition, None)
+        self.assertIsNone(edition.publication_gid)
+
+    def test_no_master_revision(self):
+        edition, publication, _ = self._create_edition()
+
+        edition.master_revision = None
+        self.session.flush()
+        self.assertIsNone(edition.publication_gid)
+        self.assertIsNone(edition.publisher_gid)
+
+        self.session.expire_all()
+        self.assertIsNone(edition.publication_gid)
+        self.assertEqual(publication.editions, [])
+
+    def test_other_flushes(self):
+        _, publication, _ = self._create_edition()
+
+        with QueryRecorder(self.engine) as recorder:
+            self._revise(publication, PublicationData.create(
+                self._data(u'Relinked'), self.session
+            ))
+
+        self.assertFalse([
+            statement for statement in recorder.statements
+            if 'publication_gid = s.publication_gid' in statement.statement
+        ])
+
+    def test_bulk_create(self):
+        edition, publication, publisher = self._create_edition()
+
+        gids = bulk_create_revisions(self.session, [
+            ('Edition', self._data(u'Bulk Edition',
+                                   publication=publication.entity_gid,
+                                   publisher=publisher.entity_gid),
+             self.user.user_id)
+        ])
+
+        self.session.expire_all()
+        self.assertEqual(
+            sorted(e.entity_gid for e in publication.editions),
+            sorted([edition.entity_gid] + gids)
+        )
+        self.assertEqual(len(publisher.editions), 2)
+
+    def test_refresh(self):
+        edition, publication, _ = self._create_edition()
+
+        self.session.execute(
+            'UPDATE bookbrainz.entity SET publication_gid = NULL '
+            'WHERE entity_gid = :gid', {'gid': str(edition.entity_gid)}
+        )
+
+        links = refresh_edition_links(self.session, [edition.entity_gid])
+        self.assertEqual(links[edition.entity_gid][0], publication.entity_gid)
+        self.assertEqual(refresh_edition_links(self.session, []), {})
+        self.assertIn(edition.entity_gid, refresh_edition_links(self.session))
@@ -0,0 +1,180 @@
+from unittest import TestCase
+
+from bbschema import (Creator, CreatorData, EntityCurrent, EntityRevision,
+                      User, Work, WorkData, bulk_create_revisions, config,
+                      maintain_entity_current, maintains_entity_current,
+                      refresh_entity_current)
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class TestEntityCurrent(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        maintain_entity_current(Session)
+        self.session = Session()
+
+        self.user = self.session.query(User).filter_by(user_id=1).one()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def _alias(self, name, default=False):
+        return {
+            'name': name,
+            'sort_name': name,
+            'language_id': 1,
+            'primary': default,
+            'default': default
+        }
+
+    def _create_creator(self):
+        entity_data = CreatorData.create({
+            'aliases': [self._alias(u'Current Creator', True),
+                        self._alias(u'Other Name')],
+            'identifiers': [{
+                'value': u'Q42',
+                'identifier_type': {'identifier_type_id': 1}
+            }],
+            'disambiguation': u'the current one',
+            'begin_date': u'1952-03-11',
+            'creator_type': {'creator_type_id': 1}
+        }, self.session)
+
+        revision = EntityRevision(user_id=self.user.user_id)
+        revision.entity = Creator()
+        revision.entity_data = entity_data
+        revision.entity.master_revision = revision
+
+        self.session.add(revision)
+        self.session.flush()
+
+        return revision.entity
+
+    def _revise(self, entity, entity_data):
+        revision = EntityRevision(user_id=self.user.user_id, entity=entity,
+                                  entity_data=entity_data,
+                                  parent=entity.master_revision)
+        entity.master_revision = revision
+        self.session.add(revision)
+        self.session.flush()
+
+        return revision
+
+    def test_create(self):
+        entity = self._create_creator()
+
+        current = self.session.query(EntityCurrent).get(entity.entity_gid)
+        self.assertEqual(current.entity_type, 'Creator')
+        self.assertEqual(current.revision_id,
+                         entity.master_revision.revision_id)
+        self.assertEqual(current.default_name, u'Current Creator')
+        self.assertEqual(current.disambiguation, u'the current one')
+        self.assertEqual(
+            sorted(alias['name'] for alias in current.aliases),
+            [u'Current Creator', u'Other Name']
+        )
+        self.assertEqual(current.identifiers[0]['value'], u'Q42')
+        self.assertEqual(current.details['begin_date'], u'1952-03-11')
+        self.assertEqual(current.details['creator_type_id'], 1)
+
+    def test_update_and_delete(self):
+        entity = self._create_creator()
+
+        revision = self._revise(
+            entity,
+            entity.master_revision.entity_data.update({
+                'aliases': [[None, self._alias(u'Renamed', True)]]
+            }, self.session)
+        )
+
+        current = EntityCurrent.get_many(self.session, [entity.entity_gid])
+        self.session.refresh(current[entity.entity_gid])
+        self.assertEqual(current[entity.entity_gid].revision_id,
+                         revision.revision_id)
+        self.assertEqual(current[entity.entity_gid].default_name, u'Renamed')
+
+        self._revise(entity, None)
+
+        self.assertEqual(
+            EntityCurrent.get_many(self.session, [entity.entity_gid]), {}
+        )
+        deleted = EntityCurrent.get_many(self.session, [entity.entity_gid],
+                                         include_deleted=True)
+        self.session.refresh(deleted[entity.entity_gid])
+        self.assertIsNone(deleted[entity.entity_gid].entity_data_id)
+        self.assertIsNone(deleted[entity.entity_gid].default_name)
+
+    def test_no_master_revision(self):
+        entity = self._create_creator()
+
+        entity.master_revision = None
+        self.session.flush()
+
+        self.assertEqual(
+            EntityCurrent.get_many(self.session, [entity.entity_gid],
+                                   include_deleted=True),
+            {}
+        )
+
+    def test_bulk_create(self):
+        gids = bulk_create_revisions(self.session, [
+            ('Work', {
+                'aliases': [self._alias(u'Bulk Current Work', True)],
+                'languages': [{'language_id': 2}, {'language_id': 1}]
+            }, self.user.user_id)
+        ])
+
+        works = EntityCurrent.with_alias(
+            self.session, u'Bulk Current Work', 'Work'
+        ).all()
+        self.assertEqual([work.entity_gid for work in works], gids)
+        self.assertEqual(works[0].details['language_ids'], [1, 2])
+
+    def test_full_refresh(self):
+        entity = self._create_creator()
+        self.session.execute(
+            'DELETE FROM bookbrainz.entity_current WHERE entity_gid = :gid',
+            {'gid': str(entity.entity_gid)}
+        )
+
+        refresh_entity_current(self.session)
+
+        self.assertIn(
+            entity.entity_gid,
+            EntityCurrent.get_many(self.session, [entity.entity_gid])
+        )
+
+    def test_opt_in(self):
+        self.assertTrue(maintains_entity_current(self.session))
+
+        session = sessionmaker(bind=self.engine)()
+        self.assertFalse(maintains_entity_current(session))
+
+        try:
+            revision = EntityRevision(user_id=self.user.user_id)
+            revision.entity = Creator()
+            revision.entity_data = CreatorData.create({
+                'aliases': [self._alias(u'Unmaintained', True)]
+            }, session)
+            revision.entity.master_revision = revision
+            session.add(revision)
+            session.flush()
+
+            self.assertIsNone(
+                session.query(EntityCurrent).get(revision.entity_gid)
+            )
+
+            maintain_entity_current(session)
+            maintain_entity_current(session)
+            self.assertTrue(maintains_entity_current(session))
+        finally:
+            session.rollback()
+            session.close()
@@ -1,12 +1,17 @@
 import copy
+import uuid
+from datetime import datetime
 from unittest import TestCase
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 
-from bbschema import config
+from bbschema import (Creator, CreatorCredit, PublicationData,
+                      RelationshipData, RelationshipEntity, RelationshipText,
+                      config, query_budget)
 
-from bbschema.entity import create_aliases, Alias, update_aliases
+from bbschema.entity import (Alias, Annotation, Identifier, create_aliases,
+                             diff_aliases, diff_identifiers, update_aliases)
 
 
 class TestAliases(TestCase):
@@ -438,3 +443,236 @@ class TestAliases(TestCase):
         self.assertEqual(aliases[0].language_id, 1)
         self.assertTrue(aliases[0].primary)
         self.assertIs(default_alias, aliases[0])
+
+
+class TestContentHash(TestCase):
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.rollback()
+
+    def test_alias_hash(self):
+        alias = Alias(name=u't\xebst', sort_name=u'test, sort', primary=True)
+        self.session.add(alias)
+        self.session.flush()
+
+        expected = self.session.execute(
+            "SELECT md5(concat_ws(E'\\x1f', name, sort_name, "
+            "coalesce(language_id::text, ''), \"primary\"::text)) "
+            "FROM bookbrainz.alias WHERE alias_id = :alias_id",
+            {'alias_id': alias.alias_id}
+        ).scalar()
+        self.assertEqual(alias.content_hash, expected)
+
+    def test_identifier_hash(self):
+        identifier = Identifier(identifier_type_id=1, value=u'0-123-4567-X')
+        self.session.add(identifier)
+        self.session.flush()
+
+        expected = self.session.execute(
+            "SELECT md5(concat_ws(E'\\x1f', identifier_type_id::text, value)) "
+            "FROM bookbrainz.identifier WHERE identifier_id = :identifier_id",
+            {'identifier_id': identifier.identifier_id}
+        ).scalar()
+        self.assertEqual(identifier.content_hash, expected)
+
+    def test_annotation_hash(self):
+        annotation = Annotation(content=u'\xc4nnotation')
+        self.session.add(annotation)
+        self.session.flush()
+
+        expected = self.session.execute(
+            "SELECT md5(content) FROM bookbrainz.annotation "
+            "WHERE annotation_id = :annotation_id",
+            {'annotation_id': annotation.annotation_id}
+        ).scalar()
+        self.assertEqual(annotation.content_hash, expected)
+
+    def test_annotation_equality(self):
+        annotation = Annotation(content=u'Annotation',
+                                created_at=datetime(2015, 1, 1))
+        later = Annotation(content=u'Annotation',
+                           created_at=datetime(2016, 1, 1))
+        self.assertEqual(annotation, later)
+        self.assertEqual(annotation.value_key, later.value_key)
+
+        later.content = u'Another annotation'
+        self.assertNotEqual(annotation, later)
+
+    def test_identifier_update_unchanged(self):
+        identifier = Identifier(identifier_type_id=1, value=u'test')
+        updated = identifier.update({
+            'value': u'test',
+            'identifier_type': {'identifier_type_id': 1}
+        })
+        self.assertIs(updated, identifier)
+
+        updated = identifier.update({'value': u'tested'})
+        self.assertIsNot(updated, identifier)
+        self.assertEqual(updated.value, u'tested')
+
+    def test_identical_values(self):
+        alias = {
+            'name': u'Twice',
+            'sort_name': u'Twice',
+            'language_id': 1,
+            'primary': True,
+            'default': True
+        }
+        identifier = {
+            'value': u'Twice',
+            'identifier_type': {'identifier_type_id': 1}
+        }
+
+        data = PublicationData.create({
+            'aliases': [alias, dict(alias)],
+            'identifiers': [identifier, dict(identifier)]
+        }, self.session)
+        self.session.add(data)
+        self.session.flush()
+
+        self.assertEqual(len(data.aliases), 1)
+        self.assertEqual(len(data.identifiers), 1)
+
+        # Values identical to each other and to existing values
+        updated = data.update({
+            'aliases': [[None, dict(alias)], [None, dict(alias)]],
+            'identifiers': [[None, dict(identifier)],
+                            [None, dict(identifier)]]
+        }, self.session)
+        self.session.add(updated)
+        self.session.flush()
+
+        self.assertEqual(updated.aliases, data.aliases)
+        self.assertEqual(updated.identifiers, data.identifiers)
+
+
+class TestDiff(TestCase):
+    def _alias(self, name, primary=False):
+        return Alias(name=name, sort_name=name, language_id=1,
+                     primary=primary)
+
+    def test_diff_aliases(self):
+        left = [self._alias(u'a'), self._alias(u'b'), self._alias(u'c')]
+        right = [self._alias(u'c'), self._alias(u'a', True)]
+
+        in_left, in_right = diff_aliases(left, right)
+        self.assertEqual(in_left, [left[0], left[1]])
+        self.assertEqual(in_right, [right[1]])
+
+    def test_diff_aliases_duplicates(self):
+        # Every copy is kept if no equal value is on the other side, and
+        # every copy is dropped if there is one
+        left = [self._alias(u'a'), self._alias(u'a'), self._alias(u'b'),
+                self._alias(u'b')]
+        right = [self._alias(u'b')]
+
+        in_left, in_right = diff_aliases(left, right)
+        self.assertEqual(len(in_left), 2)
+        self.assertIs(in_left[0], left[0])
+        self.assertIs(in_left[1], left[1])
+        self.assertEqual(in_right, [])
+
+    def test_diff_identifiers(self):
+        left = [Identifier(identifier_type_id=1, value=u'1'),
+                Identifier(identifier_type_id=2, value=u'1')]
+        right = [Identifier(identifier_type_id=1, value=u'1')]
+
+        in_left, in_right = diff_identifiers(left, right)
+        self.assertEqual(in_left, [left[1]])
+        self.assertEqual(in_right, [])
+
+    def test_diff_relationship(self):
+        gid = uuid.uuid4()
+
+        left = RelationshipData.create({
+            'relationship_type': {'relationship_type_id': 1},
+            'entities': [{'entity_gid': str(gid), 'position': 0}],
+            'text': [{'text': u'one', 'position': 1}]
+        })
+        right = RelationshipData(relationship_type_id=1)
+        right.entities = [RelationshipEntity(entity_gid=gid, position=0)]
+        right.texts = [RelationshipText(text=u'two', position=1)]
+
+        result = left.diff(right)
+        self.assertNotIn('entities', result)
+        self.assertEqual(result['texts'], (left.texts, right.texts))
+
+
+class TestCreatorCredit(TestCase):
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+        self.creators = [Creator() for _ in range(3)]
+        self.session.add_all(self.creators)
+        self.session.flush()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def _credit_data(self, join_phrase=u' & '):
+        return {
+            'begin_phrase': u'',
+            'names': [{
+                'position': position,
+                'name': u'Creator {}'.format(position),
+                'join_phrase': join_phrase if position < 2 else u'',
+                'creator_gid': str(creator.entity_gid)
+            } for position, creator in enumerate(self.creators)]
+        }
+
+    def test_create(self):
+        # One query for the creators, and one for existing credits
+        with query_budget(self.engine, 2):
+            credit = CreatorCredit.create(self._credit_data(), self.session)
+
+        self.session.add(credit)
+        self.session.flush()
+
+        self.assertEqual(
+            [(name.position, name.creator_gid) for name in credit.names],
+            [(i, creator.entity_gid)
+             for i, creator in enumerate(self.creators)]
+        )
+
+        # The hash matches the one computed by the migration, in SQL
+        sql_hash = self.session.execute(
+            "SELECT md5(concat_ws(E'\\x1f', c.begin_phrase, ("
+            "  SELECT string_agg(concat_ws(E'\\x1f', n.position::text, "
+            "    n.name, n.join_phrase, coalesce(n.creator_gid::text, '')), "
+            "    E'\\x1f' ORDER BY n.position) "
+            "  FROM bookbrainz.creator_credit_name n "
+            "  WHERE n.creator_credit_id = c.creator_credit_id"
+            "))) FROM bookbrainz.creator_credit c "
+            "WHERE c.creator_credit_id = :id",
+            {'id': credit.creator_credit_id}
+        ).scalar()
+        self.assertEqual(credit.content_hash, sql_hash)
+
+    def test_reuse_identical_credit(self):
+        credit = CreatorCredit.create(self._credit_data(), self.session)
+        self.session.add(credit)
+        self.session.flush()
+
+        self.assertIs(
+            CreatorCredit.create(self._credit_data(), self.session), credit
+        )
+
+        other = CreatorCredit.create(self._credit_data(u' and '),
+                                     self.session)
+        self.assertIsNot(other, credit)
+        self.assertIsNone(other.creator_credit_id)
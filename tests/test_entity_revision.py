@@ -1,9 +1,11 @@
+from datetime import datetime
 from unittest import TestCase
 
 from bbschema import (Entity, EntityRevision, Publication, PublicationData,
-                      User, config)
+                      Revision, RevisionNote, User, config)
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import joinedload, sessionmaker
+from utils.dump import DELTA_FILTERS
 
 
 class TestRelationshipViews(TestCase):
@@ -143,3 +145,144 @@ class TestRelationshipViews(TestCase):
 
         # Check properties of publication_data
         self.assertEqual(entity_data.publication_type_id, 1)
+
+    def test_fingerprint(self):
+        entity_gid = self.test_create_publication()
+        entity = self.session.query(Entity).\
+            filter_by(entity_gid=entity_gid).one()
+        entity_data = entity.master_revision.entity_data
+
+        self.assertIsNotNone(entity_data.fingerprint)
+        self.assertEqual(entity_data.fingerprint,
+                         entity_data.compute_fingerprint())
+
+        copied_data = entity_data.copy()
+        self.assertTrue(copied_data.same_content(entity_data))
+
+        copied_data.publication_type_id = 2
+        self.assertFalse(copied_data.same_content(entity_data))
+        copied_data.discard()
+
+    def test_update_publication_unchanged(self):
+        entity_gid = self.test_create_publication()
+        entity = self.session.query(Entity).\
+            filter_by(entity_gid=entity_gid).one()
+        entity_data = entity.master_revision.entity_data
+        alias = entity_data.aliases[0]
+
+        entity_data_count = self.session.query(PublicationData).count()
+
+        new_entity_data = entity_data.update({
+            'annotation': entity_data.annotation.content,
+            'aliases': [
+                [alias.alias_id, {
+                    'name': alias.name,
+                    'sort_name': alias.sort_name
+                }]
+            ]
+        }, self.session)
+
+        self.assertIs(new_entity_data, entity_data)
+
+        # The unused copy must not be written
+        self.session.commit()
+        self.assertEqual(self.session.query(PublicationData).count(),
+                         entity_data_count)
+
+    def test_revision_ancestry(self):
+        entity_gid = self.test_create_publication()
+        entity = self.session.query(Entity).\
+            filter_by(entity_gid=entity_gid).one()
+        root = entity.master_revision
+
+        # root <- a <- b <- c, and root <- d
+        revisions = {}
+        for name, parent in [('a', root), ('b', 'a'), ('c', 'b'),
+                             ('d', root)]:
+            rev = EntityRevision(user_id=1)
+            rev.entity = entity
+            rev.entity_data = root.entity_data
+            rev.parent = revisions.get(parent, parent)
+            revisions[name] = rev
+
+        self.session.add_all(revisions.values())
+        self.session.commit()
+        a, b, c, d = [revisions[name] for name in 'abcd']
+
+        self.session.expire_all()
+        ancestors = c.ancestors()
+        self.assertEqual(ancestors, [b, a, root])
+        self.assertIsInstance(ancestors[0], EntityRevision)
+        self.assertEqual(c.ancestors(limit=2), [b, a])
+        self.assertEqual(root.ancestors(), [])
+
+        self.assertEqual(root.descendants(), [a, d, b, c])
+        self.assertEqual(c.descendants(), [])
+
+        self.assertIs(c.common_ancestor(d), root)
+        self.assertIs(c.common_ancestor(a), a)
+        self.assertIs(a.common_ancestor(c), a)
+        self.assertIs(b.common_ancestor(b), b)
+
+        other_gid = self.test_create_publication()
+        other = self.session.query(Entity).\
+            filter_by(entity_gid=other_gid).one()
+        self.assertIsNone(c.common_ancestor(other.master_revision))
+
+    def test_revision_note(self):
+        entity_gid = self.test_create_publication()
+        entity = self.session.query(Entity).\
+            filter_by(entity_gid=entity_gid).one()
+        revision = entity.master_revision
+
+        self.assertIsNone(revision.note)
+
+        self.session.add_all([
+            RevisionNote(user_id=1, revision_id=revision.revision_id,
+                         content=u'Second', posted_at=datetime(2015, 2, 1)),
+            RevisionNote(user_id=1, revision_id=revision.revision_id,
+                         content=u'First', posted_at=datetime(2015, 1, 1))
+        ])
+        self.session.commit()
+        revision_id = revision.revision_id
+        self.session.expunge_all()
+
+        revision = self.session.query(Revision).options(
+            joinedload(Revision.first_note)
+        ).filter_by(revision_id=revision_id).one()
+        self.assertIn('first_note', revision.__dict__)
+        self.assertEqual(revision.note, u'First')
+
+        self.session.expunge_all()
+        revision = self.session.query(Revision).get(revision_id)
+        self.assertNotIn('first_note', revision.__dict__)
+        self.assertEqual(revision.note, u'First')
+
+    def test_revert_publication(self):
+        entity_gid = self.test_create_publication()
+        entity = self.session.query(Entity).\
+            filter_by(entity_gid=entity_gid).one()
+        first = entity.master_revision
+
+        second = EntityRevision(user_id=1)
+        second.entity = entity
+        second.entity_data = first.entity_data
+        second.parent = first
+        entity.master_revision = second
+        self.session.commit()
+
+        since = second.revision_id
+        last_updated = entity.last_updated
+
+        # Reverting to the first revision writes no new revision
+        entity.master_revision = first
+        self.session.commit()
+        self.assertGreater(entity.last_updated, last_updated)
+
+        # A delta dump since the second revision includes the entity
+        cursor = self.session.connection().connection.cursor()
+        cursor.execute(
+            'SELECT entity_gid FROM bookbrainz.entity WHERE ' +
+            DELTA_FILTERS['bookbrainz.entity'], {'since': since}
+        )
+        self.assertIn(entity_gid, [row[0] for row in cursor.fetchall()])
@@ -0,0 +1,174 @@
+from unittest import TestCase
+
+from bbschema import IdentifierEngine, IdentifierType, config
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def _identifier_types():
+    return [
+        IdentifierType(
+            identifier_type_id=1, label='ISBN-13', entity_type='Edition',
+            detection_regex=r'((?:\d-?){12}[X\d])',
+            validation_regex=r'^(?:\d-?){12}[X\d]$'
+        ),
+        IdentifierType(
+            identifier_type_id=2, label='ISBN-10', entity_type='Edition',
+            detection_regex=r'((?:\d-?){9}[X\d])',
+            validation_regex=r'^(?:\d-?){9}[X\d]$'
+        ),
+        IdentifierType(
+            identifier_type_id=3, label='Wikidata ID', entity_type='Edition',
+            detection_regex=r'wikidata\.org/wiki/(Q\d+)',
+            validation_regex=r'^Q\d+$'
+        ),
+        IdentifierType(
+            identifier_type_id=4, label='Repeated', entity_type='Edition',
+            detection_regex=r'(\w)\1{5}',
+            validation_regex=r'^(\w)\1*$'
+        ),
+        IdentifierType(
+            identifier_type_id=5, label='Wikidata ID', entity_type='Work',
+            detection_regex=r'wikidata\.org/wiki/(Q\d+)',
+            validation_regex=r'^Q\d+$'
+        ),
+        IdentifierType(
+            identifier_type_id=6, label='Catalogue', entity_type='Edition',
+            detection_regex=r'cat:\d+', validation_regex=r'^\d+$'
+        ),
+    ]
+
+
+class TestIdentifierEngine(TestCase):
+
+    def setUp(self):
+        self.engine = IdentifierEngine(None, _identifier_types())
+
+    def test_detect(self):
+        self.assertEqual(
+            self.engine.detect(u'ISBN 978-0-306-40615-7', 'Edition'),
+            [(1, u'978-0-306-40615-7'), (2, u'978-0-306-406')]
+        )
+        self.assertEqual(
+            self.engine.detect(
+                u'https://www.wikidata.org/wiki/Q42', 'Edition'
+            ),
+            [(3, u'Q42')]
+        )
+        self.assertEqual(
+            self.engine.detect(u'https://www.wikidata.org/wiki/Q42', 'Work'),
+            [(5, u'Q42')]
+        )
+        self.assertEqual(self.engine.detect(u'nothing', 'Edition'), [])
+        self.assertEqual(self.engine.detect(u'Q42', 'Creator'), [])
+
+    def test_detect_whole_match(self):
+        self.assertEqual(
+            self.engine.detect(u'see cat:1234', 'Edition'),
+            [(6, u'cat:1234')]
+        )
+
+    def test_detect_backreference(self):
+        self.assertEqual(
+            self.engine.detect(u'xx aaaaaa 0-306-40615-2', 'Edition'),
+            [(2, u'0-306-40615-2'), (4, u'a')]
+        )
+
+    def test_detect_inline_flags(self):
+        # The flag must not make the other regexes case-insensitive
+        identifier_types = [
+            IdentifierType(
+                identifier_type_id=1, label='Case-insensitive',
+                entity_type='Edition', detection_regex=r'(?i)doi:(\S+)',
+                validation_regex=r'^\S+$'
+            ),
+            IdentifierType(
+                identifier_type_id=2, label='Case-sensitive',
+                entity_type='Edition', detection_regex=r'ol:(OL\d+M)',
+                validation_regex=r'^OL\d+M$'
+            )
+        ]
+        engine = IdentifierEngine(None, identifier_types)
+
+        self.assertEqual(engine.detect(u'DOI:10.1/x OL:ol1m', 'Edition'),
+                         [(1, u'10.1/x')])
+        self.assertEqual(engine.detect(u'doi:10.1/x ol:OL1M', 'Edition'),
+                         [(1, u'10.1/x'), (2, u'OL1M')])
+
+    def test_detect_many_types(self):
+        # Too many groups to combine in one pattern on some versions
+        identifier_types = [
+            IdentifierType(
+                identifier_type_id=i, label='Type', entity_type='Edition',
+                detection_regex=r'id{}:(\d+)'.format(i),
+                validation_regex=r'^\d+$'
+            ) for i in range(1, 101)
+        ]
+        engine = IdentifierEngine(None, identifier_types)
+
+        self.assertEqual(
+            engine.detect(u'id100:5 id7:6', 'Edition'),
+            [(7, u'6'), (100, u'5')]
+        )
+
+    def test_validate(self):
+        self.assertTrue(self.engine.validate(1, u'9780306406157'))
+        self.assertFalse(self.engine.validate(1, u'978030640615'))
+        self.assertRaises(ValueError, self.engine.validate, 100, u'1')
+
+    def test_validate_many(self):
+        self.assertEqual(
+            self.engine.validate_many([
+                (1, u'978-0-306-40615-7'), (2, u'0-306-40615-2'),
+                (3, u'42'), (4, u'aaa'), (4, u'aab')
+            ]),
+            [True, True, False, True, False]
+        )
+
+
+class TestIdentifierEngineLoading(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def test_load_and_invalidate(self):
+        identifier_type = IdentifierType(
+            label='Test ID', description='Test', entity_type='Publisher',
+            detection_regex=r'test/(\d+)', validation_regex=r'^\d+$'
+        )
+        self.session.add(identifier_type)
+        self.session.flush()
+        type_id = identifier_type.identifier_type_id
+
+        engine = IdentifierEngine(self.session)
+        self.assertEqual(
+            engine.detect(u'http://test/12', 'Publisher'), [(type_id, u'12')]
+        )
+        self.assertFalse(engine.validate(type_id, u'x12'))
+
+        self.session.execute(
+            "UPDATE bookbrainz.identifier_type "
+            "SET validation_regex = '^x\\d+$', "
+            "detection_regex = 'test/(x\\d+)' "
+            "WHERE identifier_type_id = :id", {'id': type_id}
+        )
+
+        # The compiled regexes are used until the type is invalidated
+        self.assertFalse(engine.validate(type_id, u'x12'))
+
+        engine.invalidate(type_id)
+        self.assertTrue(engine.validate(type_id, u'x12'))
+        self.assertEqual(
+            engine.detect(u'http://test/x12', 'Publisher'),
+            [(type_id, u'x12')]
+        )
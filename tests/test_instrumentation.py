@@ -0,0 +1,140 @@
+import threading
+import time
+from unittest import TestCase
+
+from bbschema import (PublicationData, QueryRecorder, ReferenceResolver,
+                      Publication, config, query_budget)
+from bbschema.instrumentation import QueryBudgetExceeded
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class _Sink(object):
+    def __init__(self):
+        self.counts = {}
+        self.timings = {}
+
+    def incr(self, name, count):
+        self.counts[name] = count
+
+    def timing(self, name, milliseconds):
+        self.timings[name] = milliseconds
+
+
+class TestQueryRecorder(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def _create_publication_data(self):
+        data = PublicationData.create({
+            'aliases': [{
+                'name': u'Instrumented',
+                'sort_name': u'Instrumented',
+                'language_id': 1,
+                'primary': True,
+                'default': True
+            }]
+        }, self.session)
+
+        self.session.add(data)
+        self.session.flush()
+
+        return data.entity_data_id
+
+    def test_by_caller(self):
+        resolver = ReferenceResolver(self.session)
+        resolver.add(Publication, u'b1b3f8e2-6ef6-4a62-9e3a-e48ff1d6a0e0')
+
+        with QueryRecorder(self.engine) as recorder:
+            resolver.resolve()
+            self.session.execute('SELECT 1')
+
+        self.session.execute('SELECT 2')
+
+        by_caller = recorder.by_caller()
+        self.assertEqual(recorder.count, 2)
+        self.assertEqual(
+            by_caller['bbschema.resolver.ReferenceResolver._resolve_model'][0],
+            1
+        )
+        self.assertEqual(by_caller['other'][0], 1)
+        self.assertEqual(recorder.flagged, [])
+
+    def test_flag_lazy_loads(self):
+        data_id = self._create_publication_data()
+        self.session.expunge_all()
+
+        left = self.session.query(PublicationData).get(data_id)
+        right = self.session.query(PublicationData).get(data_id)
+        self.assertIs(left, right)
+        self.session.expire(left, ['aliases', 'identifiers'])
+
+        with QueryRecorder(self.engine) as recorder:
+            self.assertTrue(left == right)
+
+        self.assertTrue(recorder.flagged)
+        for statement in recorder.flagged:
+            self.assertTrue(statement.lazy)
+            self.assertIn('bbschema.entity_data.PublicationData.__eq__',
+                          statement.callers)
+
+    def test_overlapping_threads(self):
+        thread = threading.Thread(
+            target=self.engine.execute, args=('SELECT pg_sleep(0.2)',)
+        )
+
+        with QueryRecorder(self.engine) as recorder:
+            thread.start()
+            time.sleep(0.1)
+
+            # This statement starts after the thread's, and finishes after it
+            self.engine.execute('SELECT pg_sleep(0.3)')
+            thread.join()
+
+        durations = dict((s.statement, s.duration)
+                         for s in recorder.statements)
+        self.assertGreaterEqual(durations['SELECT pg_sleep(0.2)'], 0.2)
+        self.assertGreaterEqual(durations['SELECT pg_sleep(0.3)'], 0.3)
+
+    def test_query_budget(self):
+        with query_budget(self.engine, 2):
+            self.session.execute('SELECT 1')
+            self.session.execute('SELECT 2')
+
+        with self.assertRaises(QueryBudgetExceeded):
+            with query_budget(self.engine, 1):
+                self.session.execute('SELECT 1')
+                self.session.execute('SELECT 2')
+
+        resolver = ReferenceResolver(self.session)
+        resolver.add(Publication, u'b1b3f8e2-6ef6-4a62-9e3a-e48ff1d6a0e0')
+
+        # Only statements issued within the given function are counted
+        with query_budget(self.engine, 1,
+                          'bbschema.resolver.ReferenceResolver.resolve'):
+            self.session.execute('SELECT 1')
+            resolver.resolve()
+
+    def test_export(self):
+        sink = _Sink()
+
+        with QueryRecorder(self.engine) as recorder:
+            self.session.execute('SELECT 1')
+            self.session.execute('SELECT 2')
+
+        recorder.export(sink)
+
+        self.assertEqual(sink.counts, {'bbschema.other.queries': 2,
+                                       'bbschema.flagged_lazy_loads': 0})
+        self.assertIn('bbschema.other.query_time', sink.timings)
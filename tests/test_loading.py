@@ -0,0 +1,177 @@
+from unittest import TestCase
+
+from bbschema import (Creator, CreatorData, CreatorCredit, Edition,
+                      EditionData, EntityRevision, FULL_EDITION, Publication,
+                      PublicationData, Publisher, PublisherData, SUMMARY,
+                      User, config, query_budget)
+from bbschema.loading import LoaderProfile
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class TestLoaderProfiles(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+        self.user = self.session.query(User).filter_by(user_id=1).one()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+    def _data(self, name):
+        return {
+            'aliases': [{
+                'name': name,
+                'sort_name': name,
+                'language_id': 1,
+                'primary': True,
+                'default': True
+            }],
+            'identifiers': [{
+                'value': name,
+                'identifier_type': {'identifier_type_id': 1}
+            }],
+            'disambiguation': name
+        }
+
+    def _create(self, entity, entity_data):
+        revision = EntityRevision(user_id=self.user.user_id)
+        revision.entity = entity
+        revision.entity_data = entity_data
+        entity.master_revision = revision
+
+        self.session.add(revision)
+        self.session.flush()
+
+        return entity
+
+    def _create_editions(self, count):
+        creator = self._create(
+            Creator(), CreatorData.create(self._data(u'Author'), self.session)
+        )
+        publication = self._create(
+            Publication(),
+            PublicationData.create(self._data(u'Book'), self.session)
+        )
+        publisher = self._create(
+            Publisher(),
+            PublisherData.create(self._data(u'Press'), self.session)
+        )
+
+        credit = CreatorCredit.create({
+            'names': [{
+                'position': 0,
+                'name': u'Author',
+                'join_phrase': u'',
+                'creator_gid': creator.entity_gid
+            }]
+        }, self.session)
+
+        gids = []
+        for i in range(count):
+            data = self._data(u'Edition {}'.format(i))
+            data.update({
+                'publication': publication.entity_gid,
+                'publisher': publisher.entity_gid,
+                'language': {'language_id': 1}
+            })
+
+            entity_data = EditionData.create(data, self.session)
+            entity_data.creator_credit = credit
+            gids.append(self._create(Edition(), entity_data).entity_gid)
+
+        self.session.expunge_all()
+        return gids
+
+    def _load(self, profile, gids):
+        query = self.session.query(Edition).filter(
+            Edition.entity_gid.in_(gids)
+        )
+        with query_budget(self.engine, 100) as recorder:
+            editions = profile.apply(query).all()
+
+        return editions, recorder.count
+
+    def _access(self, edition):
+        data = edition.master_revision.entity_data
+        result = [
+            data.default_alias.name, data.disambiguation.comment,
+            data.annotation, data.language.name, data.edition_format,
+            data.edition_status, data.publication.entity_gid,
+            data.publisher.entity_gid, edition.publication.entity_gid,
+            edition.publisher.entity_gid
+        ]
+
+        result.extend((alias.name, alias.language.name)
+                      for alias in data.aliases)
+        result.extend((identifier.value, identifier.identifier_type.label)
+                      for identifier in data.identifiers)
+        result.extend((name.name, name.creator.entity_gid)
+                      for name in data.creator_credit.names)
+
+        return result
+
+    def test_full_edition(self):
+        gids = self._create_editions(3)
+        editions, _ = self._load(FULL_EDITION, gids)
+
+        self.assertEqual(len(editions), 3)
+        with query_budget(self.engine, 0):
+            for edition in editions:
+                self._access(edition)
+
+    def test_constant_queries(self):
+        gids = self._create_editions(5)
+
+        _, few = self._load(FULL_EDITION, gids[:1])
+        self.session.expunge_all()
+        _, many = self._load(FULL_EDITION, gids)
+
+        self.assertEqual(few, many)
+
+    def test_summary(self):
+        gids = self._create_editions(2)
+        editions, _ = self._load(SUMMARY, gids)
+
+        with query_budget(self.engine, 0):
+            for edition in editions:
+                data = edition.master_revision.entity_data
+                self.assertTrue(data.default_alias.name.startswith(u'Edition'))
+                self.assertTrue(data.disambiguation.comment)
+
+    def test_data_and_revision_queries(self):
+        gids = self._create_editions(2)
+
+        query = self.session.query(EditionData).join(
+            EntityRevision,
+            EntityRevision.entity_data_id == EditionData.entity_data_id
+        ).filter(EntityRevision.entity_gid.in_(gids))
+        data = FULL_EDITION.apply(query).all()
+
+        query = self.session.query(EntityRevision).filter(
+            EntityRevision.entity_gid.in_(gids)
+        )
+        revisions = FULL_EDITION.apply(query).all()
+
+        publication = revisions[0].entity_data.publication
+        with query_budget(self.engine, 0):
+            for entity_data in data:
+                self.assertIs(entity_data.publication, publication)
+                self.assertEqual(len(entity_data.aliases), 1)
+            for revision in revisions:
+                self.assertEqual(revision.entity_data.language.id, 1)
+
+    def test_unsupported_query(self):
+        with self.assertRaises(ValueError):
+            SUMMARY.apply(self.session.query(User))
+
+        self.assertEqual(repr(FULL_EDITION), '<LoaderProfile FULL_EDITION>')
+        self.assertIsInstance(FULL_EDITION, LoaderProfile)
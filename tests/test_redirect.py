@@ -0,0 +1,112 @@
+import uuid
+from unittest import TestCase
+
+from bbschema import (EntityRedirect, Publication, clear_redirect_cache,
+                      config, query_budget, resolve_gid)
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class TestResolveGid(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+        clear_redirect_cache()
+
+    def tearDown(self):
+        self.session.rollback()
+        self.session.close()
+
+        clear_redirect_cache()
+
+    def _entities(self, count):
+        entities = [Publication() for _ in range(count)]
+        self.session.add_all(entities)
+        self.session.flush()
+
+        return [entity.entity_gid for entity in entities]
+
+    def _redirect(self, source_gid, target_gid):
+        self.session.add(EntityRedirect(source_gid=source_gid,
+                                        target_gid=target_gid))
+        self.session.flush()
+
+    def _target(self, source_gid):
+        return self.session.execute(
+            'SELECT target_gid FROM bookbrainz.entity_redirect '
+            'WHERE source_gid = :gid', {'gid': str(source_gid)}
+        ).scalar()
+
+    def test_resolve_chain(self):
+        a, b, c, d = self._entities(4)
+        self._redirect(a, b)
+        self._redirect(b, c)
+        self._redirect(c, d)
+
+        other = uuid.uuid4()
+        with query_budget(self.engine, 2):
+            result = resolve_gid(self.session, [a, str(b), d, other])
+
+        self.assertEqual(result, {a: d, str(b): d, d: d, other: other})
+
+        # The chains found now point straight at the final target
+        self.assertEqual(self._target(a), d)
+        self.assertEqual(self._target(b), d)
+
+    def test_cache(self):
+        a, b, c = self._entities(3)
+
+        # Redirects written without the ORM aren't tracked by the session
+        self.session.execute(
+            'INSERT INTO bookbrainz.entity_redirect (source_gid, target_gid) '
+            'VALUES (:source, :target)', {'source': str(a), 'target': str(b)}
+        )
+
+        self.assertEqual(resolve_gid(self.session, [a]), {a: b})
+        with query_budget(self.engine, 0):
+            self.assertEqual(resolve_gid(self.session, [a]), {a: b})
+
+        # Once the session writes a redirect it stops using the cache, so the
+        # new chain is followed
+        self._redirect(b, c)
+        self.assertEqual(resolve_gid(self.session, [a, b]), {a: c, b: c})
+
+    def test_rollback(self):
+        a, b = self._entities(2)
+
+        self.session.begin_nested()
+        self._redirect(a, b)
+        self.assertEqual(resolve_gid(self.session, [a]), {a: b})
+        self.session.rollback()
+
+        # The redirect which was rolled back wasn't cached
+        self.assertEqual(resolve_gid(self.session, [a]), {a: a})
+
+        self._redirect(a, b)
+        self.assertEqual(resolve_gid(self.session, [a]), {a: b})
+        self.session.rollback()
+
+        # Ending the transaction clears the cache, and resolutions are cached
+        # again
+        self.assertEqual(resolve_gid(self.session, [a]), {a: a})
+        with query_budget(self.engine, 0):
+            self.assertEqual(resolve_gid(self.session, [a]), {a: a})
+
+    def test_cycle(self):
+        a, b = self._entities(2)
+        self._redirect(a, b)
+        self._redirect(b, a)
+
+        result = resolve_gid(self.session, [a])
+        self.assertIn(result[a], [a, b])
+
+        # No redirect is pointed at its own source
+        self.assertEqual(self._target(a), b)
+        self.assertEqual(self._target(b), a)
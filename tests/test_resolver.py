@@ -0,0 +1,179 @@
+import uuid
+from unittest import TestCase
+
+from bbschema import (Alias, EditionData, EntityRevision, Identifier,
+                      Language, Publication, PublicationData, Publisher,
+                      ReferenceResolver, User, WorkData, config)
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm.exc import NoResultFound
+
+
+class TestReferenceResolver(TestCase):
+
+    def setUp(self):
+        conn_string = 'postgres://{}:{}@{}/{}'.format(
+            config.USERNAME, config.PASSWORD, config.HOSTNAME, config.DATABASE
+        )
+        self.engine = create_engine(conn_string)
+
+        Session = sessionmaker(bind=self.engine)
+        self.session = Session()
+
+    def _create_publication(self):
+        user = self.session.query(User).filter_by(user_id=1).one()
+
+        entity = Publication()
+        entity_data = PublicationData.create({
+            'publication_type': {
+                'publication_type_id': 1
+            }
+        }, self.session)
+
+        rev = EntityRevision(user_id=user.user_id)
+        rev.entity = entity
+        rev.entity_data = entity_data
+
+        self.session.add(rev)
+        self.session.commit()
+
+        return entity.entity_gid
+
+    def test_edition_references(self):
+        references = EditionData.references({
+            'publication': u'b1b3f8e2-6ef6-4a62-9e3a-e48ff1d6a0e0',
+            'publisher': None
+        })
+
+        self.assertIn(
+            (Publication, u'b1b3f8e2-6ef6-4a62-9e3a-e48ff1d6a0e0'), references
+        )
+        self.assertIn((Publisher, None), references)
+
+    def test_work_references(self):
+        self.assertEqual(
+            WorkData.references({'languages': [{'language_id': 1}]}),
+            [(Language, 1)]
+        )
+        self.assertEqual(
+            WorkData.references({'languages': [[None, 2], [1, None]]}),
+            [(Language, 2), (Language, None)]
+        )
+
+    def test_resolve_batch(self):
+        gids = [self._create_publication() for _ in range(3)]
+
+        resolver = ReferenceResolver(self.session)
+        resolver.add_documents(
+            EditionData, [{'publication': str(gid)} for gid in gids]
+        )
+        resolver.resolve()
+
+        for gid in gids:
+            publication = resolver.one(Publication, str(gid))
+            self.assertEqual(publication.entity_gid, gid)
+
+    def test_one_missing(self):
+        resolver = ReferenceResolver(self.session)
+
+        with self.assertRaises(NoResultFound):
+            resolver.one(Publication, uuid.uuid4())
+
+    def test_get_missing(self):
+        resolver = ReferenceResolver(self.session)
+        self.assertIs(resolver.get(Publication, uuid.uuid4()), None)
+
+    def test_one_wrong_type(self):
+        gid = self._create_publication()
+        resolver = ReferenceResolver(self.session)
+
+        with self.assertRaises(NoResultFound):
+            resolver.one(Publisher, gid)
+
+    def test_create_edition_missing_publication(self):
+        with self.assertRaises(NoResultFound):
+            EditionData.create({'publication': str(uuid.uuid4())},
+                               self.session)
+
+    def test_intern_existing(self):
+        name = unicode(uuid.uuid4())
+        alias = Alias(name=name, sort_name=name, language_id=1, primary=True)
+        self.session.add(alias)
+        self.session.commit()
+
+        resolver = ReferenceResolver(self.session)
+        interned = resolver.intern(
+            Alias(name=name, sort_name=name, language_id=1, primary=True)
+        )
+        self.assertIs(interned, alias)
+
+        different = Alias(name=name, sort_name=name, language_id=1,
+                          primary=False)
+        self.assertIs(resolver.intern(different), different)
+
+    def test_intern_batch(self):
+        value = unicode(uuid.uuid4())
+        identifiers = [Identifier(identifier_type_id=1, value=value)
+                       for _ in range(3)]
+
+        resolver = ReferenceResolver(self.session)
+        interned = resolver.intern_all(identifiers + [None])
+
+        self.assertIs(interned[0], identifiers[0])
+        self.assertIs(interned[1], identifiers[0])
+        self.assertIs(interned[2], identifiers[0])
+        self.assertIs(interned[3], None)
+
+    def test_intern_disabled(self):
+        value = unicode(uuid.uuid4())
+        identifiers = [Identifier(identifier_type_id=1, value=value)
+                       for _ in range(2)]
+
+        resolver = ReferenceResolver(self.session, intern_values=False)
+        self.assertEqual(resolver.intern_all(identifiers), identifiers)
+        self.assertIs(identifiers[0].content_hash, None)
+
+    def test_create_shares_values(self):
+        user = self.session.query(User).filter_by(user_id=1).one()
+        name = unicode(uuid.uuid4())
+
+        revisions = []
+        for _ in range(2):
+            entity_data = PublicationData.create({
+                'publication_type': {
+                    'publication_type_id': 1
+                },
+                'annotation': name,
+                'disambiguation': name,
+                'aliases': [{
+                    'name': name,
+                    'sort_name': name,
+                    'language_id': 1,
+                    'primary': True,
+                    'default': True
+                }],
+                'identifiers': [{
+                    'value': name,
+                    'identifier_type': {
+                        'identifier_type_id': 1
+                    }
+                }]
+            }, self.session)
+
+            revision = EntityRevision(user_id=user.user_id)
+            revision.entity = Publication()
+            revision.entity_data = entity_data
+
+            self.session.add(revision)
+            self.session.commit()
+
+            revisions.append(revision)
+
+        first, second = [r.entity_data for r in revisions]
+        self.assertEqual(first.annotation_id, second.annotation_id)
+        self.assertEqual(first.disambiguation_id, second.disambiguation_id)
+        self.assertEqual(first.default_alias_id, second.default_alias_id)
+        self.assertEqual(first.aliases[0].alias_id,
+                         second.aliases[0].alias_id)
+        self.assertEqual(first.identifiers[0].identifier_id,
+                         second.identifiers[0].identifier_id)
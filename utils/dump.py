@@ -24,15 +24,26 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import datetime
+import functools
+import json
 import os
 import shutil
+import subprocess
 import tarfile
 import tempfile
+import threading
+import time
+from collections import deque
 
 import click
 import psycopg2
 import psycopg2.extensions
 
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
 GROUPS = {
     'core': [
         ('bookbrainz', [
@@ -79,6 +90,7 @@ GROUPS = {
     'derived': [
         ('bookbrainz', [
             'annotation',
+            'entity_current',
             'revision_note'
         ])
     ],
@@ -118,6 +130,116 @@ TEMPORARIES = [
 ]
 
 
+# The entity data and relationship data of the revisions in a delta dump
+NEW_ENTITY_DATA = ('SELECT entity_data_id FROM bookbrainz.entity_revision '
+                   'WHERE revision_id > %(since)s')
+NEW_REL_DATA = ('SELECT relationship_data_id FROM bookbrainz.rel_revision '
+                'WHERE revision_id > %(since)s')
+
+# The time at which the last revision before a delta dump was created
+SINCE_TIME = ('(SELECT created_at FROM bookbrainz.revision '
+              'WHERE revision_id = %(since)s)')
+
+# The entities whose rows are in a delta dump, including those reverted to an
+# older master revision, which have no new revisions
+CHANGED_ENTITIES = (
+    'entity_gid IN (SELECT entity_gid FROM bookbrainz.entity_revision '
+    '               WHERE revision_id > %(since)s) '
+    'OR last_updated >= ' + SINCE_TIME
+)
+
+# Delta dumps include the rows of these tables which match their conditions,
+# which select the rows reachable from revisions newer than the revision the
+# delta starts from, and rows which have changed since it was created. Every
+# row of the other tables, which are small or mutable, is included.
+DELTA_FILTERS = {
+    'bookbrainz.revision': 'revision_id > %(since)s',
+    'bookbrainz.entity_revision': 'revision_id > %(since)s',
+    'bookbrainz.rel_revision': 'revision_id > %(since)s',
+    'bookbrainz.entity_current': (
+        'entity_gid IN (SELECT entity_gid FROM bookbrainz.entity '
+        '               WHERE ' + CHANGED_ENTITIES + ')'
+    ),
+    'bookbrainz.revision_note': (
+        'revision_id > %(since)s OR posted_at >= ' + SINCE_TIME
+    ),
+    'bookbrainz.entity': CHANGED_ENTITIES,
+    'bookbrainz.entity_data': 'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.creator_data': 'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.edition_data': 'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.publication_data':
+        'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.publisher_data':
+        'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.work_data': 'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.entity_data__alias':
+        'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.entity_data__identifier':
+        'entity_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.work_data__language':
+        'work_data_id IN (' + NEW_ENTITY_DATA + ')',
+    'bookbrainz.alias': (
+        'alias_id IN (SELECT alias_id FROM bookbrainz.entity_data__alias '
+        '             WHERE entity_data_id IN (' + NEW_ENTITY_DATA + ')) '
+        'OR alias_id IN (SELECT default_alias_id FROM bookbrainz.entity_data '
+        '                WHERE entity_data_id IN (' + NEW_ENTITY_DATA + '))'
+    ),
+    'bookbrainz.identifier': (
+        'identifier_id IN ('
+        '  SELECT identifier_id FROM bookbrainz.entity_data__identifier '
+        '  WHERE entity_data_id IN (' + NEW_ENTITY_DATA + ')'
+        ')'
+    ),
+    'bookbrainz.annotation': (
+        'annotation_id IN (SELECT annotation_id FROM bookbrainz.entity_data '
+        '                  WHERE entity_data_id IN (' + NEW_ENTITY_DATA + '))'
+    ),
+    'bookbrainz.disambiguation': (
+        'disambiguation_id IN ('
+        '  SELECT disambiguation_id FROM bookbrainz.entity_data '
+        '  WHERE entity_data_id IN (' + NEW_ENTITY_DATA + ')'
+        ')'
+    ),
+    'bookbrainz.creator_credit': (
+        'creator_credit_id IN ('
+        '  SELECT creator_credit_id FROM bookbrainz.edition_data '
+        '  WHERE entity_data_id IN (' + NEW_ENTITY_DATA + ')'
+        ')'
+    ),
+    'bookbrainz.creator_credit_name': (
+        'creator_credit_id IN ('
+        '  SELECT creator_credit_id FROM bookbrainz.edition_data '
+        '  WHERE entity_data_id IN (' + NEW_ENTITY_DATA + ')'
+        ')'
+    ),
+    'bookbrainz.rel': (
+        'relationship_id IN ('
+        '  SELECT relationship_id FROM bookbrainz.rel_revision '
+        '  WHERE revision_id > %(since)s'
+        ') '
+        'OR last_updated >= ' + SINCE_TIME
+    ),
+    'bookbrainz.rel_data': 'relationship_data_id IN (' + NEW_REL_DATA + ')',
+    'bookbrainz.rel_entity':
+        'relationship_data_id IN (' + NEW_REL_DATA + ')',
+    'bookbrainz.rel_text': 'relationship_data_id IN (' + NEW_REL_DATA + ')'
+}
+
+# Each codec maps to the extension of its archives, the tarfile compression
+# used when no parallel compressor is installed (None if there isn't one),
+# and the parallel compressors to try first, in order of preference
+CODECS = {
+    'bz2': ('tar.bz2', 'bz2', [['lbzip2', '-c'], ['pbzip2', '-c']]),
+    'gz': ('tar.gz', 'gz', [['pigz', '-c']]),
+    'xz': ('tar.xz', 'xz', [['xz', '-T0', '-c']]),
+    'zst': ('tar.zst', None, [['zstd', '-T0', '-q', '-c']])
+}
+
+# Tables are held in memory up to this size while they are dumped, and
+# spilled to the tmp directory beyond it
+SPOOL_SIZE = 64 * 1024 * 1024
+
+
 @click.command()
 @click.argument('username')
 @click.argument('database')
@@ -129,13 +251,24 @@ TEMPORARIES = [
 @click.option('--port', default=5432,
               help='the port for the instance of PostgreSQL to connect to')
 @click.option('--compress/--no-compress', default=True,
-              help="[don't] create .tar.bz2 archives after exporting")
+              help=("[don't] stream the tables into compressed tar archives,"
+                    " rather than writing them to the tmp directory"))
+@click.option('--codec', default='bz2', type=click.Choice(sorted(CODECS)),
+              help=('compress archives with CODEC, using a parallel'
+                    ' compressor if one is installed (default: bz2)'))
 @click.option('--output-dir', default='.',
               help='place the final archive files in DIR (default: ".")')
 @click.option('--tmp-dir', default=None,
               help='use DIR for temporary storage (default: /tmp)')
 @click.option('--keep-files/--delete-files', default=False,
-              help="don't delete the exported files from the tmp directory")
+              help=("don't delete the exported files from the tmp directory,"
+                    " when not compressing"))
+@click.option('--jobs', default=1,
+              help=('dump N tables at once, using N connections which share a'
+                    ' snapshot of the database (default: 1)'))
+@click.option('--since-revision', default=None, type=int,
+              help=('dump only the rows added or changed after revision N,'
+                    ' to be applied to a database which already has it'))
 def dump(username, database, password, **kwargs):
     """ Dumps the bookbrainz data from the specified database into files. The
     user must provide the PostgreSQL USERNAME and PostgreSQL DATABASE to use,
@@ -147,54 +280,245 @@ def dump(username, database, password, **kwargs):
     temp_dir = (None if kwargs['tmp_dir'] is None
                 else os.path.abspath(kwargs['tmp_dir']))
 
-    temp_output_dir = tempfile.mkdtemp(prefix='bbexport', dir=temp_dir)
+    connect = functools.partial(
+        psycopg2.connect, database=database, user=username, password=password,
+        host=kwargs['host'], port=kwargs['port']
+    )
 
-    num_tables = 0
+    since_revision = kwargs['since_revision']
+    prefix = 'bbdump' if since_revision is None else 'bbdump-delta'
 
-    with psycopg2.connect(database=database, user=username, password=password,
-                          host=kwargs['host'], port=kwargs['port']) as conn:
-        conn.set_session(
-            isolation_level=psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-        )
-        with conn.cursor() as curs:
-            create_temporaries(curs)
+    archives = {}
+    if kwargs['compress']:
+        temp_output_dir = None
+
+        def handle_table(cursor, group, schema, table):
+            stream_table(cursor, archives[group], temp_dir, schema, table,
+                         since_revision)
+    else:
+        temp_output_dir = tempfile.mkdtemp(prefix='bbexport', dir=temp_dir)
+
+        def handle_table(cursor, group, schema, table):
+            dump_table(cursor, temp_output_dir, schema, table, since_revision)
+
+    try:
+        if kwargs['compress']:
             for group in GROUPS.keys():
-                print("Dumping Group {}...".format(group))
-                schemas = GROUPS[group]
-                for schema, tables in schemas:
-                    for table in tables:
-                        dump_table(curs, temp_output_dir, schema, table)
+                archives[group] = GroupArchive(
+                    output_dir, '{}-{}'.format(prefix, group), kwargs['codec']
+                )
+
+        with connect() as conn:
+            conn.set_session(isolation_level=psycopg2.extensions.
+                             ISOLATION_LEVEL_SERIALIZABLE)
+            with conn.cursor() as curs:
+                create_temporaries(curs)
+                write_manifest(curs, os.path.join(
+                    output_dir, '{}-manifest.json'.format(prefix)
+                ), since_revision)
+                if kwargs['jobs'] > 1:
+                    num_tables = dump_parallel(curs, connect, handle_table,
+                                               kwargs['jobs'])
+                else:
+                    num_tables = 0
+                    for group, schema, table in group_tables():
+                        handle_table(curs, group, schema, table)
                         num_tables += 1
+    finally:
+        # Finish every archive, even if one of them has failed
+        errors = []
+        for archive in archives.values():
+            try:
+                archive.close()
+            except Exception as e:
+                errors.append(e)
 
-    if kwargs['compress']:
-        for group in GROUPS.keys():
-            compress_group(temp_output_dir, group, GROUPS[group], output_dir)
+    if errors:
+        raise errors[0]
 
-    if not kwargs['keep_files']:
+    if temp_output_dir is not None and not kwargs['keep_files']:
         shutil.rmtree(temp_output_dir)
 
     end_time = datetime.datetime.now()
     print("Exported {} tables in {}".format(num_tables, end_time - start_time))
 
 
-def compress_group(source_dir, group_name, group_tables, dest_dir):
-    """ Compresses a particular group of table files into a single bzipped tar
-    file for the group, containing the exported table files.
+def group_tables():
+    """ Returns a list of the (group, schema, table) of every table to be
+    dumped, in the order of GROUPS. A table may be listed more than once, but
+    is only included once.
+    """
+    result = []
+    for group in GROUPS.keys():
+        for schema, tables in GROUPS[group]:
+            for table in tables:
+                if (group, schema, table) not in result:
+                    result.append((group, schema, table))
+
+    return result
+
+
+def which(command):
+    """ Returns the path of an executable on the PATH, or None. """
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+    return None
+
+
+class GroupArchive(object):
+    """ Writes the tables of a group into a compressed tar archive, on a thread
+    of its own, so that each group is compressed in parallel with the others
+    and with the dumping of tables. If a parallel compressor for the codec is
+    installed, the tar stream is piped through it.
     """
 
-    dest_file = os.path.join(dest_dir, 'bbdump-' + group_name + '.tar.bz2')
-    output_file = tarfile.open(dest_file, 'w:bz2')
+    def __init__(self, dest_dir, archive_name, codec):
+        extension, compression, compressors = CODECS[codec]
 
-    for schema, tables in group_tables:
-        for table in tables:
-            qualified_name = ((schema + '.' + table) if schema is not None
-                              else table)
-            output_file.add(
-                os.path.join(source_dir, qualified_name),
-                os.path.join('bbdump', qualified_name)
+        self.path = os.path.join(
+            dest_dir, '{}.{}'.format(archive_name, extension)
+        )
+        self.process = None
+
+        command = next((c for c in compressors if which(c[0]) is not None),
+                       None)
+        if command is not None:
+            self.output = open(self.path, 'wb')
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                            stdout=self.output)
+            self.tar = tarfile.open(fileobj=self.process.stdin, mode='w|')
+        elif compression is not None:
+            try:
+                self.tar = tarfile.open(self.path, 'w|' + compression)
+            except tarfile.CompressionError:
+                raise click.UsageError(
+                    "{} compression is not available".format(codec)
+                )
+        else:
+            raise click.UsageError(
+                "{} compression requires {} to be installed".format(
+                    codec, compressors[0][0]
+                )
             )
 
-    output_file.close()
+        # Only one table waits for the archive at a time, to limit the size of
+        # the spooled tables
+        self.queue = Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._write)
+        self.thread.start()
+
+    def _write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            name, spool = item
+            try:
+                if self.error is None:
+                    info = tarfile.TarInfo(os.path.join('bbdump', name))
+                    info.size = spool.tell()
+                    info.mtime = time.time()
+                    info.mode = 0o644
+
+                    spool.seek(0)
+                    self.tar.addfile(info, spool)
+            except Exception as e:
+                self.error = e
+            finally:
+                spool.close()
+
+    def add(self, name, spool):
+        """ Queues a spooled table to be written to the archive as name,
+        closing the spool once it has been written. """
+        self.queue.put((name, spool))
+
+    def close(self):
+        """ Waits for the queued tables to be written, and finishes the
+        archive. """
+        self.queue.put(None)
+        self.thread.join()
+
+        self.tar.close()
+        if self.process is not None:
+            self.process.stdin.close()
+            if self.process.wait() != 0 and self.error is None:
+                self.error = IOError(
+                    "Compressing {} failed".format(self.path)
+                )
+            self.output.close()
+
+        if self.error is not None:
+            raise self.error
+
+
+def dump_parallel(cursor, connect, handle_table, jobs):
+    """ Dumps the tables of every group using jobs connections, each of which
+    imports the snapshot of the transaction of cursor, so that every table is
+    dumped from the same state of the database. The largest tables are dumped
+    first, so that the smaller tables fill in around them. Each table is
+    passed to handle_table, with the cursor of the connection dumping it.
+    Returns the number of tables dumped.
+    """
+
+    tables = group_tables()
+
+    sizes = {}
+    for group, schema, table in tables:
+        qualified_name = ((schema + '.' + table) if schema is not None
+                          else table)
+        cursor.execute('SELECT pg_total_relation_size(%s::regclass)',
+                       (qualified_name,))
+        sizes[(group, schema, table)] = cursor.fetchone()[0]
+
+    tables.sort(key=lambda group_table: sizes[group_table], reverse=True)
+
+    # The snapshot remains valid until the transaction of cursor ends
+    cursor.execute('SELECT pg_export_snapshot()')
+    snapshot = cursor.fetchone()[0]
+
+    print("Dumping {} tables with {} jobs...".format(len(tables), jobs))
+
+    pending = deque(tables)
+    errors = []
+
+    def worker():
+        try:
+            conn = connect()
+            try:
+                conn.set_session(isolation_level=psycopg2.extensions.
+                                 ISOLATION_LEVEL_SERIALIZABLE)
+                with conn.cursor() as curs:
+                    curs.execute('SET TRANSACTION SNAPSHOT %s', (snapshot,))
+                    create_temporaries(curs)
+                    while not errors:
+                        try:
+                            group, schema, table = pending.popleft()
+                        except IndexError:
+                            break
+
+                        handle_table(curs, group, schema, table)
+                conn.rollback()
+            finally:
+                conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker)
+               for _ in range(min(jobs, len(tables)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+    return len(tables)
 
 
 def create_temporaries(cursor):
@@ -205,12 +529,67 @@ def create_temporaries(cursor):
         cursor.execute(temporary)
 
 
-def dump_table(cursor, output_dir, schema, table):
+def write_manifest(cursor, path, since_revision):
+    """ Writes a manifest for a dump, recording the revision it starts after,
+    if it is a delta dump, and the last revision it includes, which is the
+    revision the next delta dump should start after.
+    """
+    cursor.execute('SELECT max(revision_id) FROM bookbrainz.revision')
+    manifest = {
+        'since_revision': since_revision,
+        'revision_id': cursor.fetchone()[0],
+        'created_at': datetime.datetime.utcnow().isoformat(),
+        'groups': sorted(GROUPS.keys())
+    }
+
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=4, sort_keys=True)
+
+
+def copy_table(cursor, f, qualified_name, since_revision=None):
+    """ Copies the rows of a table to a file object. If since_revision is
+    given, only the rows of the table selected by DELTA_FILTERS are copied.
+    """
+    delta_filter = DELTA_FILTERS.get(qualified_name)
+    if since_revision is None or delta_filter is None:
+        cursor.copy_to(f, qualified_name)
+        return
+
+    query = cursor.mogrify(
+        'SELECT * FROM {} WHERE {}'.format(qualified_name, delta_filter),
+        {'since': since_revision}
+    )
+    if isinstance(query, bytes):
+        query = query.decode('utf8')
+
+    cursor.copy_expert('COPY ({}) TO STDOUT'.format(query), f)
+
+
+def dump_table(cursor, output_dir, schema, table, since_revision=None):
     """ Dumps a particular table to the provided output directory. """
     qualified_name = (schema + '.' + table) if schema is not None else table
     print("\tDumping Table {}...".format(qualified_name))
     with open(os.path.join(output_dir, qualified_name), 'wb') as f:
-        cursor.copy_to(f, qualified_name)
+        copy_table(cursor, f, qualified_name, since_revision)
+
+
+def stream_table(cursor, archive, temp_dir, schema, table,
+                 since_revision=None):
+    """ Dumps a particular table into a GroupArchive. Tar records the size of
+    each file before its contents, so the table is spooled until it has been
+    dumped, in memory up to SPOOL_SIZE and in temp_dir beyond that.
+    """
+    qualified_name = (schema + '.' + table) if schema is not None else table
+    print("\tDumping Table {}...".format(qualified_name))
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE, mode='w+b',
+                                          prefix='bbexport', dir=temp_dir)
+    try:
+        copy_table(cursor, spool, qualified_name, since_revision)
+    except Exception:
+        spool.close()
+        raise
+
+    archive.add(qualified_name, spool)
 
 if __name__ == "__main__":
     dump()
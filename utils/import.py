@@ -24,19 +24,53 @@ from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
 import datetime
+import functools
+import json
 import os
 import shutil
+import subprocess
 import tarfile
 import tempfile
+import threading
+from collections import deque
+from contextlib import closing
 
 import click
 import psycopg2
 import psycopg2.extensions
 
+try:
+    from queue import Full, Queue
+except ImportError:
+    from Queue import Full, Queue
+
 TABLE_RENAMES = {
     'user_sanitised': 'bookbrainz.user'
 }
 
+# Each archive extension maps to the tarfile compression used when no
+# parallel decompressor is installed (None if there isn't one), and the
+# parallel decompressors to try first, in order of preference
+CODECS = {
+    '.tar.bz2': ('bz2', [['lbzip2', '-dc'], ['pbzip2', '-dc']]),
+    '.tar.gz': ('gz', [['pigz', '-dc']]),
+    '.tar.xz': ('xz', [['xz', '-T0', '-dc']]),
+    '.tar.zst': (None, [['zstd', '-dcq']])
+}
+
+# The size of the chunks passed from the archive reader to COPY
+CHUNK_SIZE = 1024 * 1024
+
+# The number of chunks which may be decompressed ahead of COPY
+CHUNKS_AHEAD = 16
+
+# The schemas whose indexes and foreign keys are rebuilt by parallel imports
+SCHEMAS = ['bookbrainz', 'musicbrainz']
+
+# In parallel imports, tables are held in memory up to this size while they
+# wait to be copied, and spilled to the tmp directory beyond it
+SPOOL_SIZE = 64 * 1024 * 1024
+
 
 @click.command()
 @click.argument('username')
@@ -51,7 +85,20 @@ TABLE_RENAMES = {
 @click.option('--keep-files/--delete-files', default=False,
               help="delete the imported files from the source directory")
 @click.option('--tmp-dir', default=None,
-              help='use DIR for temporary storage (default: /tmp)')
+              help=('use DIR for tables waiting to be copied by parallel'
+                    ' imports. Only valid with --jobs, since serial imports'
+                    ' stream each archive (default: /tmp)'))
+@click.option('--jobs', default=1,
+              help=('copy N tables at once, dropping indexes and foreign keys'
+                    ' until the tables have been copied, and then rebuilding'
+                    ' them with N connections. This import is not done in a'
+                    ' single transaction (default: 1)'))
+@click.option('--apply-delta', is_flag=True, default=False,
+              help=('merge the rows of a delta dump into the database,'
+                    ' updating rows which already exist'))
+@click.option('--manifest', default=None,
+              help=('the manifest of the delta dump to apply (default:'
+                    ' bbdump-delta-manifest.json, beside the first source)'))
 @click.option('--source', multiple=True, help='source files to import from')
 def imp(username, database, password, **kwargs):
     """ Imports BookBrainz database dumps which have previously been stored
@@ -64,26 +111,51 @@ def imp(username, database, password, **kwargs):
 
     temp_dir = (None if kwargs['tmp_dir'] is None
                 else os.path.abspath(kwargs['tmp_dir']))
-    temp_output_dir = tempfile.mkdtemp(prefix='bbimport', dir=temp_dir)
 
     num_tables = 0
 
-    for source in sources:
-        archive = tarfile.open(source, 'r:bz2')
-        archive.extractall(temp_output_dir)
+    connect = functools.partial(
+        psycopg2.connect, database=database, user=username, password=password,
+        host=kwargs['host'], port=kwargs['port']
+    )
 
-    with psycopg2.connect(database=database, user=username, password=password,
-                          host=kwargs['host'], port=kwargs['port']) as conn:
-        conn.set_session(
-            isolation_level=psycopg2.extensions.ISOLATION_LEVEL_SERIALIZABLE
-        )
-        with conn.cursor() as curs:
-            curs.execute('SET CONSTRAINTS ALL DEFERRED')
-            num_tables +=\
-                import_directory(os.path.join(temp_output_dir, 'bbdump'), curs)
-            set_sequence_values(curs)
+    if kwargs['tmp_dir'] is not None and kwargs['jobs'] <= 1:
+        raise click.UsageError('--tmp-dir can only be used with --jobs')
+
+    manifest = None
+    if kwargs['apply_delta']:
+        if kwargs['jobs'] > 1:
+            raise click.UsageError('--apply-delta can\'t be used with --jobs')
+
+        manifest_path = kwargs['manifest']
+        if manifest_path is None and sources:
+            manifest_path = os.path.join(os.path.dirname(sources[0]),
+                                         'bbdump-delta-manifest.json')
+        if manifest_path is None or not os.path.exists(manifest_path):
+            raise click.UsageError('No delta manifest was found')
+
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+    if kwargs['jobs'] > 1:
+        num_tables = import_parallel(sources, connect, kwargs['jobs'],
+                                     temp_dir)
+    else:
+        # Leaving the block of a connection commits its transaction, but
+        # doesn't close it
+        with closing(connect()) as conn, conn:
+            conn.set_session(isolation_level=psycopg2.extensions.
+                             ISOLATION_LEVEL_SERIALIZABLE)
+            with conn.cursor() as curs:
+                curs.execute('SET CONSTRAINTS ALL DEFERRED')
+                if manifest is not None:
+                    check_delta(curs, manifest)
+                for source in sources:
+                    num_tables += import_archive(
+                        source, curs, kwargs['apply_delta']
+                    )
+                set_sequence_values(curs)
 
-    shutil.rmtree(temp_output_dir)
     if not kwargs['keep_files']:
         pass
 
@@ -91,17 +163,442 @@ def imp(username, database, password, **kwargs):
     print("Imported {} tables in {}".format(num_tables, end_time - start_time))
 
 
-def import_directory(source_dir, curs):
-    """ Import BookBrainz tables from a directory containing dump files. """
+def import_archive(source, curs, upsert=False):
+    """ Import BookBrainz tables from a dump archive, copying each file into
+    its table as it is read from the archive. If upsert is True, the rows are
+    merged into the tables with upsert_table. """
     num_tables = 0
-    for table in os.listdir(source_dir):
-        with open(os.path.join(source_dir, table), 'rb') as f_obj:
-            table = TABLE_RENAMES.get(table, table)
+    reader = ArchiveReader(source)
+    try:
+        for name, f_obj in reader:
+            table = TABLE_RENAMES.get(name, name)
             print('Importing to {}...'.format(table))
-            curs.copy_from(f_obj, table)
+            if upsert:
+                upsert_table(curs, f_obj, table)
+            else:
+                curs.copy_from(f_obj, table, size=CHUNK_SIZE)
             num_tables += 1
+    finally:
+        reader.close()
+    return num_tables
+
+
+def check_delta(curs, manifest):
+    """ Checks that the database has every revision up to the revision which a
+    delta dump starts after, so that the delta doesn't leave a gap. """
+    curs.execute('SELECT max(revision_id) FROM bookbrainz.revision')
+    revision_id = curs.fetchone()[0] or 0
+
+    since_revision = manifest.get('since_revision') or 0
+    if revision_id < since_revision:
+        raise click.ClickException(
+            'The delta starts after revision {}, but the database only has '
+            'revisions up to {}'.format(since_revision, revision_id)
+        )
+
+
+def upsert_table(curs, f_obj, table):
+    """ Copies a file into a temporary table, and merges its rows into table,
+    replacing the rows with the same primary keys. The existing rows are
+    updated before the others are inserted. Rows of a table without a primary
+    key are inserted unless the table already has an identical row. """
+    curs.execute(
+        'SELECT a.attname, a.attnum = ANY(i.indkey) '
+        'FROM pg_attribute a LEFT JOIN pg_index i '
+        '  ON i.indrelid = a.attrelid AND i.indisprimary '
+        'WHERE a.attrelid = %s::regclass AND a.attnum > 0 '
+        '  AND NOT a.attisdropped '
+        'ORDER BY a.attnum', (table,)
+    )
+    columns = curs.fetchall()
+
+    keys = ['"{}"'.format(name) for name, is_key in columns if is_key]
+    values = ['"{}"'.format(name) for name, is_key in columns if not is_key]
+
+    curs.execute('CREATE TEMPORARY TABLE delta_rows (LIKE {})'.format(table))
+    curs.copy_from(f_obj, 'delta_rows', size=CHUNK_SIZE)
+
+    if keys:
+        match = ' AND '.join('t.{0} = d.{0}'.format(k) for k in keys)
+        if values:
+            curs.execute(
+                'UPDATE {} t SET {} FROM delta_rows d WHERE {}'.format(
+                    table, ', '.join('{0} = d.{0}'.format(v) for v in values),
+                    match
+                )
+            )
+        curs.execute(
+            'INSERT INTO {0} SELECT * FROM delta_rows d '
+            'WHERE NOT EXISTS (SELECT 1 FROM {0} t WHERE {1})'.format(
+                table, match
+            )
+        )
+    else:
+        curs.execute(
+            'INSERT INTO {0} SELECT * FROM delta_rows '
+            'EXCEPT SELECT * FROM {0}'.format(table)
+        )
+    curs.execute('DROP TABLE delta_rows')
+
+
+def run_workers(connect, jobs, next_item, handle_item):
+    """ Calls handle_item with a cursor and each item returned by next_item,
+    until it returns None, on jobs connections at once. Each item is
+    committed once it has been handled. Raises the first error from any of
+    the connections, once they have all stopped. """
+    errors = []
+
+    def worker():
+        try:
+            conn = connect()
+            try:
+                with conn.cursor() as curs:
+                    while not errors:
+                        item = next_item()
+                        if item is None:
+                            break
+
+                        handle_item(curs, item)
+                        conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(jobs)]
+    for thread in threads:
+        thread.start()
+
+    return threads, errors
+
+
+def join_workers(threads, errors):
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+
+
+def run_parallel(connect, jobs, items, handle_item):
+    """ Calls handle_item with a cursor and each of items, on jobs connections
+    at once. """
+    pending = deque(items)
+
+    def next_item():
+        try:
+            return pending.popleft()
+        except IndexError:
+            return None
+
+    join_workers(*run_workers(connect, jobs, next_item, handle_item))
+
+
+def drop_indexes_and_foreign_keys(curs):
+    """ Drops the foreign keys and the indexes which don't belong to
+    constraints in SCHEMAS, returning a list of (table, name, definition) for
+    each of the foreign keys, and a list of (table, definition) for each of the
+    indexes. Primary keys and unique constraints are kept, so that they are
+    still checked while importing, and can be used to check the foreign
+    keys. """
+    curs.execute(
+        'SELECT c.conrelid::regclass::text, c.conname, '
+        '       pg_get_constraintdef(c.oid) '
+        'FROM pg_constraint c JOIN pg_namespace n ON n.oid = c.connamespace '
+        "WHERE c.contype = 'f' AND n.nspname = ANY(%s)", (SCHEMAS,)
+    )
+    foreign_keys = curs.fetchall()
+
+    curs.execute(
+        'SELECT i.indrelid::regclass::text, i.indexrelid::regclass::text, '
+        '       pg_get_indexdef(i.indexrelid) '
+        'FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+        'JOIN pg_namespace n ON n.oid = c.relnamespace '
+        'WHERE n.nspname = ANY(%s) AND NOT EXISTS ('
+        '  SELECT 1 FROM pg_constraint k WHERE k.conindid = i.indexrelid'
+        ')', (SCHEMAS,)
+    )
+    indexes = curs.fetchall()
+
+    for table, name, _ in foreign_keys:
+        curs.execute('ALTER TABLE {} DROP CONSTRAINT "{}"'.format(table, name))
+
+    for _, index, _ in indexes:
+        curs.execute('DROP INDEX {}'.format(index))
+
+    return (foreign_keys,
+            [(table, definition) for table, _, definition in indexes])
+
+
+def rebuild_indexes_and_foreign_keys(connect, jobs, foreign_keys, indexes,
+                                     validate=True):
+    """ Recreates the indexes and foreign keys dropped by
+    drop_indexes_and_foreign_keys on jobs connections at once. The indexes are
+    built first, largest tables first. The foreign keys are then added
+    without being checked, and if validate is True, each table's foreign keys
+    are validated together, since validating them locks the table. """
+    with closing(connect()) as conn, conn:
+        with conn.cursor() as curs:
+            sizes = {}
+            for table, _ in indexes:
+                curs.execute('SELECT pg_relation_size(%s::regclass)',
+                             (table,))
+                sizes[table] = curs.fetchone()[0]
+
+    indexes = sorted(indexes, key=lambda index: sizes[index[0]],
+                     reverse=True)
+
+    def build_index(curs, index):
+        print('Building index on {}...'.format(index[0]))
+        curs.execute(index[1])
+
+    run_parallel(connect, jobs, indexes, build_index)
+
+    table_foreign_keys = {}
+    with closing(connect()) as conn, conn:
+        with conn.cursor() as curs:
+            for table, name, definition in foreign_keys:
+                curs.execute(
+                    'ALTER TABLE {} ADD CONSTRAINT "{}" {} NOT VALID'.format(
+                        table, name, definition
+                    )
+                )
+                table_foreign_keys.setdefault(table, []).append(name)
+
+    def validate_table(curs, table_names):
+        table, names = table_names
+        print('Validating foreign keys of {}...'.format(table))
+        for name in names:
+            curs.execute('ALTER TABLE {} VALIDATE CONSTRAINT "{}"'.format(
+                table, name
+            ))
+
+    if validate:
+        run_parallel(connect, jobs, list(table_foreign_keys.items()),
+                     validate_table)
+
+
+def import_parallel(sources, connect, jobs, temp_dir):
+    """ Imports dump archives using jobs connections at once. Indexes and
+    foreign keys are dropped while the tables are copied, and rebuilt once
+    they have all been copied. Each file is spooled while it waits to be
+    copied, in memory up to SPOOL_SIZE and in temp_dir beyond that. Returns
+    the number of tables imported. """
+    with closing(connect()) as conn, conn:
+        with conn.cursor() as curs:
+            foreign_keys, indexes = drop_indexes_and_foreign_keys(curs)
+
+    queue = Queue(maxsize=jobs)
+
+    def copy_table(curs, item):
+        table, spool = item
+        try:
+            print('Importing to {}...'.format(table))
+            spool.seek(0)
+            curs.copy_from(spool, table, size=CHUNK_SIZE)
+        finally:
+            spool.close()
+
+    threads, errors = run_workers(connect, jobs, queue.get, copy_table)
+
+    def put(item):
+        # Stops waiting if all of the workers have failed
+        while not errors or any(thread.is_alive() for thread in threads):
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                if errors:
+                    return False
+        return False
+
+    num_tables = 0
+    try:
+        try:
+            for source in sources:
+                reader = ArchiveReader(source)
+                try:
+                    for name, f_obj in reader:
+                        spool = tempfile.SpooledTemporaryFile(
+                            max_size=SPOOL_SIZE, mode='w+b',
+                            prefix='bbimport', dir=temp_dir
+                        )
+                        shutil.copyfileobj(f_obj, spool, CHUNK_SIZE)
+                        if not put((TABLE_RENAMES.get(name, name), spool)):
+                            spool.close()
+                            break
+                        num_tables += 1
+                finally:
+                    reader.close()
+
+                if errors:
+                    break
+        finally:
+            for _ in threads:
+                put(None)
+            join_workers(threads, errors)
+    except Exception:
+        # Restores the schema, without checking the partly imported data
+        print('Import failed, restoring indexes and foreign keys...')
+        rebuild_indexes_and_foreign_keys(connect, jobs, foreign_keys, indexes,
+                                         validate=False)
+        raise
+
+    rebuild_indexes_and_foreign_keys(connect, jobs, foreign_keys, indexes)
+
+    with closing(connect()) as conn, conn:
+        with conn.cursor() as curs:
+            set_sequence_values(curs)
+
     return num_tables
 
+
+def which(command):
+    """ Returns the path of an executable on the PATH, or None. """
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+
+    return None
+
+
+class _MemberFile(object):
+    """ A file object reading the chunks of one archive member from the
+    queue of an ArchiveReader. """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.chunk = b''
+        self.position = 0
+        self.finished = False
+
+    def _next_chunk(self):
+        chunk = self.queue.get()
+        if chunk is None:
+            self.finished = True
+            return False
+
+        self.chunk, self.position = chunk, 0
+        return True
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.position >= len(self.chunk):
+                if self.finished or not self._next_chunk():
+                    break
+
+            end = len(self.chunk)
+            if size > 0:
+                end = min(end, self.position + size)
+                size -= end - self.position
+
+            parts.append(self.chunk[self.position:end])
+            self.position = end
+
+        return b''.join(parts)
+
+    def drain(self):
+        while not self.finished:
+            self._next_chunk()
+
+
+class ArchiveReader(object):
+    """ Reads the files in a dump archive on a thread of its own, so that
+    decompression overlaps with the COPY of the previous file. Iterating over
+    the reader yields the (name, file object) of each file, which must be read
+    before the next file is requested. If a parallel decompressor for the
+    archive is installed, the archive is piped through it.
+    """
+
+    def __init__(self, source):
+        compression, decompressors = None, []
+        for extension, codec in CODECS.items():
+            if source.endswith(extension):
+                compression, decompressors = codec
+
+        self.process = None
+        command = next((c for c in decompressors if which(c[0]) is not None),
+                       None)
+        if command is not None:
+            self.process = subprocess.Popen(command + [source],
+                                            stdout=subprocess.PIPE)
+            self.tar = tarfile.open(fileobj=self.process.stdout, mode='r|')
+        elif decompressors and compression is None:
+            raise click.UsageError(
+                "{} requires {} to be installed".format(
+                    source, decompressors[0][0]
+                )
+            )
+        else:
+            try:
+                self.tar = tarfile.open(source, 'r|' + (compression or '*'))
+            except tarfile.CompressionError:
+                raise click.UsageError(
+                    "{} compression is not available".format(compression)
+                )
+
+        self.queue = Queue(maxsize=CHUNKS_AHEAD)
+        self.closed = False
+        self.error = None
+        self.thread = threading.Thread(target=self._read)
+        self.thread.start()
+
+    def _put(self, item):
+        if not self.closed:
+            self.queue.put(item)
+
+    def _read(self):
+        try:
+            for member in self.tar:
+                if not member.isfile():
+                    continue
+
+                self._put(os.path.basename(member.name))
+                f_obj = self.tar.extractfile(member)
+                while not self.closed:
+                    chunk = f_obj.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self._put(chunk)
+                self._put(None)
+        except Exception as e:
+            self.error = e
+            # Ends the file being read, if there is one
+            self._put(None)
+        finally:
+            # Marks the end of the archive
+            self._put(None)
+
+    def __iter__(self):
+        while True:
+            name = self.queue.get()
+            if name is None:
+                break
+
+            member_file = _MemberFile(self.queue)
+            yield name, member_file
+            member_file.drain()
+
+        if self.error is not None:
+            raise self.error
+
+    def close(self):
+        """ Stops reading the archive, and waits for the reading thread to
+        finish. """
+        self.closed = True
+        while self.thread.is_alive():
+            # Unblocks the reading thread if it is waiting on a full queue
+            while not self.queue.empty():
+                self.queue.get()
+            self.thread.join(0.1)
+
+        self.tar.close()
+        if self.process is not None:
+            self.process.stdout.close()
+            self.process.wait()
+
 SEQUENCES = (
     ('bookbrainz.disambiguation_id_seq',
      'bookbrainz.disambiguation.disambiguation_id'),
@@ -24,12 +24,22 @@ script.
 
 from __future__ import (absolute_import, division, print_function)
 
+import datetime
+import multiprocessing
+import time
+
 import click
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.sql import text
 
 from bbschema import *
 
+ENTITY_TYPES = ['Creator', 'Edition', 'Publication', 'Publisher', 'Work']
+
+# The number of entities whose history is migrated at once
+ENTITY_BATCH_SIZE = 1000
+
 
 def migrate_types(session):
     session.execute("""
@@ -151,358 +161,246 @@ def migrate_revisions(session):
     """)
 
 
-def limit_query(q, limit):
-    offset = 0
-    results = q.limit(limit).offset(offset).all()
-    while results:
-        for result in results:
-            yield result
-        offset += limit
-        results = q.limit(limit).offset(offset).all()
-
-
-def convert_date(date, precision):
-    if date is None:
-        return (None, None, None)
-    else:
-        if precision == 'DAY':
-            return (date.year, date.month, date.day)
-        elif precision == 'MONTH':
-            return (date.year, date.month, None)
-        else:
-            return (date.year, None, None)
-
-
-def insert_creator_data_and_revision(session, entity, revision, data,
-                                     alias_set_id, identifier_set_id,
-                                     relationship_set_id):
-
-    if data is not None:
-        begin_year, begin_month, begin_day = \
-            convert_date(data.begin_date, data.begin_date_precision)
-        end_year, end_month, end_day = \
-            convert_date(data.end_date, data.end_date_precision)
-
-        result = session.execute(
-            '''INSERT INTO _bookbrainz.creator_data (
-                alias_set_id, identifier_set_id, relationship_set_id,
-                annotation_id, disambiguation_id, begin_year, begin_month,
-                begin_day, end_year, end_month, end_day, ended, gender_id, type_id
-            ) VALUES (
-                :alias_set_id, :identifier_set_id, :relationship_set_id,
-                :annotation_id, :disambiguation_id,  :begin_year, :begin_month,
-                :begin_day, :end_year, :end_month, :end_day, :ended, :gender_id,
-                :type_id
-            ) RETURNING id''', {
-                'alias_set_id': alias_set_id,
-                'identifier_set_id': identifier_set_id,
-                'relationship_set_id': relationship_set_id,
-                'annotation_id': data.annotation_id,
-                'disambiguation_id': data.disambiguation_id,
-                'begin_year': begin_year,
-                'begin_month': begin_month,
-                'begin_day': begin_day,
-                'end_year': end_year,
-                'end_month': end_month,
-                'end_day': end_day,
-                'ended': data.ended,
-                'gender_id': data.gender_id,
-                'type_id': data.creator_type_id
-            }
-        )
-        data_id = result.fetchone()[0]
-    else:
-        data_id = None
-
-    session.execute(
-        '''INSERT INTO _bookbrainz.creator_revision (
-            id, bbid, data_id
-        ) VALUES (
-            :id, :bbid, :data_id
-        )''', {
-            'id': revision.revision_id,
-            'bbid': entity.entity_gid,
-            'data_id': data_id
-        }
+def next_id(table):
+    """ Returns an SQL expression taking the next value of the ID sequence of
+    the given table in the new schema, so that IDs can be assigned to rows
+    before they are inserted.
+    """
+    return "nextval(pg_get_serial_sequence('_bookbrainz.{}', 'id'))".format(
+        table
     )
 
 
-def insert_edition_data_and_revision(session, entity, revision, data,
-                                     alias_set_id, identifier_set_id,
-                                     relationship_set_id):
-    if data is not None:
-        language_set_id = None
-        publisher_set_id = None
-        release_event_set_id = None
-
-        if data.language_id is not None:
-            language_set_id = session.execute(
-                '''INSERT INTO _bookbrainz.language_set
-                    DEFAULT VALUES
-                    RETURNING id'''
-            ).fetchone()[0]
-
-            session.execute(
-                '''INSERT INTO _bookbrainz.language_set__language (
-                    set_id, language_id
-                ) VALUES (
-                    :set_id, :language_id
-                )
-                ''', {
-                    'set_id': language_set_id,
-                    'language_id': data.language_id
-                }
-            )
-
-        # Create a release event if release date is not NULL
-        if data.release_date is not None:
-            release_year, release_month, release_day = \
-                convert_date(data.release_date, data.release_date_precision)
-            result = session.execute(
-                '''INSERT INTO _bookbrainz.release_event (
-                    "year", "month", "day"
-                ) VALUES (
-                    :year, :month, :day
-                ) RETURNING id
-                ''', {
-                    'year': release_year,
-                    'month': release_month,
-                    'day': release_day
-                }
-            )
-            release_event_id = result.fetchone()[0]
-
-            release_event_set_id = session.execute(
-                '''INSERT INTO _bookbrainz.release_event_set
-                    DEFAULT VALUES
-                    RETURNING id'''
-            ).fetchone()[0]
-
-            session.execute(
-                '''INSERT INTO _bookbrainz.release_event_set__release_event (
-                    release_event_id, set_id
-                ) VALUES (
-                    :event_id, :set_id
-                )
-                ''', {
-                    'event_id': release_event_id,
-                    'set_id': release_event_set_id
-                }
-            )
+def date_columns(column):
+    """ Returns SQL expressions for the year, month and day of a date column
+    in the old schema, leaving out the parts beyond the date's precision.
+    """
+    return """
+        extract(year FROM d.{0})::integer,
+        CASE WHEN d.{0}_precision IN ('DAY', 'MONTH')
+            THEN extract(month FROM d.{0})::integer END,
+        CASE WHEN d.{0}_precision = 'DAY'
+            THEN extract(day FROM d.{0})::integer END
+    """.format(column)
 
-        if data.publisher_gid is not None:
-            publisher_set_id = session.execute(
-                '''INSERT INTO _bookbrainz.publisher_set
-                    DEFAULT VALUES
-                    RETURNING id'''
-            ).fetchone()[0]
 
-            session.execute(
-                '''INSERT INTO _bookbrainz.publisher_set__publisher (
-                    set_id, publisher_bbid
-                ) VALUES (
-                    :set_id, :publisher_bbid
-                )
-                ''', {
-                    'set_id': publisher_set_id,
-                    'publisher_bbid': data.publisher_gid
-                }
-            )
-
-        result = session.execute(
-            '''INSERT INTO _bookbrainz.edition_data (
-                alias_set_id, identifier_set_id, relationship_set_id,
-                annotation_id, disambiguation_id, publication_bbid, width, height,
-                depth, weight, pages, format_id, status_id, language_set_id,
-                release_event_set_id, publisher_set_id
-            ) VALUES (
-                :alias_set_id, :identifier_set_id, :relationship_set_id,
-                :annotation_id, :disambiguation_id, :publication_bbid, :width,
-                :height, :depth, :weight, :pages, :format_id, :status_id,
-                :language_set_id, :release_event_set_id, :publisher_set_id
-            ) RETURNING id''', {
-                'alias_set_id': alias_set_id,
-                'identifier_set_id': identifier_set_id,
-                'relationship_set_id': relationship_set_id,
-                'annotation_id': data.annotation_id,
-                'disambiguation_id': data.disambiguation_id,
-                'publication_bbid': data.publication_gid,
-                'width': data.width,
-                'height': data.height,
-                'depth': data.depth,
-                'weight': data.weight,
-                'pages': data.pages,
-                'format_id': data.edition_format_id,
-                'status_id': data.edition_status_id,
-                'language_set_id': language_set_id,
-                'release_event_set_id': release_event_set_id,
-                'publisher_set_id': publisher_set_id
-            }
-        )
-        data_id = result.fetchone()[0]
-    else:
-        data_id = None
+def insert_creator_data(session, empty_alias_set):
+    session.execute("""
+        INSERT INTO _bookbrainz.creator_data (
+            id, alias_set_id, identifier_set_id, relationship_set_id,
+            annotation_id, disambiguation_id, begin_year, begin_month,
+            begin_day, end_year, end_month, end_day, ended, gender_id, type_id
+        ) SELECT
+            n.id, COALESCE(s.alias_set_id, :empty_alias_set),
+            s.identifier_set_id, n.relationship_set_id, ed.annotation_id,
+            ed.disambiguation_id, {}, {}, d.ended, d.gender_id,
+            d.creator_type_id
+        FROM new_data n
+        JOIN entity_data_sets s ON s.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.entity_data ed ON ed.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.creator_data d ON d.entity_data_id = n.entity_data_id
+    """.format(date_columns('begin_date'), date_columns('end_date')),
+    {'empty_alias_set': empty_alias_set})
+
+
+def insert_edition_data(session, empty_alias_set):
+    # Language, release event and publisher sets are made once for each
+    # edition data in the old schema, and shared by the rows made from it
+    session.execute("""
+        CREATE TEMPORARY TABLE edition_data_sets AS
+        SELECT
+            d.entity_data_id,
+            CASE WHEN d.language_id IS NOT NULL
+                THEN {} END AS language_set_id,
+            CASE WHEN d.release_date IS NOT NULL
+                THEN {} END AS release_event_id,
+            CASE WHEN d.release_date IS NOT NULL
+                THEN {} END AS release_event_set_id,
+            CASE WHEN d.publisher_gid IS NOT NULL
+                THEN {} END AS publisher_set_id
+        FROM bookbrainz.edition_data d
+        WHERE d.entity_data_id IN (SELECT entity_data_id FROM new_data)
+    """.format(next_id('language_set'), next_id('release_event'),
+               next_id('release_event_set'), next_id('publisher_set')))
 
-    session.execute(
-        '''INSERT INTO _bookbrainz.edition_revision (
-            id, bbid, data_id
-        ) VALUES (
-            :id, :bbid, :data_id
-        )''', {
-            'id': revision.revision_id,
-            'bbid': entity.entity_gid,
-            'data_id': data_id
-        }
-    )
+    session.execute("""
+        INSERT INTO _bookbrainz.language_set (
+            id
+        ) SELECT
+            language_set_id
+        FROM edition_data_sets
+        WHERE language_set_id IS NOT NULL
+    """)
 
+    session.execute("""
+        INSERT INTO _bookbrainz.language_set__language (
+            set_id, language_id
+        ) SELECT
+            s.language_set_id, d.language_id
+        FROM edition_data_sets s
+        JOIN bookbrainz.edition_data d ON d.entity_data_id = s.entity_data_id
+        WHERE s.language_set_id IS NOT NULL
+    """)
 
-def insert_work_data_and_revision(session, entity, revision, data,
-                                  alias_set_id, identifier_set_id,
-                                  relationship_set_id):
-    if data is not None:
-        language_set_id = None
-
-        if data.languages:
-            language_set_id = session.execute(
-                '''INSERT INTO _bookbrainz.language_set
-                    DEFAULT VALUES
-                    RETURNING id'''
-            ).fetchone()[0]
-
-            # Create a release event if release date is not NULL
-            for language in data.languages:
-                session.execute(
-                    '''INSERT INTO _bookbrainz.language_set__language (
-                        set_id, language_id
-                    ) VALUES (
-                        :set_id, :language_id
-                    )
-                    ''', {
-                        'set_id': language_set_id,
-                        'language_id': language.id
-                    }
-                )
+    session.execute("""
+        INSERT INTO _bookbrainz.release_event (
+            id, "year", "month", "day"
+        ) SELECT
+            s.release_event_id, {}
+        FROM edition_data_sets s
+        JOIN bookbrainz.edition_data d ON d.entity_data_id = s.entity_data_id
+        WHERE s.release_event_id IS NOT NULL
+    """.format(date_columns('release_date')))
 
-        result = session.execute(
-            '''INSERT INTO _bookbrainz.work_data (
-                alias_set_id, identifier_set_id, relationship_set_id,
-                annotation_id, disambiguation_id, type_id, language_set_id
-            ) VALUES (
-                :alias_set_id, :identifier_set_id, :relationship_set_id,
-                :annotation_id, :disambiguation_id, :type_id, :language_set_id
-            ) RETURNING id''', {
-                'alias_set_id': alias_set_id,
-                'identifier_set_id': identifier_set_id,
-                'relationship_set_id': relationship_set_id,
-                'annotation_id': data.annotation_id,
-                'disambiguation_id': data.disambiguation_id,
-                'type_id': data.work_type_id,
-                'language_set_id': language_set_id
-            }
-        )
-        data_id = result.fetchone()[0]
-    else:
-        data_id = None
+    session.execute("""
+        INSERT INTO _bookbrainz.release_event_set (
+            id
+        ) SELECT
+            release_event_set_id
+        FROM edition_data_sets
+        WHERE release_event_set_id IS NOT NULL
+    """)
 
-    session.execute(
-        '''INSERT INTO _bookbrainz.work_revision (
-            id, bbid, data_id
-        ) VALUES (
-            :id, :bbid, :data_id
-        )''', {
-            'id': revision.revision_id,
-            'bbid': entity.entity_gid,
-            'data_id': data_id
-        }
-    )
+    session.execute("""
+        INSERT INTO _bookbrainz.release_event_set__release_event (
+            release_event_id, set_id
+        ) SELECT
+            release_event_id, release_event_set_id
+        FROM edition_data_sets
+        WHERE release_event_set_id IS NOT NULL
+    """)
 
+    session.execute("""
+        INSERT INTO _bookbrainz.publisher_set (
+            id
+        ) SELECT
+            publisher_set_id
+        FROM edition_data_sets
+        WHERE publisher_set_id IS NOT NULL
+    """)
 
-def insert_publisher_data_and_revision(session, entity, revision, data,
-                                       alias_set_id, identifier_set_id,
-                                       relationship_set_id):
-    if data is not None:
-        begin_year, begin_month, begin_day = \
-            convert_date(data.begin_date, data.begin_date_precision)
-        end_year, end_month, end_day = \
-            convert_date(data.end_date, data.end_date_precision)
-
-        result = session.execute(
-            '''INSERT INTO _bookbrainz.publisher_data (
-                alias_set_id, identifier_set_id, relationship_set_id,
-                annotation_id, disambiguation_id, begin_year, begin_month,
-                begin_day, end_year, end_month, end_day, ended, type_id
-            ) VALUES (
-                :alias_set_id, :identifier_set_id, :relationship_set_id,
-                :annotation_id, :disambiguation_id, :begin_year, :begin_month,
-                :begin_day, :end_year, :end_month, :end_day, :ended, :type_id
-            ) RETURNING id''', {
-                'alias_set_id': alias_set_id,
-                'identifier_set_id': identifier_set_id,
-                'relationship_set_id': relationship_set_id,
-                'annotation_id': data.annotation_id,
-                'disambiguation_id': data.disambiguation_id,
-                'begin_year': begin_year,
-                'begin_month': begin_month,
-                'begin_day': begin_day,
-                'end_year': end_year,
-                'end_month': end_month,
-                'end_day': end_day,
-                'ended': data.ended,
-                'type_id': data.publisher_type_id
-            }
-        )
-        data_id = result.fetchone()[0]
-    else:
-        data_id = None
+    session.execute("""
+        INSERT INTO _bookbrainz.publisher_set__publisher (
+            set_id, publisher_bbid
+        ) SELECT
+            s.publisher_set_id, d.publisher_gid
+        FROM edition_data_sets s
+        JOIN bookbrainz.edition_data d ON d.entity_data_id = s.entity_data_id
+        WHERE s.publisher_set_id IS NOT NULL
+    """)
 
-    session.execute(
-        '''INSERT INTO _bookbrainz.publisher_revision (
-            id, bbid, data_id
-        ) VALUES (
-            :id, :bbid, :data_id
-        )''', {
-            'id': revision.revision_id,
-            'bbid': entity.entity_gid,
-            'data_id': data_id
-        }
-    )
+    session.execute("""
+        INSERT INTO _bookbrainz.edition_data (
+            id, alias_set_id, identifier_set_id, relationship_set_id,
+            annotation_id, disambiguation_id, publication_bbid, width, height,
+            depth, weight, pages, format_id, status_id, language_set_id,
+            release_event_set_id, publisher_set_id
+        ) SELECT
+            n.id, COALESCE(s.alias_set_id, :empty_alias_set),
+            s.identifier_set_id, n.relationship_set_id, ed.annotation_id,
+            ed.disambiguation_id, d.publication_gid, d.width, d.height,
+            d.depth, d.weight, d.pages, d.edition_format_id,
+            d.edition_status_id, es.language_set_id, es.release_event_set_id,
+            es.publisher_set_id
+        FROM new_data n
+        JOIN entity_data_sets s ON s.entity_data_id = n.entity_data_id
+        JOIN edition_data_sets es ON es.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.entity_data ed ON ed.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.edition_data d ON d.entity_data_id = n.entity_data_id
+    """, {'empty_alias_set': empty_alias_set})
+
+
+def insert_work_data(session, empty_alias_set):
+    session.execute("""
+        CREATE TEMPORARY TABLE work_data_sets AS
+        SELECT
+            d.entity_data_id,
+            CASE WHEN EXISTS (
+                SELECT 1 FROM bookbrainz.work_data__language l
+                WHERE l.work_data_id = d.entity_data_id
+            ) THEN {} END AS language_set_id
+        FROM bookbrainz.work_data d
+        WHERE d.entity_data_id IN (SELECT entity_data_id FROM new_data)
+    """.format(next_id('language_set')))
 
+    session.execute("""
+        INSERT INTO _bookbrainz.language_set (
+            id
+        ) SELECT
+            language_set_id
+        FROM work_data_sets
+        WHERE language_set_id IS NOT NULL
+    """)
 
-def insert_publication_data_and_revision(session, entity, revision, data,
-                                         alias_set_id, identifier_set_id,
-                                         relationship_set_id):
-    if data is not None:
-        result = session.execute(
-            '''INSERT INTO _bookbrainz.publication_data (
-                alias_set_id, identifier_set_id, relationship_set_id,
-                annotation_id, disambiguation_id, type_id
-            ) VALUES (
-                :alias_set_id, :identifier_set_id, :relationship_set_id,
-                :annotation_id, :disambiguation_id, :type_id
-            ) RETURNING id''', {
-                'alias_set_id': alias_set_id,
-                'identifier_set_id': identifier_set_id,
-                'relationship_set_id': relationship_set_id,
-                'annotation_id': data.annotation_id,
-                'disambiguation_id': data.disambiguation_id,
-                'type_id': data.publication_type_id
-            }
-        )
-        data_id = result.fetchone()[0]
-    else:
-        data_id = None
+    session.execute("""
+        INSERT INTO _bookbrainz.language_set__language (
+            set_id, language_id
+        ) SELECT
+            s.language_set_id, l.language_id
+        FROM work_data_sets s
+        JOIN bookbrainz.work_data__language l
+            ON l.work_data_id = s.entity_data_id
+        WHERE s.language_set_id IS NOT NULL
+    """)
 
-    session.execute(
-        '''INSERT INTO _bookbrainz.publication_revision (
-            id, bbid, data_id
-        ) VALUES (
-            :id, :bbid, :data_id
-        )''', {
-            'id': revision.revision_id,
-            'bbid': entity.entity_gid,
-            'data_id': data_id
-        }
-    )
+    session.execute("""
+        INSERT INTO _bookbrainz.work_data (
+            id, alias_set_id, identifier_set_id, relationship_set_id,
+            annotation_id, disambiguation_id, type_id, language_set_id
+        ) SELECT
+            n.id, COALESCE(s.alias_set_id, :empty_alias_set),
+            s.identifier_set_id, n.relationship_set_id, ed.annotation_id,
+            ed.disambiguation_id, d.work_type_id, ws.language_set_id
+        FROM new_data n
+        JOIN entity_data_sets s ON s.entity_data_id = n.entity_data_id
+        JOIN work_data_sets ws ON ws.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.entity_data ed ON ed.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.work_data d ON d.entity_data_id = n.entity_data_id
+    """, {'empty_alias_set': empty_alias_set})
+
+
+def insert_publisher_data(session, empty_alias_set):
+    session.execute("""
+        INSERT INTO _bookbrainz.publisher_data (
+            id, alias_set_id, identifier_set_id, relationship_set_id,
+            annotation_id, disambiguation_id, begin_year, begin_month,
+            begin_day, end_year, end_month, end_day, ended, type_id
+        ) SELECT
+            n.id, COALESCE(s.alias_set_id, :empty_alias_set),
+            s.identifier_set_id, n.relationship_set_id, ed.annotation_id,
+            ed.disambiguation_id, {}, {}, d.ended, d.publisher_type_id
+        FROM new_data n
+        JOIN entity_data_sets s ON s.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.entity_data ed ON ed.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.publisher_data d ON d.entity_data_id = n.entity_data_id
+    """.format(date_columns('begin_date'), date_columns('end_date')),
+    {'empty_alias_set': empty_alias_set})
+
+
+def insert_publication_data(session, empty_alias_set):
+    session.execute("""
+        INSERT INTO _bookbrainz.publication_data (
+            id, alias_set_id, identifier_set_id, relationship_set_id,
+            annotation_id, disambiguation_id, type_id
+        ) SELECT
+            n.id, COALESCE(s.alias_set_id, :empty_alias_set),
+            s.identifier_set_id, n.relationship_set_id, ed.annotation_id,
+            ed.disambiguation_id, d.publication_type_id
+        FROM new_data n
+        JOIN entity_data_sets s ON s.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.entity_data ed ON ed.entity_data_id = n.entity_data_id
+        JOIN bookbrainz.publication_data d
+            ON d.entity_data_id = n.entity_data_id
+    """, {'empty_alias_set': empty_alias_set})
+
+
+INSERT_DATA = {
+    'Creator': insert_creator_data,
+    'Edition': insert_edition_data,
+    'Publication': insert_publication_data,
+    'Publisher': insert_publisher_data,
+    'Work': insert_work_data,
+}
 
 
 def migrate_entities(session):
@@ -560,15 +458,315 @@ def migrate_entities(session):
         WHERE _type = 'Work'
     """)
 
-def set_master_revision(session, bbid, entity_type, revision_id):
+
+def build_entity_history(session, gids):
+    """ Creates a temporary table with a row for each entity and relationship
+    revision in the history of each entity with one of the given BBIDs,
+    numbered in order of creation.
+
+    Each row records the entity data in the old schema which was current after
+    the revision. Relationship revisions which add a relationship the entity
+    doesn't already have are marked, and counted, so that the count
+    identifies the relationship set current after each revision.
+    """
+    session.execute("""
+        CREATE TEMPORARY TABLE entity_history AS
+        SELECT
+            h.*,
+            max(h.entity_data_id)
+                OVER (PARTITION BY h.bbid, h.data_group) AS current_data_id,
+            sum(CASE WHEN h.adds_relationship THEN 1 ELSE 0 END) OVER (
+                PARTITION BY h.bbid ORDER BY h.position
+            ) AS relationship_group,
+            NULL::integer AS relationship_set_id
+        FROM (
+            SELECT
+                r.*,
+                row_number() OVER w AS position,
+                sum(CASE WHEN r.relationship_id IS NULL THEN 1 ELSE 0 END)
+                    OVER w AS data_group,
+                r.relationship_id IS NOT NULL AND row_number() OVER (
+                    PARTITION BY r.bbid, r.relationship_id
+                    ORDER BY r.created_at, r.revision_id
+                ) = 1 AS adds_relationship
+            FROM (
+                SELECT
+                    e.entity_gid AS bbid, e._type::text AS type,
+                    r.revision_id, r.created_at, er.entity_data_id,
+                    NULL::integer AS relationship_id
+                FROM bookbrainz.entity_revision er
+                JOIN bookbrainz.revision r ON r.revision_id = er.revision_id
+                JOIN bookbrainz.entity e ON e.entity_gid = er.entity_gid
+                WHERE e.entity_gid = ANY(CAST(:gids AS UUID[]))
+                UNION ALL
+                SELECT DISTINCT
+                    e.entity_gid, e._type::text, r.revision_id, r.created_at,
+                    NULL::integer, rr.relationship_data_id
+                FROM bookbrainz.rel_revision rr
+                JOIN bookbrainz.revision r ON r.revision_id = rr.revision_id
+                JOIN bookbrainz.rel_entity re
+                    ON re.relationship_data_id = rr.relationship_data_id
+                JOIN bookbrainz.entity e ON e.entity_gid = re.entity_gid
+                WHERE e.entity_gid = ANY(CAST(:gids AS UUID[]))
+            ) r
+            WINDOW w AS (
+                PARTITION BY r.bbid
+                ORDER BY r.created_at, r.relationship_id IS NOT NULL,
+                    r.revision_id
+            )
+        ) h
+    """, {'gids': [str(gid) for gid in gids]})
+
+    session.execute(
+        'CREATE INDEX ON entity_history (bbid, relationship_group)'
+    )
+    session.execute('ANALYZE entity_history')
+
+
+def migrate_relationships(session):
+    """ Creates the relationships added by relationship revisions, with the
+    IDs of their relationship data in the old schema.
+    """
+    session.execute("""
+        INSERT INTO _bookbrainz.relationship (
+            id, type_id, source_bbid, target_bbid
+        ) SELECT
+            d.relationship_data_id, d.relationship_type_id,
+            source.entity_gid, target.entity_gid
+        FROM bookbrainz.rel_data d
+        JOIN bookbrainz.rel_entity source
+            ON source.relationship_data_id = d.relationship_data_id
+            AND source.position = 0
+        JOIN bookbrainz.rel_entity target
+            ON target.relationship_data_id = d.relationship_data_id
+            AND target.position = 1
+        WHERE d.relationship_data_id IN (
+            SELECT relationship_data_id FROM bookbrainz.rel_revision
+        )
+    """)
+
+
+def migrate_relationship_sets(session, empty_relationship_set):
+    """ Creates a relationship set for each revision in the history of each
+    entity which adds a relationship to it, containing every relationship
+    added to the entity up to that revision, and records the current set on
+    each revision. Other revisions share the set of the revision before them,
+    since their relationships are unchanged.
+    """
+    session.execute("""
+        UPDATE entity_history SET relationship_set_id = {}
+        WHERE adds_relationship
+    """.format(next_id('relationship_set')))
+
+    session.execute("""
+        INSERT INTO _bookbrainz.relationship_set (
+            id
+        ) SELECT
+            relationship_set_id
+        FROM entity_history
+        WHERE adds_relationship
+    """)
+
+    # Each relationship is only added once to each entity, so the members
+    # don't need to be deduplicated
+    session.execute("""
+        INSERT INTO _bookbrainz.relationship_set__relationship (
+            set_id, relationship_id
+        ) SELECT
+            h.relationship_set_id, p.relationship_id
+        FROM entity_history h
+        JOIN entity_history p
+            ON p.bbid = h.bbid
+            AND p.relationship_group <= h.relationship_group
+            AND p.adds_relationship
+        WHERE h.adds_relationship
+    """)
+
+    # The set of the latest revision adding a relationship, or the empty set
+    # if there hasn't been one
+    session.execute("""
+        UPDATE entity_history h SET relationship_set_id = COALESCE((
+            SELECT r.relationship_set_id
+            FROM entity_history r
+            WHERE r.bbid = h.bbid
+                AND r.relationship_group = h.relationship_group
+                AND r.adds_relationship
+        ), :empty_set_id)
+        WHERE NOT h.adds_relationship
+    """, {'empty_set_id': empty_relationship_set})
+
+
+def migrate_alias_and_identifier_sets(session):
+    """ Creates an alias set and an identifier set for each entity data in
+    the old schema with aliases or identifiers, to be shared by every
+    revision using that data.
+    """
+    session.execute("""
+        CREATE TEMPORARY TABLE entity_data_sets AS
+        SELECT
+            ed.entity_data_id,
+            CASE WHEN EXISTS (
+                SELECT 1 FROM bookbrainz.entity_data__alias a
+                WHERE a.entity_data_id = ed.entity_data_id
+            ) THEN {} END AS alias_set_id,
+            CASE WHEN EXISTS (
+                SELECT 1 FROM bookbrainz.entity_data__identifier i
+                WHERE i.entity_data_id = ed.entity_data_id
+            ) THEN {} END AS identifier_set_id
+        FROM bookbrainz.entity_data ed
+        WHERE ed.entity_data_id IN (
+            SELECT current_data_id FROM entity_history
+        )
+    """.format(next_id('alias_set'), next_id('identifier_set')))
+
+    session.execute("""
+        INSERT INTO _bookbrainz.alias_set (
+            id, default_alias_id
+        ) SELECT
+            s.alias_set_id, ed.default_alias_id
+        FROM entity_data_sets s
+        JOIN bookbrainz.entity_data ed ON ed.entity_data_id = s.entity_data_id
+        WHERE s.alias_set_id IS NOT NULL
+    """)
+
+    session.execute("""
+        INSERT INTO _bookbrainz.alias_set__alias (
+            set_id, alias_id
+        ) SELECT
+            s.alias_set_id, a.alias_id
+        FROM entity_data_sets s
+        JOIN bookbrainz.entity_data__alias a
+            ON a.entity_data_id = s.entity_data_id
+    """)
+
+    session.execute("""
+        INSERT INTO _bookbrainz.identifier_set (
+            id
+        ) SELECT
+            identifier_set_id
+        FROM entity_data_sets
+        WHERE identifier_set_id IS NOT NULL
+    """)
+
+    session.execute("""
+        INSERT INTO _bookbrainz.identifier_set__identifier (
+            set_id, identifier_id
+        ) SELECT
+            s.identifier_set_id, i.identifier_id
+        FROM entity_data_sets s
+        JOIN bookbrainz.entity_data__identifier i
+            ON i.entity_data_id = s.entity_data_id
+    """)
+
+
+def migrate_entity_revisions(session, entity_type, empty_alias_set):
+    """ Creates the data of each revision of entities of the given type, with
+    one data row for each distinct pair of old entity data and relationship
+    set, then the revisions themselves, and sets the master revisions.
+    """
     table = entity_type.lower()
+
+    session.execute("""
+        CREATE TEMPORARY TABLE new_data AS
+        SELECT
+            {} AS id, d.entity_data_id, d.relationship_set_id
+        FROM (
+            SELECT DISTINCT
+                current_data_id AS entity_data_id, relationship_set_id
+            FROM entity_history
+            WHERE type = :type AND current_data_id IS NOT NULL
+        ) d
+    """.format(next_id('{}_data'.format(table))), {'type': entity_type})
+
+    INSERT_DATA[entity_type](session, empty_alias_set)
+
+    session.execute("""
+        INSERT INTO _bookbrainz.{}_revision (
+            id, bbid, data_id
+        ) SELECT
+            h.revision_id, h.bbid, n.id
+        FROM entity_history h
+        LEFT JOIN new_data n
+            ON n.entity_data_id = h.current_data_id
+            AND n.relationship_set_id = h.relationship_set_id
+        WHERE h.type = :type
+    """.format(table), {'type': entity_type})
+
+    session.execute("""
+        UPDATE _bookbrainz.{}_header header
+        SET master_revision_id = h.revision_id
+        FROM (
+            SELECT DISTINCT ON (bbid)
+                bbid, revision_id
+            FROM entity_history
+            WHERE type = :type
+            ORDER BY bbid, position DESC
+        ) h
+        WHERE header.bbid = h.bbid
+    """.format(table), {'type': entity_type})
+
+    session.execute('DROP TABLE new_data')
+
+
+def migrate_revision_parents(session):
+    """ Makes each revision in the history of an entity a child of the
+    revision before it. Relationship revisions appear in the histories of
+    both related entities, so may have two parents, and may be linked to the
+    same parent by the batches of both entities, which can run concurrently.
+    """
+    # The links already made are skipped with NOT EXISTS, which could miss
+    # those being made by another batch, so batches take turns from here
+    # until they commit, which they do straight after this
     session.execute("""
-        UPDATE _bookbrainz.{}_header SET master_revision_id=:revision_id
-        WHERE bbid=:bbid
-    """.format(table),
-    {'revision_id': revision_id, 'bbid': bbid})
+        LOCK TABLE _bookbrainz.revision_parent IN SHARE ROW EXCLUSIVE MODE
+    """)
+
+    session.execute("""
+        INSERT INTO _bookbrainz.revision_parent (
+            parent_id, child_id
+        ) SELECT DISTINCT
+            h.parent_id, h.revision_id
+        FROM (
+            SELECT
+                lag(revision_id) OVER (
+                    PARTITION BY bbid ORDER BY position
+                ) AS parent_id,
+                revision_id
+            FROM entity_history
+        ) h
+        WHERE h.parent_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM _bookbrainz.revision_parent p
+            WHERE p.parent_id = h.parent_id AND p.child_id = h.revision_id
+        )
+    """)
+
+
+def migrate_entity_batch(session, gids, empty_alias_set,
+                         empty_relationship_set):
+    """ Migrates the history of the entities with the given BBIDs. The
+    history is built in a temporary table, from which the sets,
+    data and revisions of the new schema are made with a few statements for
+    each table, rather than a few for each revision.
+    """
+    build_entity_history(session, gids)
+    migrate_relationship_sets(session, empty_relationship_set)
+    migrate_alias_and_identifier_sets(session)
+
+    for entity_type in ENTITY_TYPES:
+        migrate_entity_revisions(session, entity_type, empty_alias_set)
+
+    migrate_revision_parents(session)
 
-def migrate_entity_data(session):
+    session.execute("""
+        DROP TABLE entity_history, entity_data_sets, edition_data_sets,
+            work_data_sets
+    """)
+
+
+def migrate_entity_values(session):
+    """ Migrates the rows which are referenced by entity data, but which
+    don't depend on the history of any entity.
+    """
     session.execute("""
         INSERT INTO _bookbrainz.annotation (
             id, content, last_revision_id
@@ -609,228 +807,176 @@ def migrate_entity_data(session):
         FROM bookbrainz.identifier
     """)
 
-    # For each entity, go through all the entity and relationship revisions
-    # Keep track of the aliases, identifiers and relationships on the
-    # entity at all times
-    # For each entity revision, create a new alias set, identifier_set and
-    # relationship set, using the tracked aliases, identifier and
-    # relationships
-    EMPTY_RELATIONSHIP_SET = session.execute(
+    migrate_relationships(session)
+
+
+def create_checkpoint_table(session):
+    session.execute("""
+        CREATE TABLE IF NOT EXISTS bookbrainz.v1_migration_checkpoint (
+            phase TEXT PRIMARY KEY,
+            completed_at TIMESTAMP,
+            last_entity_gid UUID,
+            empty_alias_set_id INTEGER,
+            empty_relationship_set_id INTEGER,
+            workers INTEGER
+        )
+    """)
+
+
+def load_checkpoints(session):
+    return {
+        checkpoint.phase: checkpoint for checkpoint in session.execute(
+            'SELECT * FROM bookbrainz.v1_migration_checkpoint'
+        )
+    }
+
+
+def complete_phase(session, phase):
+    updated = session.execute("""
+        UPDATE bookbrainz.v1_migration_checkpoint SET completed_at = now()
+        WHERE phase = :phase
+    """, {'phase': phase})
+    if updated.rowcount == 0:
+        session.execute("""
+            INSERT INTO bookbrainz.v1_migration_checkpoint (
+                phase, completed_at
+            ) VALUES (
+                :phase, now()
+            )
+        """, {'phase': phase})
+
+
+def report_progress(done, total, migrated, start_time):
+    rate = migrated / max(time.time() - start_time, 0.001)
+    if rate > 0:
+        eta = datetime.timedelta(seconds=int((total - done) / rate))
+    else:
+        eta = 'unknown'
+
+    print('Migrated {}/{} entities ({:.0f} entities/s, ETA {})'.format(
+        done, total, rate, eta
+    ))
+
+
+def start_entity_data(session, checkpoint, workers):
+    """ Creates the empty sets shared by the histories of all entities, and
+    records them in the checkpoint of the entity data phase, unless a
+    checkpoint is given. Returns the IDs of the empty alias and relationship
+    sets.
+    """
+    if checkpoint is not None:
+        if checkpoint.workers != workers:
+            raise click.UsageError(
+                'The migration was started with --workers {}, and must be '
+                'resumed with the same number'.format(checkpoint.workers)
+            )
+
+        return (checkpoint.empty_alias_set_id,
+                checkpoint.empty_relationship_set_id)
+
+    empty_relationship_set = session.execute(
         'INSERT INTO _bookbrainz.relationship_set DEFAULT VALUES RETURNING id'
     ).fetchone()[0]
 
-    EMPTY_ALIAS_SET = session.execute(
+    empty_alias_set = session.execute(
         'INSERT INTO _bookbrainz.alias_set DEFAULT VALUES RETURNING id'
     ).fetchone()[0]
 
-    entity_query = session.query(Entity)
-    processed_revisions = []
-    for entity in limit_query(entity_query, 100):
-        print(entity)
-        print('--------------')
-        entity_revision_query = session.query(EntityRevision).\
-            filter(EntityRevision.entity_gid == entity.entity_gid)
-        relationship_revision_query = session.query(RelationshipRevision).\
-            join(RelationshipData).\
-            join(RelationshipEntity).\
-            filter(RelationshipEntity.entity_gid == entity.entity_gid)
-
-        all_revisions = (
-            entity_revision_query.all() + relationship_revision_query.all()
+    session.execute("""
+        INSERT INTO bookbrainz.v1_migration_checkpoint (
+            phase, empty_alias_set_id, empty_relationship_set_id, workers
+        ) VALUES (
+            'entity_data', :empty_alias_set, :empty_relationship_set, :workers
         )
+    """, {
+        'empty_alias_set': empty_alias_set,
+        'empty_relationship_set': empty_relationship_set,
+        'workers': workers
+    })
+    session.commit()
 
-        all_revisions = sorted(all_revisions, key=lambda x: x.created_at)
-
-        relationship_set_id = EMPTY_RELATIONSHIP_SET
-        aliases = []
-        alias_set_id = EMPTY_ALIAS_SET
-        identifiers = []
-        identifier_set_id = None
-        data = None
-        previous_revision = None
-        for revision in all_revisions:
-            print('r{}'.format(revision.revision_id))
-            if isinstance(revision, EntityRevision):
-                if revision.entity_data is not None:
-                    aliases = revision.entity_data.aliases
-                    identifiers = revision.entity_data.identifiers
-                    default_alias = revision.entity_data.default_alias
-
-                    # Create alias set
-                    if aliases:
-                        result = session.execute('''
-                            INSERT INTO _bookbrainz.alias_set (
-                                default_alias_id
-                            ) VALUES (
-                                :default_id
-                            ) RETURNING id
-                        ''', {
-                            "default_id":
-                                default_alias.alias_id
-                                if default_alias is not None else None
-                        })
-                        alias_set_id = result.fetchone()[0]
-
-                        for alias in aliases:
-                            session.execute('''
-                                INSERT INTO _bookbrainz.alias_set__alias (
-                                    set_id, alias_id
-                                ) VALUES (
-                                    :set_id, :alias_id
-                                )
-                            ''', {
-                                "set_id": alias_set_id,
-                                "alias_id": alias.alias_id
-                            })
-                    else:
-                        alias_set_id = EMPTY_ALIAS_SET
-
-                    # Create identifier set
-                    if identifiers:
-                        EMPTY_IDENTIFIER_SET = session.execute(
-                            'INSERT INTO _bookbrainz.identifier_set DEFAULT VALUES RETURNING id'
-                        ).fetchone()[0]
-
-                        result = session.execute('''INSERT INTO _bookbrainz.identifier_set
-                            DEFAULT VALUES RETURNING id
-                        ''')
-                        identifier_set_id = result.fetchone()[0]
-
-                        # Add identifiers to set
-                        for identifier in identifiers:
-                            session.execute('''
-                                INSERT INTO
-                                _bookbrainz.identifier_set__identifier (
-                                    set_id, identifier_id
-                                ) VALUES (
-                                    :set_id, :identifier_id
-                                )
-                            ''', {
-                                "set_id": identifier_set_id,
-                                "identifier_id": identifier.identifier_id
-                            })
-
-                data = revision.entity_data
-            else:
-                # All relationship revisions add a relationship
-                rel_data = revision.relationship_data
-
-                # Create new relationship set
-                source = [e for e in rel_data.entities if e.position == 0][0]
-                target = [e for e in rel_data.entities if e.position == 1][0]
-
-                # Find or create relationship
-                result = session.execute(
-                    'SELECT id FROM _bookbrainz.relationship WHERE id = :id',
-                    {'id': rel_data.relationship_data_id}
-                ).fetchone()
-                if result is None:
-                    session.execute('''INSERT INTO _bookbrainz.relationship (
-                            id, type_id, source_bbid, target_bbid
-                        ) VALUES (
-                            :id, :type_id, :source_bbid, :target_bbid
-                        )
-                    ''', {
-                        "id": rel_data.relationship_data_id,
-                        "type_id": rel_data.relationship_type_id,
-                        "source_bbid": source.entity_gid,
-                        "target_bbid": target.entity_gid
-                    })
-
-                # Create relationship_set
-                result = session.execute('''
-                    INSERT INTO _bookbrainz.relationship_set
-                    DEFAULT VALUES RETURNING id
-                ''')
-                new_relationship_set_id = result.fetchone()[0]
-
-                # Link previous relationships to new relationship set
-                if relationship_set_id is not None:
-                    session.execute('''
-                        INSERT INTO
-                        _bookbrainz.relationship_set__relationship (
-                            set_id, relationship_id
-                        ) SELECT
-                            :new_set_id, relationship_id
-                        FROM _bookbrainz.relationship_set__relationship
-                        WHERE set_id = :set_id
-                    ''', {
-                        'set_id': relationship_set_id,
-                        'new_set_id': new_relationship_set_id
-                    })
-
-                # Add new relationship to the set
-                session.execute('''
-                    INSERT INTO _bookbrainz.relationship_set__relationship (
-                        set_id, relationship_id
-                    ) VALUES (
-                        :set_id, :relationship_id
-                    )
-                ''', {
-                    'set_id': new_relationship_set_id,
-                    'relationship_id': rel_data.relationship_data_id
-                })
-
-                # Set current relationship_set_id to the new one
-                relationship_set_id = new_relationship_set_id
-
-            # Create entity data
-            if isinstance(entity, Creator):
-                insert_creator_data_and_revision(
-                    session, entity, revision, data, alias_set_id,
-                    identifier_set_id, relationship_set_id
-                )
-                set_master_revision(session, entity.entity_gid, 'Creator',
-                                    revision.revision_id)
-            elif isinstance(entity, Edition):
-                insert_edition_data_and_revision(
-                    session, entity, revision, data, alias_set_id,
-                    identifier_set_id, relationship_set_id
-                )
-                set_master_revision(session, entity.entity_gid, 'Edition',
-                                    revision.revision_id)
-            elif isinstance(entity, Work):
-                insert_work_data_and_revision(
-                    session, entity, revision, data, alias_set_id,
-                    identifier_set_id, relationship_set_id
-                )
-                set_master_revision(session, entity.entity_gid, 'Work',
-                                    revision.revision_id)
-            elif isinstance(entity, Publisher):
-                insert_publisher_data_and_revision(
-                    session, entity, revision, data, alias_set_id,
-                    identifier_set_id, relationship_set_id
-                )
-                set_master_revision(session, entity.entity_gid, 'Publisher',
-                                    revision.revision_id)
-            elif isinstance(entity, Publication):
-                insert_publication_data_and_revision(
-                    session, entity, revision, data, alias_set_id,
-                    identifier_set_id, relationship_set_id
+    return empty_alias_set, empty_relationship_set
+
+
+def migrate_entity_data(session, worker, workers, empty_alias_set,
+                        empty_relationship_set):
+    """ Migrates the history of each entity in the partition of the given
+    worker, which is chosen by a hash of the BBID. Each batch of entities is
+    committed along with the BBID of the last entity in it, and the migration
+    continues from the entity after the checkpointed BBID.
+    """
+    phase = 'entity_data/{}'.format(worker)
+    checkpoint = load_checkpoints(session).get(phase)
+    if checkpoint is not None and checkpoint.completed_at is not None:
+        return
+
+    entity_query = session.query(Entity.entity_gid)
+    if workers > 1:
+        entity_query = entity_query.filter(text(
+            '(hashtext(bookbrainz.entity.entity_gid::text) & 2147483647) '
+            '% :workers = :worker'
+        )).params(workers=workers, worker=worker)
+
+    total = entity_query.count()
+    if checkpoint is None:
+        done = 0
+    else:
+        last_gid = checkpoint.last_entity_gid
+        done = entity_query.filter(Entity.entity_gid <= last_gid).count()
+        entity_query = entity_query.filter(Entity.entity_gid > last_gid)
+
+    start_time = time.time()
+    migrated = 0
+    for batch in query_batches(entity_query, ENTITY_BATCH_SIZE):
+        migrate_entity_batch(session, [row.entity_gid for row in batch],
+                             empty_alias_set, empty_relationship_set)
+
+        params = {'phase': phase, 'last_gid': str(batch[-1].entity_gid)}
+        updated = session.execute("""
+            UPDATE bookbrainz.v1_migration_checkpoint
+            SET last_entity_gid = :last_gid
+            WHERE phase = :phase
+        """, params)
+        if updated.rowcount == 0:
+            session.execute("""
+                INSERT INTO bookbrainz.v1_migration_checkpoint (
+                    phase, last_entity_gid
+                ) VALUES (
+                    :phase, :last_gid
                 )
-                set_master_revision(session, entity.entity_gid, 'Publication',
-                                    revision.revision_id)
-            else:
-                raise Exception('Err... what?')
-
-            pair = None
-            if previous_revision is not None:
-                pair = (previous_revision.revision_id, revision.revision_id)
-                if pair not in processed_revisions:
-                    session.execute('''
-                        INSERT INTO _bookbrainz.revision_parent (
-                            parent_id, child_id
-                        ) VALUES (
-                            :parent_id, :revision_id
-                        )
-                    ''', {
-                        'parent_id': previous_revision.revision_id,
-                        'revision_id': revision.revision_id
-                    })
-
-                    processed_revisions.append(pair)
-
-            previous_revision = revision
+            """, params)
+        session.commit()
+
+        done += len(batch)
+        migrated += len(batch)
+        if workers > 1:
+            print('Worker {}: '.format(worker), end='')
+        report_progress(done, total, migrated, start_time)
+
+    complete_phase(session, phase)
+    session.commit()
+
+
+def run_worker(connection_string, worker, workers, empty_alias_set,
+               empty_relationship_set):
+    engine = create_engine(connection_string)
+    Session = sessionmaker(bind=engine)
+
+    session = Session()
+    migrate_entity_data(session, worker, workers, empty_alias_set,
+                        empty_relationship_set)
+
+
+# The phases of the migration before entity data, in order. Each phase is
+# committed along with a checkpoint recording that it has been completed
+PHASES = [
+    ('types', migrate_types),
+    ('editors', migrate_editors),
+    ('revisions', migrate_revisions),
+    ('entities', migrate_entities),
+    ('entity_values', migrate_entity_values),
+]
+
 
 @click.command()
 @click.argument('username')
@@ -842,9 +988,23 @@ def migrate_entity_data(session):
               help='the hostname for the instance of PostgreSQL to connect to')
 @click.option('--port', default=5432,
               help='the port for the instance of PostgreSQL to connect to')
-def migrate(username, database, password, **kwargs):
+@click.option('--resume', is_flag=True,
+              help=('continue an interrupted migration from its last'
+                    ' checkpoint'))
+@click.option('--workers', default=1, type=click.IntRange(1),
+              help=('the number of processes migrating the history of'
+                    ' entities in parallel'))
+def migrate(username, database, password, resume, workers, **kwargs):
     """ Migrates the specified database from v0.x to v1.x, using the provided
     credentials and connections information.
+
+    The migration is committed in phases, with checkpoints recorded in
+    bookbrainz.v1_migration_checkpoint, so that an interrupted migration can be
+    continued with --resume.
+
+    With --workers, the entities are partitioned by a hash of their BBIDs, and
+    the history of each partition is migrated by a separate process with its
+    own connection.
     """
 
     connection_string =\
@@ -852,19 +1012,69 @@ def migrate(username, database, password, **kwargs):
             username, password, kwargs['host'], kwargs['port'], database
         )
 
-    engine = create_engine(connection_string, echo=True)
+    engine = create_engine(connection_string)
     Session = sessionmaker(bind=engine)
 
     session = Session()
 
     # Assume that the new schema exists in _bookbrainz
 
-    migrate_types(session)
-    migrate_editors(session)
-    migrate_revisions(session)
-    migrate_entities(session)
-    migrate_entity_data(session)
+    create_checkpoint_table(session)
+    session.commit()
+
+    checkpoints = load_checkpoints(session)
+    if checkpoints and not resume:
+        raise click.UsageError(
+            'A migration has already been started on this database, use '
+            '--resume to continue it'
+        )
+
+    for phase, function in PHASES:
+        if phase in checkpoints:
+            print('Skipping completed phase {}'.format(phase))
+            continue
+
+        print('Migrating {}...'.format(phase))
+        function(session)
+        complete_phase(session, phase)
+        session.commit()
+
+    checkpoint = checkpoints.get('entity_data')
+    if checkpoint is not None and checkpoint.completed_at is not None:
+        return
+
+    print('Migrating entity_data...')
+    empty_alias_set, empty_relationship_set =\
+        start_entity_data(session, checkpoint, workers)
+
+    if workers == 1:
+        migrate_entity_data(session, 0, 1, empty_alias_set,
+                            empty_relationship_set)
+    else:
+        session.close()
+        # The workers make their own connections, rather than sharing those
+        # of the pool with this process
+        engine.dispose()
+
+        processes = [
+            multiprocessing.Process(target=run_worker, args=(
+                connection_string, worker, workers, empty_alias_set,
+                empty_relationship_set
+            )) for worker in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        failed = [process for process in processes if process.exitcode != 0]
+        if failed:
+            raise click.ClickException(
+                '{} of {} workers failed, use --resume to continue the '
+                'migration'.format(len(failed), workers)
+            )
 
+    complete_phase(session, 'entity_data')
     session.commit()
 
 if __name__ == "__main__":